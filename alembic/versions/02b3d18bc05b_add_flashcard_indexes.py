@@ -0,0 +1,30 @@
+"""Add flashcard indexes
+
+Revision ID: 02b3d18bc05b
+Revises: a6e3c9e93ee3
+Create Date: 2026-10-18 10:02:11.734120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '02b3d18bc05b'
+down_revision: Union[str, None] = 'a6e3c9e93ee3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # set_id is the leading column, so this also serves lookups by set alone
+    op.create_index('ix_flashcards_set_id_exclude', 'flashcards', ['set_id', 'exclude'], unique=False)
+    op.create_index('ix_flashcards_course_name', 'flashcards', ['course_name'], unique=False)
+    op.execute('ANALYZE')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_flashcards_course_name', table_name='flashcards')
+    op.drop_index('ix_flashcards_set_id_exclude', table_name='flashcards')
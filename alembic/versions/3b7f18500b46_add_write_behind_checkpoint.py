@@ -0,0 +1,31 @@
+"""Add write behind checkpoint
+
+Revision ID: 3b7f18500b46
+Revises: b4973b0a7bde
+Create Date: 2026-10-18 20:12:37.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7f18500b46'
+down_revision: Union[str, None] = 'b4973b0a7bde'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('write_behind_checkpoint',
+    sa.Column('journal', sa.String(), nullable=False),
+    sa.Column('sequence', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.BigInteger(), nullable=True),
+    sa.PrimaryKeyConstraint('journal')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('write_behind_checkpoint')
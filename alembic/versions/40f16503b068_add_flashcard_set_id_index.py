@@ -0,0 +1,29 @@
+"""Add partial flashcard set_id index
+
+Revision ID: 40f16503b068
+Revises: 4aab281450cb
+Create Date: 2026-10-18 14:05:32.861930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '40f16503b068'
+down_revision: Union[str, None] = '4aab281450cb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # entries of the cards which aren't excluded, ordered by (set_id, id), so decks can be paged
+    # through a set without sorting. ix_flashcards_set_id_exclude is ordered by exclude first
+    op.create_index('ix_flashcards_set_id_included', 'flashcards', ['set_id'], unique=False,
+                    sqlite_where=sa.text('exclude IS NOT 1'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_flashcards_set_id_included', table_name='flashcards')
@@ -0,0 +1,38 @@
+"""Add notion sync
+
+Revision ID: 453958197293
+Revises: de75f8ae2ae8
+Create Date: 2026-10-18 16:40:27.361904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '453958197293'
+down_revision: Union[str, None] = 'de75f8ae2ae8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('flashcards', sa.Column('notion_page_id', sa.String(length=36), nullable=True))
+    op.create_index('ix_flashcards_notion_page_id', 'flashcards', ['notion_page_id'], unique=True)
+    op.create_table('notion_sync_state',
+    sa.Column('database_id', sa.String(length=36), nullable=False),
+    sa.Column('set_id', sa.Integer(), nullable=True),
+    sa.Column('last_edited_time', sa.String(), nullable=True),
+    sa.Column('synced_at', sa.BigInteger(), nullable=True),
+    sa.ForeignKeyConstraint(['set_id'], ['flashcard_sets.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('database_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('notion_sync_state')
+    op.drop_index('ix_flashcards_notion_page_id', table_name='flashcards')
+    # plain ALTER TABLE DROP COLUMN, so the full text search triggers survive
+    op.drop_column('flashcards', 'notion_page_id')
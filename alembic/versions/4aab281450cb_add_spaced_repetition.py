@@ -0,0 +1,51 @@
+"""Add spaced repetition
+
+Revision ID: 4aab281450cb
+Revises: 720c37b6e8ff
+Create Date: 2026-10-18 12:41:07.402816
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4aab281450cb'
+down_revision: Union[str, None] = '720c37b6e8ff'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('flashcards', sa.Column('ease', sa.Float(), server_default='2.5', nullable=True))
+    op.add_column('flashcards', sa.Column('interval', sa.Float(), server_default='0', nullable=True))
+    op.add_column('flashcards', sa.Column('repetitions', sa.Integer(), server_default='0', nullable=True))
+    op.add_column('flashcards', sa.Column('due', sa.BigInteger(), nullable=True))
+    op.create_index('ix_flashcards_set_id_due', 'flashcards', ['set_id', 'due'], unique=False)
+
+    op.create_table('review_log',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('card_id', sa.Integer(), nullable=True),
+    sa.Column('reviewed_at', sa.BigInteger(), nullable=True),
+    sa.Column('knew', sa.Boolean(), nullable=True),
+    sa.Column('ease', sa.Float(), nullable=True),
+    sa.Column('interval', sa.Float(), nullable=True),
+    sa.Column('due', sa.BigInteger(), nullable=True),
+    sa.ForeignKeyConstraint(['card_id'], ['flashcards.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_review_log_card_id'), 'review_log', ['card_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_review_log_card_id'), table_name='review_log')
+    op.drop_table('review_log')
+    op.drop_index('ix_flashcards_set_id_due', table_name='flashcards')
+    # plain ALTER TABLE DROP COLUMN (SQLite 3.35+). Batch mode would recreate the table and
+    # lose the full text search triggers
+    op.drop_column('flashcards', 'due')
+    op.drop_column('flashcards', 'repetitions')
+    op.drop_column('flashcards', 'interval')
+    op.drop_column('flashcards', 'ease')
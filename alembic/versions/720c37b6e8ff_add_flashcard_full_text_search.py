@@ -0,0 +1,54 @@
+"""Add flashcard full text search
+
+Revision ID: 720c37b6e8ff
+Revises: 02b3d18bc05b
+Create Date: 2026-10-18 11:20:53.119044
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '720c37b6e8ff'
+down_revision: Union[str, None] = '02b3d18bc05b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # external content table: the text is only stored once, in flashcards
+    op.execute("""
+        CREATE VIRTUAL TABLE flashcards_fts USING fts5(
+            term, definition,
+            content='flashcards', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    op.execute("""
+        CREATE TRIGGER flashcards_fts_insert AFTER INSERT ON flashcards BEGIN
+            INSERT INTO flashcards_fts(rowid, term, definition) VALUES (new.id, new.term, new.definition);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER flashcards_fts_delete AFTER DELETE ON flashcards BEGIN
+            INSERT INTO flashcards_fts(flashcards_fts, rowid, term, definition) VALUES ('delete', old.id, old.term, old.definition);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER flashcards_fts_update AFTER UPDATE OF term, definition ON flashcards BEGIN
+            INSERT INTO flashcards_fts(flashcards_fts, rowid, term, definition) VALUES ('delete', old.id, old.term, old.definition);
+            INSERT INTO flashcards_fts(rowid, term, definition) VALUES (new.id, new.term, new.definition);
+        END
+    """)
+    # index the cards which already exist
+    op.execute("INSERT INTO flashcards_fts(flashcards_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS flashcards_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS flashcards_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS flashcards_fts_insert")
+    op.execute("DROP TABLE IF EXISTS flashcards_fts")
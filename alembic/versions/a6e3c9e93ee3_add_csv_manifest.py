@@ -0,0 +1,34 @@
+"""Add csv manifest
+
+Revision ID: a6e3c9e93ee3
+Revises: 3e2cd043301b
+Create Date: 2026-10-18 09:12:40.518263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6e3c9e93ee3'
+down_revision: Union[str, None] = '3e2cd043301b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('csv_manifest',
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('mtime_ns', sa.BigInteger(), nullable=True),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('content_hash', sa.String(), nullable=True),
+    sa.Column('set_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['set_id'], ['flashcard_sets.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('path')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('csv_manifest')
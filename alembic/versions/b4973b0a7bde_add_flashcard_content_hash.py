@@ -0,0 +1,60 @@
+"""Add flashcard content hash
+
+Revision ID: b4973b0a7bde
+Revises: 453958197293
+Create Date: 2026-10-18 18:05:51.902417
+
+"""
+import hashlib
+from typing import Sequence, Union
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4973b0a7bde'
+down_revision: Union[str, None] = '453958197293'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+# a copy of database.dedupe.content_hash as it was when this migration was written, so that
+# later changes to it don't change what this migration does
+def content_hash(term, definition):
+    def normalize(value):
+        return ' '.join(unicodedata.normalize('NFKC', value or '').casefold().split())
+    content = f'{normalize(term)}\x1f{normalize(definition)}'
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def upgrade() -> None:
+    op.add_column('flashcards', sa.Column('content_hash', sa.String(length=32), nullable=True))
+
+    # hash the existing cards a batch at a time, walking the primary key
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.text("SELECT id, term, definition FROM flashcards WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {'last_id': last_id, 'limit': BACKFILL_BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            sa.text("UPDATE flashcards SET content_hash = :content_hash WHERE id = :card_id"),
+            [{'card_id': card_id, 'content_hash': content_hash(term, definition)} for card_id, term, definition in rows]
+        )
+        last_id = rows[-1][0]
+
+    # created after the backfill, which is much faster than keeping it up to date during it
+    op.create_index('ix_flashcards_content_hash', 'flashcards', ['content_hash', 'set_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_flashcards_content_hash', table_name='flashcards')
+    # plain ALTER TABLE DROP COLUMN, so the full text search triggers survive
+    op.drop_column('flashcards', 'content_hash')
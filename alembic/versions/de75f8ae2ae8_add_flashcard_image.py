@@ -0,0 +1,27 @@
+"""Add flashcard image
+
+Revision ID: de75f8ae2ae8
+Revises: 40f16503b068
+Create Date: 2026-10-18 15:12:08.417203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'de75f8ae2ae8'
+down_revision: Union[str, None] = '40f16503b068'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('flashcards', sa.Column('image_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    # plain ALTER TABLE DROP COLUMN, so the full text search triggers survive
+    op.drop_column('flashcards', 'image_hash')
@@ -0,0 +1,189 @@
+"""
+Measure how rendering audio packs scales with the number of workers, check that an
+interrupted render resumes without synthesizing anything twice, and time reading clips
+aloud from the packs.
+
+Synthesis is simulated by a backend which sleeps for --latency seconds per clip, like a
+network backend waiting on its server, so the results don't depend on the network. Reading
+aloud uses a backend which fails if it is called, so every clip has to come from a pack.
+A --duplicates share of the cards repeat another card, usually of another set, and each text
+should only be synthesized once however many sets it is in.
+
+Usage: python benchmarks/audio_pack_render.py [--sets 20] [--cards 1000] [--duplicates 0.1] [--workers 1 4 16] [--latency 0.01] [--json]
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from suite import summarize
+from synthetic import generate, root_path
+
+src_path_str = str(root_path / 'src')
+if src_path_str not in sys.path:
+    sys.path.insert(0, src_path_str)
+
+from audio_cache import AudioCache  # noqa: E402
+from audio_packs import AudioPack, AudioPackLibrary, render_sets  # noqa: E402
+from database.manager import DatabaseManager  # noqa: E402
+from text_to_speech import TextToSpeech  # noqa: E402
+
+
+class LatencyBackend:
+    """
+    Takes latency seconds to synthesize each clip
+    """
+    name = 'latency'
+    extension = '.wav'
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def synthesize(self, text, language, slow):
+        self.calls += 1
+        time.sleep(self.latency)
+        return text.encode()
+
+
+class OfflineBackend:
+    """
+    Stands in for LatencyBackend when the packs should have every clip
+    """
+    name = LatencyBackend.name
+    extension = LatencyBackend.extension
+
+    def synthesize(self, text, language, slow):
+        raise RuntimeError(f"{text!r} was synthesized instead of read from a pack")
+
+
+class Interrupted(Exception):
+    pass
+
+
+def render(manager, set_ids, directory, workers, latency, **options):
+    backend = LatencyBackend(latency)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        report = render_sets(manager, set_ids, directory=directory, workers=workers, backend=backend,
+                             cache=AudioCache(cache_dir), **options)
+    return report, backend.calls
+
+
+def check_resume(manager, set_ids, directory, workers, latency):
+    """
+    Interrupt a render half way through, resume it and return whether the two renders
+    synthesized every clip exactly once
+    """
+    clips = None
+
+    def interrupt(done, total):
+        nonlocal clips
+        clips = total
+        if done == total // 2:
+            raise Interrupted
+
+    start = time.perf_counter()
+    try:
+        render(manager, set_ids, directory, workers, latency, progress=interrupt)
+    except Interrupted:
+        pass
+    # a clip shared by several sets is added to all of their packs at once
+    first = len(set().union(*(AudioPack(path).index for path in Path(directory).glob('*.pack'))))
+    report, calls = render(manager, set_ids, directory, workers, latency)
+    return {
+        'seconds': time.perf_counter() - start,
+        'clips': clips,
+        'before_interrupt': first,
+        'after_resume': calls,
+        'resumed': first + calls == clips and report.failed == 0,
+    }
+
+
+def time_playback(manager, set_ids, directory):
+    """
+    Seconds taken to get the audio of each term and definition with nothing cached
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        engine = TextToSpeech(backend=OfflineBackend(), cache=AudioCache(cache_dir), packs=AudioPackLibrary(directory))
+        timings = []
+        for card in manager.get_cards(set_ids):
+            for text in (card.term, card.definition):
+                start = time.perf_counter()
+                engine.audio_path(text)
+                timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sets', type=int, default=20)
+    parser.add_argument('--cards', type=int, default=1000)
+    parser.add_argument('--duplicates', type=float, default=0.1, help="share of cards which repeat another card")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16], help="worker counts to render with")
+    parser.add_argument('--latency', type=float, default=0.01, help="seconds the simulated backend takes per clip")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {'render': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        database_path = directory / 'audio_packs.db'
+        generate(database_path, sets=args.sets, cards=args.cards, duplicate_ratio=args.duplicates)
+        manager = DatabaseManager(f"sqlite:///{database_path.resolve()}")
+        set_ids = [summary.id for summary in manager.get_set_summaries()]
+        distinct = len({text for card in manager.get_cards(set_ids) for text in (card.term, card.definition) if text and text.strip()})
+
+        for workers in args.workers:
+            pack_dir = directory / f'packs-{workers}'
+            report, _ = render(manager, set_ids, pack_dir, workers, args.latency)
+            # running again finds everything already rendered
+            again, calls = render(manager, set_ids, pack_dir, workers, args.latency)
+            results['render'][workers] = {
+                'seconds': report.seconds,
+                'clips': report.synthesized,
+                'added': sum(result.added for result in report.sets),
+                'distinct': distinct,
+                'failed': report.failed,
+                'rerun_seconds': again.seconds,
+                'rerun_synthesized': calls,
+            }
+
+        results['resume'] = check_resume(manager, set_ids, directory / 'packs-resume', max(args.workers), args.latency)
+        try:
+            results['playback'] = summarize(time_playback(manager, set_ids, directory / f'packs-{args.workers[0]}'))
+            results['playback']['offline'] = True
+        except RuntimeError as exception:
+            results['playback'] = {'offline': False, 'error': str(exception)}
+
+    baseline = results['render'][args.workers[0]]['seconds']
+    for result in results['render'].values():
+        result['speedup'] = baseline / result['seconds']
+    passed = (results['resume']['resumed'] and results['playback']['offline']
+              and all(not result['failed'] and not result['rerun_synthesized'] and result['clips'] == result['distinct']
+                      for result in results['render'].values()))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for workers, result in results['render'].items():
+            print(f"{workers} workers: {result['clips']} clips synthesized for {result['added']} in packs "
+                  f"({result['distinct']} distinct texts) in {result['seconds']:.2f}s ({result['speedup']:.1f}x), "
+                  f"run again in {result['rerun_seconds'] * 1000:.0f}ms with {result['rerun_synthesized']} synthesized")
+        resume = results['resume']
+        print(f"interrupted after {resume['before_interrupt']} of {resume['clips']} clips, resuming synthesized "
+              f"{resume['after_resume']}: {'OK' if resume['resumed'] else 'FAILED'}")
+        playback = results['playback']
+        if playback['offline']:
+            print(f"reading aloud from packs: median {playback['median'] * 1000:.3f}ms, p95 {playback['p95'] * 1000:.3f}ms, "
+                  f"max {playback['max'] * 1000:.3f}ms per clip, nothing synthesized")
+        else:
+            print(f"reading aloud from packs FAILED: {playback['error']}")
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
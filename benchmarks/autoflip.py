@@ -0,0 +1,90 @@
+"""
+Check that hands-free sessions keep their pace: run a long autoflip session through
+StudySession on a simulated clock and measure how far behind schedule it ends up and how
+late each autoflip is.
+
+Each autoflip is woken up to --lag seconds after it is due, as Tk's event loop can be, and
+then takes up to --draw seconds to draw the card. Timers which restart from whenever the
+previous autoflip ran, as autoflip used to, fall behind by the lag of every autoflip. The
+deadline stream of StudySession.run_autoflip should not fall behind at all.
+
+Usage: python benchmarks/autoflip.py [--autoflips 2000] [--interval 5] [--lag 0.01] [--draw 0.03] [--json]
+"""
+
+import argparse
+import json
+import random
+import sys
+from types import SimpleNamespace
+
+from synthetic import root_path
+
+src_path_str = str(root_path / 'src')
+if src_path_str not in sys.path:
+    sys.path.insert(0, src_path_str)
+
+from session import StudySession  # noqa: E402
+
+
+def simulate(autoflips, interval, lag, draw, restart, seed=0):
+    """
+    Run autoflips autoflips and return the session and how many seconds they took.
+    restart=True restarts the interval from each autoflip instead of following deadlines.
+    """
+    rng = random.Random(seed)
+    now = 0.0
+    cards = [SimpleNamespace(id=i, term=f'term {i}', definition=f'definition {i}') for i in range(autoflips // 2 + 2)]
+    session = StudySession(cards, autoflip=True, autoflip_interval=interval, clock=lambda: now)
+    session.next()
+    start = now
+    for _ in range(autoflips):
+        now += session.time_until_autoflip() + rng.uniform(0, lag)
+        if restart and session.autoflip_action() == 'flip':
+            session.flip()
+        elif restart:
+            session.next()
+        else:
+            session.run_autoflip()
+        now += rng.uniform(0, draw)
+    return session, now - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--autoflips', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=5, help="seconds between autoflips")
+    parser.add_argument('--lag', type=float, default=0.01, help="most seconds the event loop wakes up late by")
+    parser.add_argument('--draw', type=float, default=0.03, help="most seconds drawing a card takes")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for mode, restart in (('restarting timers', True), ('deadline stream', False)):
+        session, seconds = simulate(args.autoflips, args.interval, args.lag, args.draw, restart)
+        expected = args.autoflips * args.interval
+        results[mode] = {
+            'seconds': seconds,
+            'behind_seconds': seconds - expected,
+            'behind_per_hour': (seconds - expected) / expected * 3600,
+        }
+        if not restart:
+            results[mode].update(session.autoflip_jitter()._asdict())
+
+    stream = results['deadline stream']
+    # the only delay left is the lag and drawing of the last autoflip
+    passed = stream['behind_seconds'] <= args.lag + args.draw
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for mode, result in results.items():
+            print(f"{mode}: {args.autoflips} autoflips {result['behind_seconds']:.3f}s behind schedule "
+                  f"({result['behind_per_hour']:.2f}s per hour)")
+        print(f"deadline stream lateness: median {stream['median'] * 1000:.2f}ms, p95 {stream['p95'] * 1000:.2f}ms, "
+              f"max {stream['max'] * 1000:.2f}ms")
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
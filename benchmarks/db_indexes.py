@@ -0,0 +1,103 @@
+"""
+Time the hot flashcard queries on a synthetic database before and after the migration which
+adds the flashcard indexes.
+
+Usage: python benchmarks/db_indexes.py [--sets 10000] [--cards 1000000] [--json]
+"""
+
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic import generate, upgrade_schema
+
+REVISION_BEFORE = 'a6e3c9e93ee3'
+REVISION_AFTER = '02b3d18bc05b'
+
+# the statements DatabaseManager issues, written out so they can be timed on their own
+QUERIES = {
+    'cards of a set': (
+        'SELECT id, term, definition FROM flashcards WHERE set_id = ? AND exclude IS NOT 1 ORDER BY set_id, id',
+        'set_id'
+    ),
+    'excluded cards in a set': (
+        'SELECT count(*) FROM flashcards WHERE set_id = ? AND exclude = 1',
+        'set_id'
+    ),
+    'cards of a course': (
+        'SELECT count(*) FROM flashcards WHERE course_name = ?',
+        'course'
+    ),
+    'set summaries': (
+        'SELECT flashcard_sets.id, flashcard_sets.name, count(flashcards.id), '
+        'coalesce(sum(CASE WHEN flashcards.exclude IS 1 THEN 1 ELSE 0 END), 0) '
+        'FROM flashcard_sets LEFT OUTER JOIN flashcards ON flashcards.set_id = flashcard_sets.id '
+        'GROUP BY flashcard_sets.id ORDER BY flashcard_sets.name',
+        None
+    ),
+}
+
+
+def time_queries(database_path, sets, courses, repeats, seed=0):
+    """
+    Median time in seconds of each query, with random parameters
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(database_path)
+    results = {}
+    for name, (sql, parameter) in QUERIES.items():
+        timings = []
+        # whole-table queries are slow without indexes, so run them fewer times
+        for _ in range(repeats if parameter else max(1, repeats // 10)):
+            if parameter == 'set_id':
+                parameters = (rng.randint(1, sets),)
+            elif parameter == 'course':
+                parameters = (f"course {rng.randrange(courses)}",)
+            else:
+                parameters = ()
+            start = time.perf_counter()
+            connection.execute(sql, parameters).fetchall()
+            timings.append(time.perf_counter() - start)
+        results[name] = statistics.median(timings)
+    connection.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sets', type=int, default=10_000)
+    parser.add_argument('--cards', type=int, default=1_000_000)
+    parser.add_argument('--courses', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = Path(directory) / 'benchmark.db'
+        generate(database_path, sets=args.sets, cards=args.cards, courses=args.courses, revision=REVISION_BEFORE)
+        before = time_queries(database_path, args.sets, args.courses, args.repeats)
+
+        start = time.perf_counter()
+        upgrade_schema(database_path, REVISION_AFTER)
+        migration_time = time.perf_counter() - start
+        after = time_queries(database_path, args.sets, args.courses, args.repeats)
+
+    if args.json:
+        print(json.dumps({'cards': args.cards, 'sets': args.sets, 'migration_seconds': migration_time,
+                          'before': before, 'after': after}, indent=2))
+        return
+
+    print(f"{args.cards} cards in {args.sets} sets. Migration took {migration_time:.2f}s")
+    print(f"{'query':<26}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for name in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float('inf')
+        print(f"{name:<26}{before[name] * 1000:>14.3f}{after[name] * 1000:>14.3f}{speedup:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Report how long the app and the terminal study mode take to start, and which imports the
+time goes to, so that cold start can be kept under a budget.
+
+Each run is a fresh interpreter:
+- app: imports what main.pyw imports, upgrades the database if needed and loads the set
+  summaries, i.e. everything before the window is drawn
+- study: the same for study.py
+
+The modules which are meant to be loaded only on first use (PIL, pygame, gTTS, Alembic) are
+reported if a start up loads them anyway.
+
+Usage: python benchmarks/import_time.py [--repeats 5] [--budget-ms 900] [--top 15] [--json]
+
+Exits with status 1 if the median cold start of the app is over the budget.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic import generate, root_path
+
+src_path = root_path / 'src'
+
+DEFAULT_BUDGET_MS = 900
+
+# modules which should only be imported once they are used
+LAZY_MODULES = ('PIL', 'pygame', 'gtts', 'alembic')
+
+STARTUP_SCRIPTS = {
+    'app': (
+        "import tkinter\n"
+        "import window\n"
+        "from database.manager import DatabaseManager\n"
+        "manager = DatabaseManager({database_url!r})\n"
+        "manager.ensure_db_upgraded()\n"
+        "manager.get_set_summaries()\n"
+    ),
+    'study': (
+        "import study\n"
+        "from database.manager import DatabaseManager\n"
+        "manager = DatabaseManager({database_url!r})\n"
+        "manager.ensure_db_upgraded()\n"
+        "manager.get_set_summaries()\n"
+    ),
+}
+
+
+def run_startup(script, importtime=False):
+    """
+    Run script in a new interpreter from the src folder. Returns the wall time of the whole
+    process in seconds and what it wrote to stderr.
+    """
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', script]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=src_path, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"start up failed:\n{result.stderr}")
+    return seconds, result.stderr
+
+
+def parse_importtime(output):
+    """
+    (module, self µs, cumulative µs, depth) for each line of -X importtime output
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def report_startup(name, script, repeats, top):
+    timings = [run_startup(script)[0] for _ in range(repeats)]
+    _, output = run_startup(script, importtime=True)
+    modules = parse_importtime(output)
+    loaded = {module for module, *_ in modules}
+    top_level = sorted((module for module in modules if module[3] == 0), key=lambda module: module[2], reverse=True)
+
+    return {
+        'name': name,
+        'median_seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'import_seconds': sum(module[2] for module in modules if module[3] == 0) / 1e6,
+        'unexpected_imports': [module for module in LAZY_MODULES if module in loaded],
+        'slowest_imports': [{'module': module, 'cumulative_ms': cumulative / 1000, 'self_ms': self_us / 1000}
+                            for module, self_us, cumulative, _ in top_level[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help="most the app may take to start")
+    parser.add_argument('--top', type=int, default=15, help="number of slowest top level imports to list")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = generate(Path(directory) / 'startup.db', sets=100, cards=10_000)
+        database_url = f"sqlite:///{database_path.resolve()}"
+        reports = [report_startup(name, script.format(database_url=database_url), args.repeats, args.top)
+                   for name, script in STARTUP_SCRIPTS.items()]
+
+    app = reports[0]
+    over_budget = app['median_seconds'] * 1000 > args.budget_ms
+
+    if args.json:
+        print(json.dumps({'budget_ms': args.budget_ms, 'over_budget': over_budget, 'reports': reports}, indent=2))
+    else:
+        for report in reports:
+            print(f"\n{report['name']}: {report['median_seconds'] * 1000:.0f} ms to start (median of {args.repeats}), "
+                  f"{report['import_seconds'] * 1000:.0f} ms of it importing")
+            if report['unexpected_imports']:
+                print(f"  loaded at start up although only needed later: {', '.join(report['unexpected_imports'])}")
+            print(f"  {'module':<40}{'cumulative (ms)':>17}{'self (ms)':>11}")
+            for module in report['slowest_imports']:
+                print(f"  {module['module']:<40}{module['cumulative_ms']:>17.1f}{module['self_ms']:>11.1f}")
+        print(f"\napp start up {'is OVER' if over_budget else 'is within'} the budget of {args.budget_ms:.0f} ms")
+
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
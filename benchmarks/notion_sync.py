@@ -0,0 +1,329 @@
+"""
+Time the Notion sync against a local mock of the Notion API, so that it can be measured
+and checked without an account or the real rate limit.
+
+The mock serves one database of --pages pages, implements the query endpoint's cursors and
+last_edited_time filters, and can refuse a share of requests with 429 or 503 to exercise
+the retries. Each response is held back by --latency seconds to stand in for the round trip
+to Notion, which is what querying concurrently hides. It runs in its own process so that
+serving doesn't compete with the sync for the GIL. Five syncs are timed: the first (full)
+sync, an incremental sync after --edits pages were edited and one was deleted, a full sync
+which removes the deleted page's card, and an incremental and a full sync with nothing
+edited. The resulting cards are checked against the mock after each one, and each sync is
+checked for what it should have done:
+
+- the incremental sync only fetches the pages edited since the first sync
+- the full sync deletes the card of the deleted page
+- syncing again with nothing edited leaves the database as it was
+- the mock refuses the first requests of the repeated incremental sync with 429 and a
+  Retry-After of --retry-after seconds, which the sync waits out before retrying
+
+Usage: python benchmarks/notion_sync.py [--pages 50000] [--edits 500] [--latency 0.05] [--failure-rate 0.02]
+                                        [--refuse 2] [--retry-after 0.5] [--concurrency 8] [--json]
+"""
+
+import argparse
+import asyncio
+import bisect
+from datetime import datetime, timedelta, timezone
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+import urllib.request
+
+from aiohttp import web
+
+from synthetic import random_text, root_path, upgrade_schema
+
+src_path_str = str(root_path / 'src')
+if src_path_str not in sys.path:
+    sys.path.insert(0, src_path_str)
+
+from database.manager import DatabaseManager  # noqa: E402
+from database.notion_sync import format_time, parse_time  # noqa: E402
+
+DATABASE_ID = '8c5a1f1e-2b3c-4d5e-9f60-718293a4b5c6'
+
+
+class MockNotion:
+    """
+    In-memory Notion database served over HTTP
+    """
+
+    def __init__(self, pages, latency=0.0, failure_rate=0.0, seed=0):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.refuse = 0  # requests still to refuse with 429 whatever the failure rate
+        self.retry_after = 0.0
+        self.refused_at = None  # when the last of those was refused
+        self.retry_wait = None  # seconds from then until the next request
+        self.created = datetime(2021, 7, 27, tzinfo=timezone.utc)
+        self.pages = {}
+        self.edited = {}  # page id -> last_edited_time as a datetime
+        self._matching = {}  # filter -> sorted ids of the pages it matches
+        # edits are skewed towards recent times, as in a database which is still in use
+        minutes = int((datetime.now(timezone.utc) - self.created).total_seconds() // 60)
+        for i in range(pages):
+            edited = self.created + timedelta(minutes=int(minutes * self.rng.random() ** 0.5))
+            self.add_page(f'{i:08x}-0000-4000-8000-000000000000', random_text(self.rng, 1, 6), random_text(self.rng, 2, 20),
+                          i % 10 == 0, edited)
+
+    def add_page(self, page_id, term, definition, exclude, edited):
+        self.edited[page_id] = edited
+        self.pages[page_id] = {
+            'object': 'page',
+            'id': page_id,
+            'last_edited_time': format_time(edited),
+            'archived': False,
+            'properties': {
+                'Term': {'type': 'title', 'title': [{'plain_text': term}]},
+                'Definition': {'type': 'rich_text', 'rich_text': [{'plain_text': definition}]},
+                'Exclude': {'type': 'checkbox', 'checkbox': exclude},
+            },
+        }
+
+    def edit(self, count):
+        """
+        Change the definition of count pages and delete one, as if edited now. Returns how
+        many pages an incremental sync from the latest edit before then should fetch
+        """
+        now = datetime.now(timezone.utc)
+        latest = max(self.edited[page_id] for page_id in self.pages)
+        page_ids = self.rng.sample(sorted(self.pages), count + 1)
+        for page_id in page_ids[:-1]:
+            page = self.pages[page_id]
+            page['properties']['Definition']['rich_text'][0]['plain_text'] = random_text(self.rng, 2, 20)
+            page['last_edited_time'] = format_time(now)
+            self.edited[page_id] = now
+        del self.pages[page_ids[-1]]
+        self._matching.clear()
+        return sum(1 for page_id in self.pages if self.edited[page_id] >= latest)
+
+    def expected_cards(self):
+        return {page_id: (page['properties']['Term']['title'][0]['plain_text'],
+                          page['properties']['Definition']['rich_text'][0]['plain_text'],
+                          page['properties']['Exclude']['checkbox'])
+                for page_id, page in self.pages.items()}
+
+    async def respond(self):
+        """
+        Wait out the latency, then return an error response if this request is to fail
+        """
+        if self.refused_at is not None and not self.refuse:
+            self.retry_wait = time.monotonic() - self.refused_at
+            self.refused_at = None
+        await asyncio.sleep(self.latency)
+        self.requests += 1
+        if self.refuse:
+            self.refuse -= 1
+            self.failures += 1
+            self.refused_at = time.monotonic()
+            return web.json_response({'object': 'error', 'code': 'rate_limited'}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        if self.rng.random() < self.failure_rate:
+            self.failures += 1
+            if self.rng.random() < 0.5:
+                return web.json_response({'object': 'error', 'code': 'rate_limited'}, status=429, headers={'Retry-After': '0.05'})
+            return web.json_response({'object': 'error', 'code': 'service_unavailable'}, status=503)
+        return None
+
+    async def get_database(self, request):
+        return await self.respond() or web.json_response({
+            'object': 'database',
+            'id': request.match_info['database_id'],
+            'created_time': format_time(self.created),
+            'title': [{'plain_text': 'Notion flashcards'}],
+        })
+
+    def matching_ids(self, condition):
+        """
+        Sorted ids of the pages within the last_edited_time bounds of a query's filter
+        """
+        low = high = None
+        for part in (condition.get('and', [condition]) if condition else []):
+            bounds = part['last_edited_time']
+            if 'on_or_after' in bounds:
+                low = parse_time(bounds['on_or_after'])
+            if 'before' in bounds:
+                high = parse_time(bounds['before'])
+        return sorted(page_id for page_id, edited in self.edited.items()
+                      if page_id in self.pages and (low is None or edited >= low) and (high is None or edited < high))
+
+    async def query_database(self, request):
+        failure = await self.respond()
+        if failure:
+            return failure
+        body = await request.json()
+        condition = body.get('filter')
+        key = json.dumps(condition, sort_keys=True)
+        page_ids = self._matching.get(key)
+        if page_ids is None:
+            page_ids = self._matching[key] = self.matching_ids(condition)
+        # real cursors are opaque. Here they are the id of the next page, in id order
+        start = bisect.bisect_left(page_ids, body['start_cursor']) if body.get('start_cursor') else 0
+        end = start + body.get('page_size', 100)
+        return web.json_response({
+            'object': 'list',
+            'results': [self.pages[page_id] for page_id in page_ids[start:end]],
+            'has_more': end < len(page_ids),
+            'next_cursor': page_ids[end] if end < len(page_ids) else None,
+        })
+
+    # endpoints for the benchmark to control the mock with
+
+    async def edit_pages(self, request):
+        return web.json_response({'edited_since': self.edit((await request.json())['count'])})
+
+    async def refuse_requests(self, request):
+        body = await request.json()
+        self.refuse = body['count']
+        self.retry_after = body['retry_after']
+        self.retry_wait = None
+        return web.json_response({})
+
+    async def get_state(self, request):
+        return web.json_response({'requests': self.requests, 'failures': self.failures, 'retry_wait': self.retry_wait,
+                                  'cards': self.expected_cards()})
+
+    def serve(self, ports):
+        """
+        Serve until the process is stopped, putting the port on the ports queue once listening
+        """
+        app = web.Application()
+        app.router.add_get('/v1/databases/{database_id}', self.get_database)
+        app.router.add_post('/v1/databases/{database_id}/query', self.query_database)
+        app.router.add_post('/mock/edit', self.edit_pages)
+        app.router.add_post('/mock/refuse', self.refuse_requests)
+        app.router.add_get('/mock/state', self.get_state)
+
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(app, access_log=None)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        loop.run_until_complete(site.start())
+        ports.put(site._server.sockets[0].getsockname()[1])
+        loop.run_forever()
+
+
+def run_mock(pages, latency, failure_rate, ports):
+    MockNotion(pages, latency, failure_rate).serve(ports)
+
+
+def mock_request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def synced_cards(manager):
+    with manager.engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "SELECT notion_page_id, term, definition, exclude FROM flashcards WHERE notion_page_id IS NOT NULL"
+        ).all()
+    return {page_id: (term, definition, bool(exclude)) for page_id, term, definition, exclude in rows}
+
+
+def snapshot(manager):
+    """
+    Every row of the flashcard tables, to tell whether a sync changed anything
+    """
+    with manager.engine.connect() as connection:
+        return [connection.exec_driver_sql(f"SELECT * FROM {table} ORDER BY id").all() for table in ('flashcard_sets', 'flashcards')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=50_000)
+    parser.add_argument('--edits', type=int, default=500, help="pages edited before the incremental sync")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds the mock takes to respond")
+    parser.add_argument('--failure-rate', type=float, default=0.02, help="share of requests refused with 429 or 503")
+    parser.add_argument('--refuse', type=int, default=2, help="requests refused in a row before the repeated incremental sync")
+    parser.add_argument('--retry-after', type=float, default=0.5, help="Retry-After of those refusals, in seconds")
+    parser.add_argument('--rate', type=float, default=1000, help="requests per second allowed by the sync")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_mock, args=(args.pages, args.latency, args.failure_rate, ports), daemon=True)
+    server.start()
+    mock_url = f'http://127.0.0.1:{ports.get()}'
+    base_url = f'{mock_url}/v1'
+    options = {'base_url': base_url, 'rate': args.rate, 'burst': args.concurrency, 'concurrency': args.concurrency}
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = Path(directory) / 'notion.db'
+        upgrade_schema(database_path)
+        manager = DatabaseManager(f"sqlite:///{database_path.resolve()}")
+
+        syncs = (('first sync', False), ('incremental sync', False), ('full sync', True),
+                 ('repeated incremental sync', False), ('repeated full sync', True))
+        for name, full in syncs:
+            edited_since = None
+            if name == 'incremental sync':
+                edited_since = mock_request(f'{mock_url}/mock/edit', {'count': args.edits})['edited_since']
+            if name == 'repeated incremental sync':
+                mock_request(f'{mock_url}/mock/refuse', {'count': args.refuse, 'retry_after': args.retry_after})
+            rows = snapshot(manager)
+            before = mock_request(f'{mock_url}/mock/state')
+            report = manager.sync_notion('secret_benchmark', [DATABASE_ID], full=full, **options)
+            cards = synced_cards(manager)
+            after = mock_request(f'{mock_url}/mock/state')
+            expected = {page_id: tuple(card) for page_id, card in after['cards'].items()}
+            # the incremental sync can't see the deleted page, so its card is only gone after the full sync
+            correct = cards == expected if name != 'incremental sync' else \
+                all(cards.get(page_id) == card for page_id, card in expected.items())
+            result = report.databases[0]
+
+            checks = {}
+            if name == 'incremental sync':
+                checks['only fetched the edited pages'] = not result.full and result.pages == edited_since
+            if name == 'full sync':
+                checks['deleted the removed page'] = result.full and result.cards_deleted == 1
+            if name.startswith('repeated'):
+                checks['left the database unchanged'] = (snapshot(manager) == rows and result.cards_inserted
+                                                         == result.cards_updated == result.cards_deleted == 0)
+            if name == 'repeated incremental sync':
+                checks['waited out Retry-After'] = (after['failures'] - before['failures'] >= args.refuse
+                                                    and after['retry_wait'] is not None and after['retry_wait'] >= args.retry_after)
+            results.append({
+                'sync': name,
+                'seconds': report.seconds,
+                'pages_fetched': result.pages,
+                'pages_per_second': result.pages / report.seconds if report.seconds else None,
+                'requests': after['requests'] - before['requests'],
+                'failed_requests': after['failures'] - before['failures'],
+                'inserted': result.cards_inserted,
+                'updated': result.cards_updated,
+                'deleted': result.cards_deleted,
+                'correct': correct,
+                'checks': checks,
+            })
+
+    server.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['sync']}: {result['seconds']:.2f}s, {result['pages_fetched']} pages fetched using {result['requests']} "
+                  f"requests ({result['failed_requests']} refused), {result['inserted']} cards added, {result['updated']} "
+                  f"updated, {result['deleted']} deleted. {'matches' if result['correct'] else 'DOES NOT MATCH'} the mock")
+            for check, passed in result['checks'].items():
+                print(f"    {check}: {'OK' if passed else 'FAILED'}")
+
+    if not all(result['correct'] and all(result['checks'].values()) for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
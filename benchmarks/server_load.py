@@ -0,0 +1,184 @@
+"""
+Load test the study API server (src/server.py) with many simulated study clients.
+
+Each client lists the sets, revalidating the listing with its ETag after the first time,
+then studies decks of one to three random sets in random order: it reads the deck a page
+at a time, answers every card, sending the answers in batches, and fetches the audio of
+some of the cards.
+
+By default a server is started in a separate process, so that it doesn't compete with the
+clients for the GIL, on a synthetic database of --sets sets and --cards cards, with the
+silent null text to speech backend. Use --url to load test a server which is already
+running instead.
+
+Usage: python benchmarks/server_load.py [--clients 50] [--duration 20] [--sets 200] [--cards 50000] [--json]
+       python benchmarks/server_load.py --url http://127.0.0.1:8080 [--clients 50] [--duration 20]
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from synthetic import generate, root_path
+
+src_path_str = str(root_path / 'src')
+if src_path_str not in sys.path:
+    sys.path.insert(0, src_path_str)
+
+ANSWER_BATCH_SIZE = 20  # answers a client sends at once
+AUDIO_RATIO = 0.05  # share of cards whose audio is fetched
+PAGES_PER_DECK = 3  # pages studied before a client moves on to another deck
+
+
+def run_server(database_path, audio_cache_dir, ports):
+    """
+    Serve the database until the process is stopped, putting the port on the ports queue
+    once listening
+    """
+    from audio_cache import AudioCache
+    from database.manager import DatabaseManager
+    from server import create_app
+
+    manager = DatabaseManager(f"sqlite:///{Path(database_path).resolve()}")
+    app = create_app(manager, tts_backend='null', audio_cache=AudioCache(audio_cache_dir))
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    ports.put(site._server.sockets[0].getsockname()[1])
+    loop.run_forever()
+
+
+class Results:
+    def __init__(self):
+        self.timings = defaultdict(list)  # endpoint -> seconds taken by each request
+        self.statuses = defaultdict(lambda: defaultdict(int))  # endpoint -> status -> requests
+
+    async def request(self, session, endpoint, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            body, status = None, 'error'
+        self.timings[endpoint].append(time.perf_counter() - start)
+        self.statuses[endpoint][status] += 1
+        return status, body, response.headers if body is not None else {}
+
+    def summary(self, seconds):
+        endpoints = {}
+        for endpoint, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            endpoints[endpoint] = {
+                'requests': len(timings),
+                'statuses': {str(status): requests for status, requests in sorted(self.statuses[endpoint].items(), key=str)},
+                'p50': timings[len(timings) // 2],
+                'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+                'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+                'max': timings[-1],
+            }
+        requests = sum(len(timings) for timings in self.timings.values())
+        failed = sum(requests for statuses in self.statuses.values() for status, requests in statuses.items()
+                     if status == 'error' or status >= 400)
+        return {'seconds': seconds, 'requests': requests, 'requests_per_second': requests / seconds, 'failed': failed,
+                'endpoints': endpoints}
+
+
+async def study_client(url, deadline, results, rng):
+    etag = None
+    set_ids = []
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            headers = {'If-None-Match': etag} if etag else {}
+            status, body, response_headers = await results.request(session, 'GET /sets', 'GET', f'{url}/sets', headers=headers)
+            if status == 200:
+                etag = response_headers.get('ETag')
+                set_ids = [summary['id'] for summary in json.loads(body)['sets'] if summary['included_count']]
+            if not set_ids:
+                await asyncio.sleep(0.1)
+                continue
+
+            deck_sets = ','.join(map(str, rng.sample(set_ids, min(len(set_ids), rng.randint(1, 3)))))
+            seed = rng.randrange(2**32)
+            answers = []
+            for page in range(PAGES_PER_DECK):
+                status, body, _ = await results.request(session, 'GET /deck', 'GET', f'{url}/deck',
+                                                        params={'sets': deck_sets, 'random': '1', 'seed': str(seed), 'page': str(page)})
+                if status != 200:
+                    break
+                deck = json.loads(body)
+                for card in deck['cards']:
+                    if rng.random() < AUDIO_RATIO:
+                        await results.request(session, 'GET /cards/{card_id}/audio', 'GET', f"{url}/cards/{card['id']}/audio")
+                    answers.append({'card_id': card['id'], 'knew': rng.random() < 0.7})
+                    if len(answers) == ANSWER_BATCH_SIZE:
+                        await results.request(session, 'POST /answers', 'POST', f'{url}/answers', json={'answers': answers})
+                        answers = []
+                if page + 1 >= deck['pages'] or time.monotonic() >= deadline:
+                    break
+            if answers:
+                await results.request(session, 'POST /answers', 'POST', f'{url}/answers', json={'answers': answers})
+
+
+async def load_test(url, clients, duration, seed=0):
+    results = Results()
+    start = time.monotonic()
+    await asyncio.gather(*(study_client(url, start + duration, results, random.Random(seed + i)) for i in range(clients)))
+    return results.summary(time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help="server to load test. If not given, one is started")
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20, help="seconds to run for")
+    parser.add_argument('--sets', type=int, default=200, help="sets in the generated database")
+    parser.add_argument('--cards', type=int, default=50_000, help="cards in the generated database")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        url = args.url
+        if url is None:
+            database_path = Path(directory) / 'server.db'
+            generate(database_path, sets=args.sets, cards=args.cards)
+            ports = multiprocessing.Queue()
+            server = multiprocessing.Process(target=run_server, args=(database_path, Path(directory) / 'audio', ports), daemon=True)
+            server.start()
+            url = f'http://127.0.0.1:{ports.get()}'
+
+        summary = asyncio.run(load_test(url.rstrip('/'), args.clients, args.duration))
+        if server is not None:
+            server.terminate()
+            server.join()
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{summary['requests']} requests from {args.clients} clients in {summary['seconds']:.1f}s: "
+              f"{summary['requests_per_second']:.0f} requests/s, {summary['failed']} failed")
+        for endpoint, result in summary['endpoints'].items():
+            statuses = ', '.join(f"{requests} {status}" for status, requests in result['statuses'].items())
+            print(f"  {endpoint}: {result['requests']} requests ({statuses}), p50 {result['p50'] * 1000:.1f}ms, "
+                  f"p95 {result['p95'] * 1000:.1f}ms, p99 {result['p99'] * 1000:.1f}ms, max {result['max'] * 1000:.1f}ms")
+
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""
+Time the hot paths of the app on a synthetic database and write the results as JSON, so
+that runs on different commits can be compared.
+
+Benchmarks:
+- startup: creating a DatabaseManager and ensure_db_upgraded on an up to date database
+- get_flashcard_data: the set summaries shown in the set list
+- deck assembly: building the deck for a selection of sets, as Root.start_button_press does
+- session engine: StudySession.next / flip / back through a deck, without any UI
+- session: FlashcardFrame.next / flip / back. Needs a display; if there is none, Xvfb is
+  started when it is installed, otherwise these are skipped
+
+Usage:
+    python benchmarks/suite.py [--sets 10000] [--cards 1000000] [--database synthetic.db] [--output results.json]
+    python benchmarks/suite.py --compare baseline.json [--tolerance 1.25]
+
+--database keeps the generated database at the given path and reuses it on later runs, as
+long as it has the same size. --compare exits with status 1 if any benchmark got slower
+than the baseline by more than the tolerance.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic import generate, root_path, upgrade_schema
+
+DUE_DECK_SIZE = 200  # Root.due_deck_size
+SEARCH_DECK_SIZE = 500  # Root.search_deck_size
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'median': statistics.median(timings),
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'min': timings[0],
+        'max': timings[-1],
+        'repeats': len(timings),
+    }
+
+
+def measure(func, repeats, setup=None):
+    """
+    Time func repeats times. setup, if given, runs untimed before each call and whatever it
+    returns is passed to func
+    """
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            argument = setup()
+            start = time.perf_counter()
+            func(argument)
+        else:
+            start = time.perf_counter()
+            func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root_path, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root_path,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def prepare_database(path, sets, cards, seed):
+    """
+    Generate the synthetic database, or reuse an existing one of the same size brought up to
+    the latest revision
+    """
+    path = Path(path)
+    if path.exists():
+        connection = sqlite3.connect(path)
+        try:
+            existing = connection.execute('SELECT (SELECT count(*) FROM flashcard_sets), (SELECT count(*) FROM flashcards)').fetchone()
+        except sqlite3.Error:
+            existing = None
+        connection.close()
+        if existing == (sets, cards):
+            upgrade_schema(path)
+            return False
+
+    generate(path, sets=sets, cards=cards, seed=seed)
+    return True
+
+
+def benchmark_database(database_url, repeats, seed):
+    from database.engine import dispose_engine
+    from database.manager import DatabaseManager
+
+    rng = random.Random(seed)
+    results = {}
+
+    results['startup: DatabaseManager()'] = measure(lambda _: DatabaseManager(database_url), repeats,
+                                                    setup=lambda: dispose_engine(database_url))
+    manager = DatabaseManager(database_url)
+    results['startup: ensure_db_upgraded'] = measure(manager.ensure_db_upgraded, repeats)
+
+    results['get_flashcard_data'] = measure(manager.get_set_summaries, repeats)
+
+    # the selections someone might tick in the set list
+    set_ids = [summary.id for summary in manager.get_set_summaries()]
+    selections = {
+        'one set': lambda: [rng.choice(set_ids)],
+        '1% of sets': lambda: rng.sample(set_ids, max(1, len(set_ids) // 100)),
+        'all sets': lambda: set_ids,
+    }
+    for name, selection in selections.items():
+        # a deck is ready once its first card can be shown
+        results[f'deck: {name}, in order'] = measure(lambda ids: manager.open_deck(ids)[0:1], repeats, setup=selection)
+        results[f'deck: {name}, random order'] = measure(lambda ids: manager.open_deck(ids, random_order=True)[0:1], repeats,
+                                                         setup=selection)
+        results[f'deck: {name}, due cards'] = measure(lambda ids: manager.get_due_cards(ids, limit=DUE_DECK_SIZE), repeats,
+                                                      setup=selection)
+    results['deck: 1% of sets, fully loaded'] = measure(manager.get_cards, repeats, setup=selections['1% of sets'])
+
+    words = ('theorem', 'cell energy', 'vect', 'revolution treaty')
+    results['deck: search'] = measure(lambda query: manager.search_cards(query, limit=SEARCH_DECK_SIZE), repeats,
+                                      setup=lambda: rng.choice(words))
+    return results
+
+
+def benchmark_session_engine(database_url, cards, repeats):
+    """
+    Move a StudySession through a deck, as the views do, without drawing anything
+    """
+    from database.manager import DatabaseManager
+    from session import StudySession
+
+    manager = DatabaseManager(database_url)
+    set_ids = [summary.id for summary in manager.get_set_summaries()]
+    session = StudySession(manager.open_deck(set_ids), autoflip=True, autoflip_interval=5)
+
+    timings = {'next': [], 'flip': [], 'back': []}
+
+    def press(name, button):
+        start = time.perf_counter()
+        button()
+        _ = session.current_text, session.progress
+        timings[name].append(time.perf_counter() - start)
+
+    # enough presses to cross several deck pages
+    presses = min(repeats * 100, cards // 2)
+    session.next()
+    for _ in range(presses):
+        press('flip', session.flip)
+        press('next', session.next)
+    for _ in range(presses):
+        press('back', session.back)
+    return {f'session engine: {name}': summarize(values) for name, values in timings.items()}
+
+
+def start_virtual_display():
+    """
+    Start Xvfb if there is no display. Returns the process, or None if there is a display or
+    Xvfb isn't installed.
+    """
+    if os.environ.get('DISPLAY') or sys.platform in ('win32', 'darwin'):
+        return None
+    xvfb = shutil.which('Xvfb')
+    if xvfb is None:
+        return None
+    display = f':{random.randint(100, 999)}'
+    process = subprocess.Popen([xvfb, display, '-screen', '0', '1280x800x24'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1)
+    os.environ['DISPLAY'] = display
+    return process
+
+
+def benchmark_session(database_url, cards, repeats):
+    """
+    Drive a FlashcardFrame through a deck, timing each button press including the redraw
+    """
+    import tkinter as tk
+
+    from database.manager import DatabaseManager
+    from window import FlashcardFrame
+
+    manager = DatabaseManager(database_url)
+    set_ids = [summary.id for summary in manager.get_set_summaries()]
+
+    root = tk.Tk()
+    root.withdraw()
+    try:
+        frame = FlashcardFrame(root, manager.open_deck(set_ids), image_path=root_path / 'src' / 'img')
+        frame.pack(fill='both', expand=True)
+        root.update_idletasks()
+
+        timings = {'next': [], 'flip': [], 'back': []}
+
+        def press(name, button):
+            start = time.perf_counter()
+            button()
+            root.update_idletasks()
+            timings[name].append(time.perf_counter() - start)
+
+        presses = min(repeats * 10, cards // 2)
+        frame.next()
+        for _ in range(presses):
+            press('flip', frame.flip)
+            press('next', frame.next)
+        for _ in range(presses):
+            press('back', frame.back)
+    finally:
+        root.destroy()
+    return {f'session: {name}': summarize(values) for name, values in timings.items()}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print how each benchmark changed against a baseline run. Returns the names of the ones
+    which got slower by more than tolerance.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<40}{'baseline (ms)':>15}{'now (ms)':>12}{'change':>10}")
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        ratio = result['median'] / before['median'] if before['median'] else float('inf')
+        flag = ''
+        if ratio > tolerance:
+            regressions.append(name)
+            flag = '  SLOWER'
+        print(f"{name:<40}{before['median'] * 1000:>15.3f}{result['median'] * 1000:>12.3f}{ratio:>9.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sets', type=int, default=10_000)
+    parser.add_argument('--cards', type=int, default=1_000_000)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', type=Path, default=None, help="where to keep the synthetic database between runs")
+    parser.add_argument('--output', type=Path, default=None, help="write the results to this JSON file")
+    parser.add_argument('--compare', type=Path, default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="slowdown allowed by --compare, as a ratio")
+    parser.add_argument('--no-ui', action='store_true', help="skip the FlashcardFrame benchmarks")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = (args.database or Path(directory) / 'benchmark.db').resolve()
+        start = time.perf_counter()
+        generated = prepare_database(database_path, args.sets, args.cards, args.seed)
+        setup_seconds = time.perf_counter() - start
+        database_url = f"sqlite:///{database_path}"
+
+        results = benchmark_database(database_url, args.repeats, args.seed)
+        results.update(benchmark_session_engine(database_url, args.cards, args.repeats))
+
+        skipped = {}
+        if args.no_ui:
+            skipped['session'] = "--no-ui"
+        else:
+            display = start_virtual_display()
+            try:
+                results.update(benchmark_session(database_url, args.cards, args.repeats))
+            except Exception as e:  # most likely no display, e.g. tkinter.TclError
+                skipped['session'] = f"{type(e).__name__}: {e}"
+            finally:
+                if display is not None:
+                    display.terminate()
+
+        from database.engine import dispose_engine
+        dispose_engine(database_url)
+
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'parameters': {'sets': args.sets, 'cards': args.cards, 'repeats': args.repeats, 'seed': args.seed},
+        'database_generated': generated,
+        'database_setup_seconds': setup_seconds,
+        'results': results,
+        'skipped': skipped,
+    }
+
+    print(f"{args.cards} cards in {args.sets} sets, commit {commit[:10] if commit else 'unknown'}{' (dirty)' if dirty else ''}")
+    print(f"{'benchmark':<40}{'median (ms)':>13}{'p95 (ms)':>12}")
+    for name, result in results.items():
+        print(f"{name:<40}{result['median'] * 1000:>13.3f}{result['p95'] * 1000:>12.3f}")
+    for name, reason in skipped.items():
+        print(f"skipped {name}: {reason}")
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than {args.tolerance:.2f}x the baseline")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Generate synthetic flashcard databases of any size for benchmarking.
+
+The schema is created with the project's own Alembic migrations, so the database looks
+exactly like a real one at the chosen revision. Rows are then bulk inserted with sqlite3.
+
+Usage: python benchmarks/synthetic.py out.db [--sets 10000] [--cards 1000000] [--duplicates 0.0] [--revision head]
+"""
+
+import argparse
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+root_path = Path(__file__).resolve().parent.parent
+src_path_str = str(root_path / 'src')
+if src_path_str not in sys.path:
+    sys.path.insert(0, src_path_str)
+
+WORDS = (
+    "revolution cell mitochondria theorem integral derivative enzyme protein monarchy treaty "
+    "empire republic velocity momentum energy photon electron molecule atom reaction equation "
+    "matrix vector function limit series graph algorithm network language grammar verb noun"
+).split()
+
+
+def alembic_config(database_path):
+    from alembic.config import Config
+
+    config = Config(root_path / 'alembic.ini')
+    config.set_main_option('script_location', str(root_path / 'alembic'))
+    config.set_main_option('sqlalchemy.url', f"sqlite:///{Path(database_path).resolve()}")
+    return config
+
+
+def upgrade_schema(database_path, revision='head'):
+    """
+    Create the database, or upgrade an existing one, at the given Alembic revision
+    """
+    from alembic import command
+
+    command.upgrade(alembic_config(database_path), revision)
+
+
+def random_text(rng, min_words, max_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def populate(database_path, sets=10_000, cards=1_000_000, courses=50, excluded_ratio=0.1, duplicate_ratio=0.0, seed=0,
+             batch_size=50_000):
+    """
+    Fill an existing database with sets and cards. Cards are spread evenly over the sets and
+    every set belongs to one of the courses. A duplicate_ratio share of the cards repeat the
+    content of an earlier card, usually from another set.
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(database_path)
+    # older revisions don't have the content hash
+    hashed = 'content_hash' in {row[1] for row in connection.execute('PRAGMA table_info(flashcards)')}
+    if hashed:
+        from database.dedupe import content_hash
+    # durability doesn't matter while generating throwaway data
+    connection.execute('PRAGMA journal_mode=OFF')
+    connection.execute('PRAGMA synchronous=OFF')
+
+    set_courses = [f"course {i % courses}" for i in range(sets)]
+    with connection:
+        connection.executemany(
+            'INSERT INTO flashcard_sets (id, name, course_name) VALUES (?, ?, ?)',
+            ((i + 1, f"set {i + 1} {random_text(rng, 1, 3)}", set_courses[i]) for i in range(sets))
+        )
+
+    def card_rows():
+        recent = []  # content of recent cards for duplicates to copy
+        for i in range(cards):
+            set_index = i % sets
+            if recent and rng.random() < duplicate_ratio:
+                term, definition = rng.choice(recent)
+            else:
+                term, definition = f"{random_text(rng, 3, 10)} {i}?", random_text(rng, 1, 20)
+                recent.append((term, definition))
+                if len(recent) > 1000:
+                    recent.pop(rng.randrange(len(recent)))
+            row = (term, definition, rng.random() < excluded_ratio, set_courses[set_index], set_index + 1)
+            yield row + (content_hash(term, definition),) if hashed else row
+
+    rows = card_rows()
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        with connection:
+            connection.executemany(
+                'INSERT INTO flashcards (term, definition, exclude, course_name, set_id, content_hash) VALUES (?, ?, ?, ?, ?, ?)'
+                if hashed else 'INSERT INTO flashcards (term, definition, exclude, course_name, set_id) VALUES (?, ?, ?, ?, ?)',
+                batch
+            )
+    connection.execute('ANALYZE')
+    connection.close()
+
+
+def generate(database_path, sets=10_000, cards=1_000_000, revision='head', **kwargs):
+    """
+    Create a new synthetic database, replacing any existing file at database_path
+    """
+    database_path = Path(database_path)
+    if database_path.exists():
+        database_path.unlink()
+    upgrade_schema(database_path, revision)
+    populate(database_path, sets=sets, cards=cards, **kwargs)
+    return database_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic flashcard database")
+    parser.add_argument('path', type=Path)
+    parser.add_argument('--sets', type=int, default=10_000)
+    parser.add_argument('--cards', type=int, default=1_000_000)
+    parser.add_argument('--courses', type=int, default=50)
+    parser.add_argument('--duplicates', type=float, default=0.0, help="share of cards repeating an earlier card")
+    parser.add_argument('--revision', default='head', help="Alembic revision to create the schema at")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generate(args.path, sets=args.sets, cards=args.cards, revision=args.revision, courses=args.courses,
+             duplicate_ratio=args.duplicates, seed=args.seed)
+    print(f"Generated {args.cards} cards in {args.sets} sets at {args.path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Measure the latency and throughput of every available text to speech backend so that the
+fastest engine can be chosen for this machine.
+
+Usage: python benchmarks/tts_latency.py [--backends gtts espeak null] [--clips 20] [--json]
+
+time to first audio is how long the first, uncached clip takes to synthesize. Throughput is
+measured over the remaining clips, which are all distinct so the cache never helps.
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+src_path_str = str(Path(__file__).resolve().parent.parent / 'src')
+if src_path_str not in sys.path:
+    sys.path.insert(0, src_path_str)
+
+from audio_cache import AudioCache  # noqa: E402
+from tts_backends import BACKENDS, available_backends, get_backend  # noqa: E402
+
+SAMPLE_TEXT = [
+    "When did the french revolution start?",
+    "May 5, 1789",
+    "Where did the french revolution occur?",
+    "France",
+    "What is the powerhouse of the cell?",
+    "The mitochondria",
+]
+
+
+def sample_texts(count):
+    return [f"{SAMPLE_TEXT[i % len(SAMPLE_TEXT)]} ({i})" for i in range(count)]
+
+
+def benchmark_backend(name, clips, language='en'):
+    """
+    Synthesize clips through a fresh cache and return the timings in seconds
+    """
+    backend = get_backend(name)
+    texts = sample_texts(clips)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = AudioCache(cache_dir)
+
+        def synthesize(text):
+            key = cache.key(text, language, False, backend=backend.name, extension=backend.extension)
+            return cache.get_or_create(key, lambda: backend.synthesize(text, language, False))
+
+        start = time.perf_counter()
+        synthesize(texts[0])
+        time_to_first_audio = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for text in texts[1:]:
+            synthesize(text)
+        elapsed = time.perf_counter() - start
+
+        cached_start = time.perf_counter()
+        synthesize(texts[0])
+        cache_hit_time = time.perf_counter() - cached_start
+
+    remaining = len(texts) - 1
+    return {
+        'backend': name,
+        'time_to_first_audio': time_to_first_audio,
+        'clips_per_second': remaining / elapsed if elapsed > 0 and remaining else None,
+        'chars_per_second': sum(len(text) for text in texts[1:]) / elapsed if elapsed > 0 and remaining else None,
+        'cache_hit_time': cache_hit_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), help="defaults to every available backend")
+    parser.add_argument('--clips', type=int, default=20, help="number of distinct clips to synthesize per backend")
+    parser.add_argument('--language', default='en')
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.backends or available_backends():
+        try:
+            results.append(benchmark_backend(name, max(args.clips, 1), args.language))
+        except Exception as e:
+            results.append({'backend': name, 'error': str(e)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'backend':<10}{'first audio (ms)':>18}{'clips/s':>10}{'chars/s':>10}{'cache hit (ms)':>16}")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['backend']:<10}  failed: {result['error']}")
+            continue
+        clips_per_second = result['clips_per_second'] or 0
+        chars_per_second = result['chars_per_second'] or 0
+        print(f"{result['backend']:<10}{result['time_to_first_audio'] * 1000:>18.1f}{clips_per_second:>10.1f}"
+              f"{chars_per_second:>10.0f}{result['cache_hit_time'] * 1000:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Measure how long answering a card takes with answers recorded synchronously, as before,
+and with the write-behind queue, and check that the queue loses nothing when the app is
+killed.
+
+Answer latency is the time StudySession.answer takes, which includes recording the answer
+and moving to the next card. At the 95th percentile it should stay within a frame
+(--budget, 1/60 s by default) so that the next card is drawn without a visible pause.
+
+The crash check queues --crash-events answers and edits in a process which then exits
+without flushing, opens the queue again and checks that every event was written exactly
+once. The lost journal check deletes the journal once the checkpoint is well past zero and
+checks that answers queued afterwards are still written.
+
+Usage: python benchmarks/write_behind.py [--sets 200] [--cards 50000] [--answers 2000] [--json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from suite import summarize
+from synthetic import generate, root_path
+
+src_path_str = str(root_path / 'src')
+if src_path_str not in sys.path:
+    sys.path.insert(0, src_path_str)
+
+from database.manager import WRITE_BEHIND_SUFFIX, DatabaseManager  # noqa: E402
+from session import StudySession  # noqa: E402
+
+FRAME_BUDGET = 1 / 60
+
+
+def review_count(manager):
+    with manager.engine.connect() as connection:
+        return connection.exec_driver_sql("SELECT count(*) FROM review_log").scalar()
+
+
+def time_answers(manager, record_answer, answers):
+    """
+    Seconds taken by each of answers calls to StudySession.answer
+    """
+    session = StudySession(manager.open_deck(range(1, 51), random_order=True, seed=0), record_answer=record_answer)
+    session.next()
+    timings = []
+    for i in range(answers):
+        session.flip()
+        start = time.perf_counter()
+        session.answer(i % 3 != 0)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def queue_and_crash(database_url, events):
+    """
+    Queue events and exit straight away, as if the app had been killed
+    """
+    writes = DatabaseManager(database_url).open_write_behind(max_delay=3600)
+    for i in range(events - 1):
+        writes.record_review(i % 1000 + 1, i % 2 == 0)
+    writes.update_card(1, exclude=True)
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sets', type=int, default=200)
+    parser.add_argument('--cards', type=int, default=50_000)
+    parser.add_argument('--answers', type=int, default=2000, help="cards answered in each mode")
+    parser.add_argument('--crash-events', type=int, default=1000, help="events queued before the simulated crash")
+    parser.add_argument('--budget', type=float, default=FRAME_BUDGET, help="seconds an answer may take at the 95th percentile")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = Path(directory) / 'write_behind.db'
+        generate(database_path, sets=args.sets, cards=args.cards)
+        database_url = f"sqlite:///{database_path.resolve()}"
+        manager = DatabaseManager(database_url)
+
+        results['synchronous'] = summarize(time_answers(manager, manager.record_review, args.answers))
+
+        writes = manager.open_write_behind()
+        before = review_count(manager)
+        results['write-behind'] = summarize(time_answers(manager, writes.record_review, args.answers))
+        start = time.perf_counter()
+        writes.close()
+        results['write-behind']['close_seconds'] = time.perf_counter() - start
+        results['write-behind']['written'] = review_count(manager) - before == args.answers
+
+        before = review_count(manager)
+        crash = multiprocessing.Process(target=queue_and_crash, args=(database_url, args.crash_events))
+        crash.start()
+        crash.join()
+        start = time.perf_counter()
+        manager.open_write_behind().close()
+        with manager.engine.connect() as connection:
+            excluded = connection.exec_driver_sql("SELECT exclude FROM flashcards WHERE id = 1").scalar()
+        results['recovery'] = {
+            'seconds': time.perf_counter() - start,
+            'events': args.crash_events,
+            'recovered': review_count(manager) - before == args.crash_events - 1 and bool(excluded),
+        }
+
+        # numbering starts again from the checkpoint, not from the journal which is gone
+        (database_path.parent / (database_path.name + WRITE_BEHIND_SUFFIX)).unlink()
+        before = review_count(manager)
+        writes = manager.open_write_behind()
+        for card_id in range(1, 4):
+            writes.record_review(card_id, True)
+        closed = writes.close()
+        results['lost journal'] = {'written': closed and review_count(manager) - before == 3}
+
+    passed = (results['write-behind']['p95'] <= args.budget and results['write-behind']['written'] and results['recovery']['recovered']
+              and results['lost journal']['written'])
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for mode in ('synchronous', 'write-behind'):
+            result = results[mode]
+            print(f"{mode}: median {result['median'] * 1000:.3f}ms, p95 {result['p95'] * 1000:.3f}ms, "
+                  f"max {result['max'] * 1000:.3f}ms per answer")
+        print(f"closing the queue wrote the remaining answers in {results['write-behind']['close_seconds'] * 1000:.1f}ms"
+              f"{'' if results['write-behind']['written'] else ', BUT SOME ARE MISSING'}")
+        recovery = results['recovery']
+        print(f"after a crash, {recovery['events']} journaled events were {'recovered' if recovery['recovered'] else 'NOT recovered'} "
+              f"in {recovery['seconds'] * 1000:.1f}ms")
+        print(f"answers queued after the journal was deleted were {'written' if results['lost journal']['written'] else 'NOT written'}")
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
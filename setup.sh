@@ -3,7 +3,8 @@
 # Create api_conf.json file for notion API key
 cat > src/api_conf.json << EOF
 {
-    "api_key": "Enter API Key Here"
+    "api_key": "Enter API Key Here",
+    "database_ids": []
 }
 EOF
 
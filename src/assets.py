@@ -0,0 +1,127 @@
+"""
+In-memory cache of decoded images for the Tk UI.
+
+Opening an image with PIL, resizing it and wrapping it in a PhotoImage every time a frame is
+built is slow enough to notice, so each file is decoded once and every size it is shown at
+is kept, keyed by (path, size).
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:
+    from PIL import Image, ImageTk
+
+DEFAULT_MAX_IMAGES = 64
+DEFAULT_MAX_PHOTOS = 64
+
+
+class ImageCache:
+    """
+    Decoded images and their resized variants, plus the Tk PhotoImages made from them.
+
+    PIL images may be loaded from any thread, which is how prefetch() decodes upcoming card
+    images in the background. PhotoImages belong to the Tk interpreter, so photo() must only
+    be called from the Tk thread. Both are evicted least recently used first. Widgets must
+    still keep a reference to the PhotoImage they show, since Tk drops the image once the
+    last Python reference to it is gone.
+    """
+
+    def __init__(self, max_images: int = DEFAULT_MAX_IMAGES, max_photos: int = DEFAULT_MAX_PHOTOS):
+        self.max_images = max_images
+        self.max_photos = max_photos
+        self.decodes = 0  # number of times a file was actually read and decoded
+        self._lock = threading.Lock()
+        self._images: OrderedDict[tuple, 'Image.Image'] = OrderedDict()
+        self._photos: OrderedDict[tuple, 'ImageTk.PhotoImage'] = OrderedDict()
+        self._executor = None
+
+    @staticmethod
+    def _key(path: os.PathLike, size=None):
+        return str(path), tuple(size) if size is not None else None
+
+    def image(self, path: os.PathLike, size=None) -> 'Image.Image':
+        """
+        The decoded image at path, resized to exactly size if given
+        """
+        key = self._key(path, size)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                return image
+
+        if size is None:
+            # PIL is imported on first use, so that starting the app doesn't wait for it
+            from PIL import Image
+
+            with Image.open(path) as file:
+                file.load()
+                image = file.copy()
+            with self._lock:
+                self.decodes += 1
+        else:
+            image = self.image(path).resize(key[1])
+
+        with self._lock:
+            # another thread may have got here first
+            image = self._images.setdefault(key, image)
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_images:
+                self._images.popitem(last=False)
+        return image
+
+    def photo(self, path: os.PathLike, size=None) -> 'ImageTk.PhotoImage':
+        """
+        A PhotoImage of the image at path, resized to exactly size if given. Tk thread only.
+        """
+        key = self._key(path, size)
+        photo = self._photos.get(key)
+        if photo is None:
+            from PIL import ImageTk
+
+            photo = self._photos[key] = ImageTk.PhotoImage(self.image(path, size))
+            while len(self._photos) > self.max_photos:
+                self._photos.popitem(last=False)
+        else:
+            self._photos.move_to_end(key)
+        return photo
+
+    def prefetch(self, paths: Iterable[Optional[os.PathLike]], size=None):
+        """
+        Decode images in a background thread so that showing them later doesn't stall the UI
+        """
+        paths = [path for path in paths if path is not None]
+        if not paths:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-prefetch')
+        for path in paths:
+            self._executor.submit(self._prefetch_one, path, size)
+
+    def _prefetch_one(self, path, size):
+        try:
+            self.image(path, size)
+        except OSError:
+            pass  # missing or unreadable. Reported when the image is actually shown
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+        self._photos.clear()
+
+
+_default_cache = None
+
+
+def get_default_image_cache() -> ImageCache:
+    """
+    Application-wide cache shared by every frame
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ImageCache()
+    return _default_cache
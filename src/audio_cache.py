@@ -0,0 +1,143 @@
+"""
+On-disk cache of synthesized speech. Clips are stored under a name derived from a hash of
+everything that affects the audio, so the same text is only ever synthesized once.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Optional
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / 'audio_cache'
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024  # 200 MiB
+
+
+class AudioCache:
+    """
+    Content-addressed audio cache with a size limit and least-recently-used eviction.
+
+    Clips are keyed by (text, language, slow) and the backend which synthesized them. The
+    key is also the file name of the clip. The least recently used clips are removed once
+    the total size of the cache goes over max_bytes. Recency is kept in file modification
+    times, so it persists between runs.
+    """
+
+    def __init__(self, cache_dir: os.PathLike = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # clips are synthesized and looked up from background threads as well as the Tk thread
+        self._lock = threading.RLock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # key -> size in bytes, ordered from least to most recently used
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self.total_bytes = 0
+        existing = []
+        for path in self.cache_dir.iterdir():
+            if path.suffix == '.tmp':
+                continue
+            stat = path.stat()
+            existing.append((stat.st_mtime, path.name, stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def key(text: str, language: str, slow: bool, backend: str = 'gtts', extension: str = '.mp3') -> str:
+        """
+        Content address of a clip
+        """
+        content = '\x1f'.join((backend, language, 'slow' if slow else 'normal', text))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest() + extension
+
+    def path_for(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def get(self, key: str) -> Optional[Path]:
+        """
+        Return the path of the cached clip, or None if it hasn't been synthesized yet
+        """
+        path = self.path_for(key)
+        with self._lock:
+            if key not in self._entries or not path.exists():
+                self._forget(key)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key: str, data: bytes) -> Path:
+        """
+        Store a clip and evict old clips if the cache has grown too large
+        """
+        path = self.path_for(key)
+
+        # write to a temporary file first so that a partially written clip is never played
+        tmp_path = path.with_name(f'{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = len(data)
+            self.total_bytes += len(data)
+            self._evict(keep=key)
+        return path
+
+    def get_or_create(self, key: str, synthesize: Callable[[], bytes]) -> Path:
+        """
+        Return the path of the cached clip, synthesizing it first on a miss
+        """
+        path = self.get(key)
+        if path is None:
+            path = self.put(key, synthesize())
+        return path
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _remove(self, key: str):
+        self._forget(key)
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep: str = None):
+        while self.total_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self._remove(oldest)
+
+
+_default_cache = None
+
+
+def get_default_cache() -> AudioCache:
+    """
+    Application-wide cache shared by every TextToSpeech instance
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = AudioCache()
+    return _default_cache
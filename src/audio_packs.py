@@ -0,0 +1,317 @@
+"""
+Speech for whole flashcard sets rendered ahead of time, so that they can be read aloud
+offline without waiting for synthesis.
+
+Each set gets an audio pack in src/audio_packs: set-<id>.pack holds the clips of its terms
+and definitions back to back, and set-<id>.index.json maps the AudioCache key of each clip
+to where it is in the pack. Keys cover the text, language, speed and backend, so one pack
+can hold clips of several voices and TextToSpeech finds a clip with the key it would cache
+it under.
+
+Clips are synthesized by a pool of workers, at most WORKERS at a time by default. Clips
+already in the pack are skipped, and clips already in the audio cache are copied instead
+of synthesized. The index is saved every INDEX_SAVE_INTERVAL clips and the pack is only
+ever appended to, so an interrupted render picks up where it stopped when run again.
+
+Run from the src folder:
+    python audio_packs.py [--set NAME_OR_ID ...] [--course NAME] [--workers 8] [--language en] [--slow] [--backend NAME]
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+from audio_cache import AudioCache, get_default_cache
+from metrics import count
+from tts_backends import TTSBackend, get_backend
+
+DEFAULT_PACK_DIR = Path(__file__).parent / 'audio_packs'
+
+WORKERS = 8  # clips synthesized at once. gTTS spends most of its time waiting on the network
+INDEX_SAVE_INTERVAL = 100  # clips appended to a pack between saves of its index
+
+
+class AudioPack:
+    """
+    Clips stored back to back in one file, with a JSON index of key -> [offset, length]
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = Path(path)
+        self.index_path = self.path.with_suffix('.index.json')
+        try:
+            self.index: dict[str, list[int]] = json.loads(self.index_path.read_text(encoding='utf-8'))['clips']
+        except (OSError, ValueError, KeyError):
+            self.index = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """
+        Bytes of clips listed in the index. Anything after them is left over from an
+        interrupted write
+        """
+        return max((offset + length for offset, length in self.index.values()), default=0)
+
+    def __contains__(self, key: str):
+        return key in self.index
+
+    def read(self, key: str) -> Optional[bytes]:
+        location = self.index.get(key)
+        if location is None:
+            return None
+        offset, length = location
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'rb')
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class AudioPackWriter:
+    """
+    Appends clips to an audio pack, saving its index as it goes
+    """
+
+    def __init__(self, path: os.PathLike, rebuild=False):
+        self.pack = AudioPack(path)
+        if rebuild:
+            self.pack.index = {}
+        self.pack.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.pack.path, 'r+b' if self.pack.path.exists() else 'w+b')
+        # drop whatever an interrupted render wrote after the last clip in the index
+        self._file.truncate(self.pack.size)
+        self._file.seek(self.pack.size)
+        self._unsaved = 0
+
+    def __contains__(self, key: str):
+        return key in self.pack
+
+    def add(self, key: str, data: bytes):
+        self.pack.index[key] = [self._file.tell(), len(data)]
+        self._file.write(data)
+        self._unsaved += 1
+        if self._unsaved >= INDEX_SAVE_INTERVAL:
+            self.save_index()
+
+    def save_index(self):
+        """
+        Write the index, after making sure the clips it lists are on disk
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # write to a temporary file first so that a partially written index is never read
+        tmp_path = self.pack.index_path.with_name(f'{self.pack.index_path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps({'clips': self.pack.index}, separators=(',', ':')), encoding='utf-8')
+        os.replace(tmp_path, self.pack.index_path)
+        self._unsaved = 0
+
+    def close(self):
+        self.save_index()
+        self._file.close()
+
+
+def pack_path(set_id: int, directory: os.PathLike = DEFAULT_PACK_DIR) -> Path:
+    return Path(directory) / f'set-{set_id}.pack'
+
+
+class AudioPackLibrary:
+    """
+    Every audio pack in a folder, for looking clips up by key. The packs are found on first use
+    and again after refresh().
+    """
+
+    def __init__(self, directory: os.PathLike = DEFAULT_PACK_DIR):
+        self.directory = Path(directory)
+        self._packs: Optional[dict[str, AudioPack]] = None  # key -> pack holding it
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            if self._packs is not None:
+                for pack in set(self._packs.values()):
+                    pack.close()
+            self._packs = None
+
+    def _load(self):
+        packs = {}
+        for path in sorted(self.directory.glob('*.pack')):
+            pack = AudioPack(path)
+            packs.update(dict.fromkeys(pack.index, pack))
+        return packs
+
+    def read(self, key: str) -> Optional[bytes]:
+        """
+        The clip with the given key, or None if no pack has it
+        """
+        with self._lock:
+            if self._packs is None:
+                self._packs = self._load()
+            pack = self._packs.get(key)
+        return pack.read(key) if pack is not None else None
+
+
+_default_library = None
+
+
+def get_default_packs() -> AudioPackLibrary:
+    """
+    Application-wide library of the packs in DEFAULT_PACK_DIR
+    """
+    global _default_library
+    if _default_library is None:
+        _default_library = AudioPackLibrary()
+    return _default_library
+
+
+class SetRenderResult(NamedTuple):
+    set_id: int
+    clips: int  # distinct terms and definitions in the set
+    added: int  # clips added to its pack by this render
+    failed: int
+
+
+class RenderReport(NamedTuple):
+    sets: list[SetRenderResult]
+    synthesized: int  # clips synthesized, once however many sets they were added to
+    copied: int  # clips taken from the audio cache
+    seconds: float
+
+    @property
+    def failed(self):
+        return sum(result.failed for result in self.sets)
+
+
+def render_sets(manager, set_ids, directory: os.PathLike = DEFAULT_PACK_DIR, workers: int = WORKERS, language: str = 'en',
+                slow: bool = False, backend: TTSBackend | str = None, cache: AudioCache = None, rebuild=False,
+                progress: Callable[[int, int], object] = None) -> RenderReport:
+    """
+    Render the terms and definitions of the non-excluded cards of the given sets into their
+    audio packs. A text in several of the sets is synthesized once and added to each of their
+    packs. progress is called with (clips done, clips to do) as clips are added.
+    """
+    start = time.perf_counter()
+    backend = backend if backend is not None and not isinstance(backend, str) else get_backend(backend)
+    cache = cache if cache is not None else get_default_cache()
+
+    writers = {}
+    texts = {}  # key -> text
+    set_keys = {}  # set id -> keys of its clips
+    todo = {}  # key -> ids of the sets whose packs don't have it yet, in the order the sets were given
+    for set_id in set_ids:
+        keys = set_keys[set_id] = set()
+        for card in manager.get_cards([set_id]):
+            for text in (card.term, card.definition):
+                if text and text.strip():
+                    key = cache.key(text, language, slow, backend=backend.name, extension=backend.extension)
+                    texts[key] = text
+                    keys.add(key)
+        writer = writers[set_id] = AudioPackWriter(pack_path(set_id, directory), rebuild=rebuild)
+        for key in keys:
+            if key not in writer:
+                todo.setdefault(key, []).append(set_id)
+
+    added = dict.fromkeys(set_keys, 0)
+    failed = dict.fromkeys(set_keys, 0)
+    synthesized = copied = done = 0
+
+    def add(key, data):
+        nonlocal done
+        for set_id in todo[key]:
+            writers[set_id].add(key, data)
+            added[set_id] += 1
+        done += 1
+        if progress is not None:
+            progress(done, len(todo))
+
+    def finish(future, key):
+        nonlocal synthesized
+        try:
+            data = future.result()
+        except Exception as exception:
+            # a clip which couldn't be synthesized is tried again on the next render
+            print(f"Could not synthesize {texts[key]!r}: {exception}")
+            for set_id in todo[key]:
+                failed[set_id] += 1
+            count('tts.render_failures')
+            return
+        synthesized += 1
+        add(key, data)
+
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix='render') as executor:
+            running = {}  # future -> key
+            for key in todo:
+                cached = cache.get(key)
+                if cached is not None:
+                    copied += 1
+                    add(key, cached.read_bytes())
+                    continue
+                # bounded, so that clips don't pile up in memory faster than they are written
+                if len(running) >= workers * 2:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        finish(future, running.pop(future))
+                running[executor.submit(backend.synthesize, texts[key], language, slow)] = key
+            for future in list(running):
+                finish(future, running.pop(future))
+    finally:
+        for writer in writers.values():
+            writer.close()
+        get_default_packs().refresh()
+
+    results = [SetRenderResult(set_id, len(keys), added[set_id], failed[set_id]) for set_id, keys in set_keys.items()]
+    return RenderReport(results, synthesized, copied, time.perf_counter() - start)
+
+
+def main():
+    import argparse
+    import sys
+
+    from database.manager import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Render the cards of flashcard sets to audio packs for reading aloud offline")
+    parser.add_argument('--set', dest='sets', action='append', default=None, help="name or id of a set to render. May be repeated")
+    parser.add_argument('--course', default=None, help="render the sets of this course")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="clips synthesized at once")
+    parser.add_argument('--language', default='en')
+    parser.add_argument('--slow', action='store_true', help="render slow speech")
+    parser.add_argument('--backend', default=None, help="text to speech backend. See tts_backends")
+    parser.add_argument('--rebuild', action='store_true', help="render every clip again instead of resuming")
+    args = parser.parse_args()
+
+    manager = DatabaseManager()
+    manager.ensure_db_upgraded()
+    summaries = manager.get_set_summaries()
+    set_ids = [summary.id for summary in summaries
+               if (not args.sets or str(summary.id) in args.sets or summary.name in args.sets)
+               and (args.course is None or summary.course_name == args.course)]
+    if not set_ids:
+        parser.error("no sets match")
+
+    def print_progress(done, total):
+        print(f"\r{done}/{total} clips ({done / total * 100:.0f}%)", end='', file=sys.stderr, flush=True)
+
+    report = render_sets(manager, set_ids, workers=args.workers, language=args.language, slow=args.slow, backend=args.backend,
+                         rebuild=args.rebuild, progress=print_progress)
+    print(file=sys.stderr)
+    clips = sum(result.clips for result in report.sets)
+    print(f"Rendered {len(report.sets)} sets ({clips} clips, {report.synthesized} synthesized) in {report.seconds:.2f}s"
+          + (f". {report.failed} clips failed, run again to retry them" if report.failed else ''))
+    if report.failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Streaming import of CSV flashcard files into the database.
+
+Each file becomes one flashcard set named after the file. Files are read row by row and
+inserted in chunks, one transaction per chunk, so memory use doesn't depend on the size of
+the file. Multiple files are parsed in parallel in a process pool.
+
+Files follow the layout described in the README, with an optional header row:
+Term | Definition | Exclude
+
+Usage (from the src folder): python -m database.csv_import [--workers N] file.csv ...
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import os
+from pathlib import Path
+import time
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import delete, insert
+
+from .dedupe import DedupeReport, content_hash, dedupe_cards
+from .engine import get_engine
+from .models import Flashcard, FlashcardSet
+
+DEFAULT_CHUNK_SIZE = 5000
+
+TRUE_VALUES = {'true', 't', 'yes', 'y', '1', 'x'}
+
+
+class FileImportResult(NamedTuple):
+    path: str
+    set_id: int
+    rows: int
+    seconds: float
+
+
+class ImportReport(NamedTuple):
+    files: list[FileImportResult]
+    rows: int
+    seconds: float
+    duplicates: Optional[DedupeReport] = None  # duplicates found in the imported sets
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def parse_exclude(value: Optional[str]) -> bool:
+    return value is not None and value.strip().lower() in TRUE_VALUES
+
+
+def is_header(row: list[str]) -> bool:
+    return [cell.strip().lower() for cell in row[:2]] == ['term', 'definition']
+
+
+def read_flashcard_rows(path: os.PathLike) -> Iterator[tuple[str, str, bool]]:
+    """
+    Lazily yield (term, definition, exclude) for each row of a CSV flashcard file
+    """
+    # utf-8-sig drops the byte order mark which spreadsheet programs like to add
+    with open(path, newline='', encoding='utf-8-sig') as fp:
+        for line_num, row in enumerate(csv.reader(fp)):
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if line_num == 0 and is_header(row):
+                continue
+            term = row[0].strip()
+            definition = row[1].strip() if len(row) > 1 else ''
+            exclude = parse_exclude(row[2]) if len(row) > 2 else False
+            yield term, definition, exclude
+
+
+def chunked(rows: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_file(database_url: str, path: os.PathLike, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                course_name: str = None) -> FileImportResult:
+    """
+    Import a single CSV file as a new flashcard set. Runs inside the worker processes, which
+    each have their own engine.
+    """
+    start = time.perf_counter()
+    path = Path(path)
+    engine = get_engine(database_url)
+    with engine.begin() as connection:
+        set_id = connection.execute(
+            insert(FlashcardSet).values(name=path.stem, course_name=course_name)
+        ).inserted_primary_key[0]
+
+    rows = 0
+    try:
+        for chunk in chunked(read_flashcard_rows(path), chunk_size):
+            with engine.begin() as connection:
+                connection.execute(insert(Flashcard), [
+                    {'term': term, 'definition': definition, 'exclude': exclude, 'course_name': course_name, 'set_id': set_id,
+                     'content_hash': content_hash(term, definition)}
+                    for term, definition, exclude in chunk
+                ])
+            rows += len(chunk)
+    except Exception:
+        # don't leave a half imported set behind
+        with engine.begin() as connection:
+            connection.execute(delete(Flashcard).where(Flashcard.set_id == set_id))
+            connection.execute(delete(FlashcardSet).where(FlashcardSet.id == set_id))
+        raise
+
+    return FileImportResult(str(path), set_id, rows, time.perf_counter() - start)
+
+
+def import_csv_files(database_url: str, paths: Iterable[os.PathLike], workers: int = None,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE, course_name: str = None, progress=None,
+                     dedupe: bool = True) -> ImportReport:
+    """
+    Import each CSV file as a new flashcard set, parsing up to `workers` files at a time.
+    progress, if given, is called with each FileImportResult as soon as its file is done.
+    Duplicate cards within the new sets are then merged, unless dedupe is False.
+    """
+    paths = [Path(path) for path in paths]
+    start = time.perf_counter()
+    results = []
+
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            results.append(import_file(database_url, path, chunk_size, course_name))
+            if progress:
+                progress(results[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(import_file, database_url, path, chunk_size, course_name) for path in paths]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if progress:
+                    progress(results[-1])
+
+    duplicates = None
+    if dedupe and results:
+        duplicates = dedupe_cards(get_engine(database_url), [result.set_id for result in results])
+
+    return ImportReport(results, sum(result.rows for result in results), time.perf_counter() - start, duplicates)
+
+
+def main():
+    import argparse
+
+    from .manager import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Import CSV flashcard files into the database")
+    parser.add_argument('paths', nargs='+', type=Path)
+    parser.add_argument('--workers', type=int, default=None, help="number of files to parse at once. Defaults to the number of CPUs")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows inserted per transaction")
+    parser.add_argument('--course', default=None, help="course name to give the imported cards")
+    args = parser.parse_args()
+
+    manager = DatabaseManager()
+    manager.ensure_db_upgraded()
+
+    def print_progress(result: FileImportResult):
+        print(f"{result.path}: {result.rows} rows in {result.seconds:.2f}s")
+
+    report = manager.import_csv_files(args.paths, workers=args.workers, chunk_size=args.chunk_size,
+                                      course_name=args.course, progress=print_progress)
+    print(f"Imported {report.rows} rows from {len(report.files)} files in {report.seconds:.2f}s "
+          f"({report.rows_per_second:.0f} rows/sec)")
+    if report.duplicates is not None:
+        print(f"Merged {report.duplicates.cards_removed} duplicate rows. {len(report.duplicates.linked)} cards are also in "
+              f"other sets")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Incremental sync of a folder of CSV flashcard files with the database.
+
+A manifest table records the modification time, size and content hash of every imported
+file. On each sync, files whose modification time and size are unchanged are skipped
+without being read. Files which really did change are diffed row by row against their set,
+so only the cards which changed are inserted, updated or deleted. New files are imported in
+parallel and the sets of deleted files are removed along with their cards.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.engine import Engine
+
+from .csv_import import DEFAULT_CHUNK_SIZE, chunked, import_csv_files, read_flashcard_rows
+# renamed, since content_hash is the hash of a whole file here
+from .dedupe import DedupeReport, dedupe_cards, content_hash as card_hash
+from .models import CsvManifestEntry, Flashcard, FlashcardSet
+
+
+class SyncReport(NamedTuple):
+    added: list[str]  # files imported as new sets
+    changed: list[str]  # files which were diffed against their set
+    removed: list[str]  # files which no longer exist
+    unchanged: int
+    cards_inserted: int
+    cards_updated: int
+    cards_deleted: int
+    duplicates: Optional[DedupeReport] = None  # duplicates found in the added and changed sets
+
+
+def file_hash(path: os.PathLike) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def diff_set(engine: Engine, set_id: int, path: os.PathLike, chunk_size: int = DEFAULT_CHUNK_SIZE) -> tuple[int, int, int]:
+    """
+    Make the cards of a set match the rows of a CSV file, touching only the cards which
+    differ. Cards are matched by term, in order for repeated terms. A row which duplicates an
+    earlier row is skipped, since dedupe_cards would merge its card away again. Returns the
+    number of cards inserted, updated and deleted.
+    """
+    with engine.connect() as connection:
+        existing = connection.execute(
+            select(Flashcard.id, Flashcard.term, Flashcard.definition, Flashcard.exclude)
+            .where(Flashcard.set_id == set_id)
+            .order_by(Flashcard.id)
+        ).all()
+        course_name = connection.execute(
+            select(FlashcardSet.course_name).where(FlashcardSet.id == set_id)
+        ).scalar()
+
+    by_term: dict[str, list] = {}
+    for row in existing:
+        by_term.setdefault(row.term, []).append(row)
+    for rows in by_term.values():
+        rows.reverse()  # so that pop() returns the earliest card with the term
+
+    to_insert = []
+    to_update = []
+    seen = set()  # (content hash, exclude) of the rows so far, which dedupe_cards merges on
+    for term, definition, exclude in read_flashcard_rows(path):
+        content = card_hash(term, definition)
+        if (content, exclude) in seen:
+            continue
+        seen.add((content, exclude))
+        matches = by_term.get(term)
+        if matches:
+            card = matches.pop()
+            if card.definition != definition or bool(card.exclude) != exclude:
+                to_update.append({'card_id': card.id, 'definition': definition, 'exclude': exclude, 'content_hash': content})
+        else:
+            to_insert.append({'term': term, 'definition': definition, 'exclude': exclude,
+                              'course_name': course_name, 'set_id': set_id, 'content_hash': content})
+    to_delete = [card.id for rows in by_term.values() for card in rows]
+
+    with engine.begin() as connection:
+        for chunk in chunked(to_insert, chunk_size):
+            connection.execute(insert(Flashcard), chunk)
+        update_statement = update(Flashcard)\
+            .where(Flashcard.id == bindparam('card_id'))\
+            .values(definition=bindparam('definition'), exclude=bindparam('exclude'), content_hash=bindparam('content_hash'))
+        for chunk in chunked(to_update, chunk_size):
+            connection.execute(update_statement, chunk)
+        for chunk in chunked(to_delete, 500):
+            connection.execute(delete(Flashcard).where(Flashcard.id.in_(chunk)))
+
+    return len(to_insert), len(to_update), len(to_delete)
+
+
+def sync_csv_folder(engine: Engine, folder: os.PathLike, workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> SyncReport:
+    """
+    Bring the database up to date with every CSV file in folder and its subfolders
+    """
+    folder = Path(folder)
+    files = {path.relative_to(folder).as_posix(): path for path in sorted(folder.rglob('*.csv')) if path.is_file()}
+
+    with engine.connect() as connection:
+        manifest = {entry.path: entry for entry in connection.execute(select(CsvManifestEntry.__table__)).all()}
+        sets = connection.execute(select(FlashcardSet.id, FlashcardSet.name).order_by(FlashcardSet.id)).all()
+
+    set_ids = {set_id for set_id, _ in sets}
+    # sets which weren't imported through a sync, e.g. before the manifest existed, by name
+    managed_set_ids = {entry.set_id for entry in manifest.values()}
+    unmanaged_sets = {}
+    for set_id, name in sets:
+        if set_id not in managed_set_ids:
+            unmanaged_sets.setdefault(name, set_id)
+
+    added, changed, unchanged = [], [], 0
+    inserted = updated = deleted = 0
+    new_files = {}  # relative path -> (stat, content hash)
+    manifest_updates = []
+
+    for rel_path, path in files.items():
+        stat = path.stat()
+        entry = manifest.get(rel_path)
+        if entry is not None and entry.set_id in set_ids:
+            if entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                unchanged += 1
+                continue
+
+            content_hash = file_hash(path)
+            if content_hash != entry.content_hash:
+                counts = diff_set(engine, entry.set_id, path, chunk_size)
+                inserted, updated, deleted = inserted + counts[0], updated + counts[1], deleted + counts[2]
+                changed.append(rel_path)
+            else:
+                unchanged += 1  # only touched
+            manifest_updates.append((rel_path, stat, content_hash, entry.set_id))
+        elif path.stem in unmanaged_sets:
+            # adopt the existing set with the same name instead of importing a duplicate
+            set_id = unmanaged_sets.pop(path.stem)
+            counts = diff_set(engine, set_id, path, chunk_size)
+            inserted, updated, deleted = inserted + counts[0], updated + counts[1], deleted + counts[2]
+            changed.append(rel_path)
+            manifest_updates.append((rel_path, stat, file_hash(path), set_id))
+        else:
+            new_files[rel_path] = (stat, file_hash(path))
+
+    if new_files:
+        report = import_csv_files(
+            engine.url.render_as_string(hide_password=False),
+            [files[rel_path] for rel_path in new_files],
+            workers=workers,
+            chunk_size=chunk_size,
+            dedupe=False  # done below along with the changed sets
+        )
+        set_id_by_path = {result.path: result.set_id for result in report.files}
+        for rel_path, (stat, content_hash) in new_files.items():
+            manifest_updates.append((rel_path, stat, content_hash, set_id_by_path[str(files[rel_path])]))
+            added.append(rel_path)
+        inserted += report.rows
+
+    removed = [rel_path for rel_path in manifest if rel_path not in files]
+
+    with engine.begin() as connection:
+        for rel_path, stat, content_hash, set_id in manifest_updates:
+            connection.execute(delete(CsvManifestEntry).where(CsvManifestEntry.path == rel_path))
+            connection.execute(insert(CsvManifestEntry).values(
+                path=rel_path, mtime_ns=stat.st_mtime_ns, size=stat.st_size, content_hash=content_hash, set_id=set_id
+            ))
+        for rel_path in removed:
+            set_id = manifest[rel_path].set_id
+            deleted += connection.execute(delete(Flashcard).where(Flashcard.set_id == set_id)).rowcount
+            connection.execute(delete(FlashcardSet).where(FlashcardSet.id == set_id))
+            connection.execute(delete(CsvManifestEntry).where(CsvManifestEntry.path == rel_path))
+
+    touched_set_ids = [set_id for rel_path, _, _, set_id in manifest_updates if rel_path in added or rel_path in changed]
+    duplicates = dedupe_cards(engine, touched_set_ids) if touched_set_ids else None
+
+    return SyncReport(added, changed, removed, unchanged, inserted, updated, deleted, duplicates)
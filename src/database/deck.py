@@ -0,0 +1,240 @@
+"""
+Decks which are loaded from the database a page at a time while they are studied.
+
+A DeckCursor behaves like a read-only list of CardRecords, but only keeps the page holding
+the current card and the pages on either side of it in memory. In order, cards are paged
+through with keyset pagination on (set, card id). Random order is a seeded pseudo-random
+permutation of the positions, so nothing has to be shuffled up front.
+"""
+
+from array import array
+from collections.abc import Sequence
+import json
+import random
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+
+from .models import Flashcard
+from .records import CardRecord
+
+# the only columns needed to present a card. Loaded instead of whole Flashcard objects
+CARD_COLUMNS = (Flashcard.id, Flashcard.term, Flashcard.definition, Flashcard.set_id, Flashcard.image_hash)
+
+# keep the number of bound parameters in a single IN (...) well below SQLite's limit
+MAX_IN_PARAMS = 500
+
+MASK_64 = (1 << 64) - 1
+
+
+class SeededPermutation:
+    """
+    Pseudo-random permutation of range(n), computed one position at a time.
+
+    A small Feistel network is a bijection on the smallest even number of bits covering n.
+    Values which land outside range(n) are encrypted again ("cycle walking") until they fall
+    inside it, which keeps the mapping a bijection on range(n).
+    """
+
+    rounds = 4
+
+    def __init__(self, n: int, seed: int):
+        self.n = n
+        bits = max(2, (n - 1).bit_length())
+        bits += bits % 2
+        self.half_bits = bits // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(64) for _ in range(self.rounds)]
+
+    def _round(self, value, key):
+        # splitmix64 finalizer
+        z = (value + key) & MASK_64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+        return (z ^ (z >> 31)) & self.half_mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half_bits) | right
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.n:
+            raise IndexError(position)
+        value = self._encrypt(position)
+        while value >= self.n:
+            value = self._encrypt(value)
+        return value
+
+
+class DeckCursor(Sequence):
+    """
+    The non-excluded cards of the given sets, loaded in pages as they are accessed.
+
+    Cards are ordered by set and then by card id, or in a random order fixed by seed. A card
+    which is in more than one of the sets (see database.dedupe) is only shown once.
+
+    Cards deleted after the deck was opened are skipped when their page is loaded. In order,
+    the deck then ends sooner than len() first said. In random order, a deleted card's
+    position shows another card of the same page, and slices leave it out.
+    """
+
+    def __init__(self, engine: Engine, set_ids, random_order=False, seed: int = None, page_size=200, window_pages=1):
+        self.engine = engine
+        self.set_ids = sorted(set(set_ids))
+        self.random_order = random_order
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.page_size = page_size
+        self.window_pages = window_pages  # pages kept on either side of the last accessed page
+
+        self._pages: dict[int, list[CardRecord]] = {}
+        self._hidden_ids = self._load_hidden_ids()
+
+        if random_order:
+            # ids of the cards, in index order. The permutation is applied on access
+            self._card_ids = self._load_card_ids()
+            self._length = len(self._card_ids)
+            self._permutation = SeededPermutation(self._length, self.seed)
+        else:
+            self._length = self._count_cards() - len(self._hidden_ids)
+            # where each page starts: (index into self.set_ids, id of the card before the page)
+            self._page_starts = [(0, 0)]
+
+    def _criteria(self, set_ids):
+        return Flashcard.set_id.in_(set_ids), Flashcard.exclude.isnot(True)
+
+    def _load_hidden_ids(self):
+        """
+        Ids of the cards with the same content as a card with a lower id elsewhere in the deck
+        """
+        # every set id is passed as one JSON parameter, so that a deck of any number of sets
+        # is grouped in a single query, within SQLite's limit on parameters
+        deck_set_ids = select(func.json_each(json.dumps(self.set_ids)).table_valued('value').c.value)
+        duplicates = (
+            select(func.group_concat(Flashcard.id).label('ids'))
+            .where(Flashcard.set_id.in_(deck_set_ids), Flashcard.exclude.isnot(True), Flashcard.content_hash.isnot(None))
+            .group_by(Flashcard.content_hash)
+            .having(func.count() > 1)
+        )
+        hidden = set()
+        with self.engine.connect() as connection:
+            for joined, in connection.execute(duplicates):
+                card_ids = sorted(map(int, joined.split(',')))
+                hidden.update(card_ids[1:])
+        return frozenset(hidden)
+
+    def _set_id_chunks(self):
+        for i in range(0, len(self.set_ids), MAX_IN_PARAMS):
+            yield self.set_ids[i:i+MAX_IN_PARAMS]
+
+    def _count_cards(self):
+        with self.engine.connect() as connection:
+            return sum(
+                connection.execute(select(func.count()).select_from(Flashcard).where(*self._criteria(chunk))).scalar()
+                for chunk in self._set_id_chunks()
+            )
+
+    def _load_card_ids(self):
+        card_ids = array('q')
+        with self.engine.connect() as connection:
+            for chunk in self._set_id_chunks():
+                # joining the ids in SQLite and splitting them here is several times faster than
+                # fetching a million single column rows
+                joined = connection.execute(select(func.group_concat(Flashcard.id)).where(*self._criteria(chunk))).scalar()
+                if joined:
+                    chunk_ids = map(int, joined.split(','))
+                    if self._hidden_ids:
+                        chunk_ids = (card_id for card_id in chunk_ids if card_id not in self._hidden_ids)
+                    card_ids.extend(chunk_ids)
+        return card_ids
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            cards = (self._card_at(i) for i in range(*position.indices(self._length)))
+            return [card for card in cards if card is not None]
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError("deck index out of range")
+
+        card = self._card_at(position)
+        if card is None:
+            page = self._pages.get(position // self.page_size)
+            if not self.random_order or not page:
+                raise IndexError("deck index out of range")
+            card = page[position % len(page)]
+        return card
+
+    def _card_at(self, position):
+        """
+        The card at position, or None if it has been deleted since the deck was opened
+        """
+        page_number = position // self.page_size
+        page = self._pages.get(page_number)
+        if page is None:
+            page = self._load_page(page_number)
+            self._pages[page_number] = page
+            self._evict(page_number)
+        offset = position % self.page_size
+        if offset < len(page):
+            return page[offset]
+        if not self.random_order:
+            # sequential pages are filled from the following sets, so only the last one falls short
+            self._length = min(self._length, page_number * self.page_size + len(page))
+        return None
+
+    def _evict(self, page_number):
+        for number in list(self._pages):
+            if abs(number - page_number) > self.window_pages:
+                del self._pages[number]
+
+    def _load_page(self, page_number):
+        if self.random_order:
+            return self._load_random_page(page_number)
+
+        # pages are only ever reached one after another, so the previous page says where this one starts
+        while len(self._page_starts) <= page_number:
+            self._load_sequential_page(len(self._page_starts) - 1)
+        return self._load_sequential_page(page_number)
+
+    def _load_sequential_page(self, page_number):
+        set_index, after_id = self._page_starts[page_number]
+        cards = []
+        with self.engine.connect() as connection:
+            while len(cards) < self.page_size and set_index < len(self.set_ids):
+                needed = self.page_size - len(cards)
+                rows = connection.execute(
+                    select(*CARD_COLUMNS)
+                    .where(*self._criteria([self.set_ids[set_index]]), Flashcard.id > after_id)
+                    .order_by(Flashcard.id)
+                    .limit(needed)
+                ).all()
+                cards.extend(CardRecord.from_row(row) for row in rows if row.id not in self._hidden_ids)
+                if len(rows) < needed:
+                    set_index, after_id = set_index + 1, 0
+                else:
+                    after_id = rows[-1].id
+
+        if page_number + 1 == len(self._page_starts):
+            self._page_starts.append((set_index, after_id))
+        return cards
+
+    def _load_random_page(self, page_number):
+        start = page_number * self.page_size
+        positions = range(start, min(start + self.page_size, self._length))
+        card_ids = [self._card_ids[self._permutation[position]] for position in positions]
+
+        with self.engine.connect() as connection:
+            rows = {}
+            for i in range(0, len(card_ids), MAX_IN_PARAMS):
+                for row in connection.execute(select(*CARD_COLUMNS).where(Flashcard.id.in_(card_ids[i:i+MAX_IN_PARAMS]))):
+                    rows[row.id] = row
+        return [CardRecord.from_row(rows[card_id]) for card_id in card_ids if card_id in rows]
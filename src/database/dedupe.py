@@ -0,0 +1,163 @@
+"""
+Duplicate detection for flashcards by a hash of their normalized content.
+
+Every card stores content_hash, a hash of its term and definition after Unicode
+normalization, case folding and collapsing whitespace, so "The  Cell" and "the cell" are the
+same card. The hash is indexed, which lets duplicates be found by grouping in SQL instead of
+comparing cards in Python.
+
+- Duplicates within one set are merged: the card which has been reviewed the most (the
+  oldest on a tie) is kept, the review history of the others is moved onto it and they are
+  deleted. Only cards which are both excluded or both included are merged, and cards synced
+  from Notion never are, since their pages would bring them back.
+- Other duplicates are linked: each card is kept, but a deck only shows the first of them.
+  See DeckCursor.
+
+Imports and syncs run dedupe_cards() over the sets they touched. To check the whole
+database, run from the src folder: python -m database.dedupe [--dry-run]
+"""
+
+import hashlib
+import time
+import unicodedata
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Engine
+
+from .deck import MAX_IN_PARAMS
+
+
+class MergedDuplicates(NamedTuple):
+    set_id: int
+    kept_id: int
+    removed_ids: list[int]
+
+
+class LinkedDuplicates(NamedTuple):
+    content_hash: str
+    card_ids: list[int]
+    set_ids: list[int]
+
+
+class DedupeReport(NamedTuple):
+    merged: list[MergedDuplicates]
+    linked: list[LinkedDuplicates]
+    seconds: float
+
+    @property
+    def cards_removed(self):
+        return sum(len(group.removed_ids) for group in self.merged)
+
+
+def normalize_text(value: Optional[str]) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', value or '').casefold().split())
+
+
+def content_hash(term: Optional[str], definition: Optional[str]) -> str:
+    """
+    Hash identifying a card by its normalized term and definition
+    """
+    content = f'{normalize_text(term)}\x1f{normalize_text(definition)}'
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# the cards of each (hash, set) group which aren't kept, along with the one which is. One pass
+# over the cards in content_hash order, which ix_flashcards_content_hash already provides
+MERGE_QUERY = """
+    SELECT id, set_id, kept_id FROM (
+        SELECT id, set_id,
+               first_value(id) OVER (PARTITION BY content_hash, set_id, exclude ORDER BY repetitions DESC, id) AS kept_id
+        FROM flashcards
+        WHERE content_hash IS NOT NULL AND notion_page_id IS NULL {scope}
+    )
+    WHERE id != kept_id
+    ORDER BY set_id, kept_id, id
+"""
+
+LINK_QUERY = """
+    SELECT content_hash, group_concat(id), group_concat(set_id)
+    FROM (
+        SELECT id, set_id, content_hash FROM flashcards
+        WHERE content_hash IN (SELECT content_hash FROM flashcards WHERE content_hash IS NOT NULL {scope})
+        ORDER BY content_hash, id
+    )
+    GROUP BY content_hash
+    HAVING count(DISTINCT set_id) > 1
+"""
+
+
+def _scoped(query: str, set_ids: Optional[list[int]]):
+    if set_ids is None:
+        return text(query.format(scope=''))
+    return text(query.format(scope='AND set_id IN :set_ids')).bindparams(bindparam('set_ids', expanding=True))
+
+
+def dedupe_cards(engine: Engine, set_ids=None, dry_run: bool = False) -> DedupeReport:
+    """
+    Merge the duplicates within each of the given sets, every set if set_ids is None, and
+    report which of their cards are duplicated in other sets. With dry_run nothing is changed.
+    """
+    start = time.perf_counter()
+    set_ids = sorted(set(set_ids)) if set_ids is not None else None
+    chunks = [None] if set_ids is None else [set_ids[i:i+MAX_IN_PARAMS] for i in range(0, len(set_ids), MAX_IN_PARAMS)]
+
+    merged = []
+    linked = {}
+    with engine.begin() as connection:
+        for chunk in chunks:
+            parameters = {'set_ids': chunk} if chunk is not None else {}
+
+            group = None
+            for card_id, set_id, kept_id in connection.execute(_scoped(MERGE_QUERY, chunk), parameters):
+                if group is None or group.kept_id != kept_id:
+                    group = MergedDuplicates(set_id, kept_id, [])
+                    merged.append(group)
+                group.removed_ids.append(card_id)
+
+            for content, card_ids, card_set_ids in connection.execute(_scoped(LINK_QUERY, chunk), parameters):
+                linked[content] = LinkedDuplicates(content, [int(card_id) for card_id in card_ids.split(',')],
+                                                   sorted({int(set_id) for set_id in card_set_ids.split(',')}))
+
+        if not dry_run:
+            moves = [{'card_id': card_id, 'kept_id': group.kept_id} for group in merged for card_id in group.removed_ids]
+            if moves:
+                connection.execute(text("UPDATE review_log SET card_id = :kept_id WHERE card_id = :card_id"), moves)
+                connection.execute(text("DELETE FROM flashcards WHERE id = :card_id"), moves)
+
+    # cards which were merged away are no longer part of the links
+    removed = {card_id for group in merged for card_id in group.removed_ids} if not dry_run else set()
+    links = []
+    for group in linked.values():
+        card_ids = [card_id for card_id in group.card_ids if card_id not in removed]
+        if len(card_ids) > 1:
+            links.append(group._replace(card_ids=card_ids))
+
+    return DedupeReport(merged, links, time.perf_counter() - start)
+
+
+def main():
+    import argparse
+
+    from .manager import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Merge duplicate cards within sets and list those shared between sets")
+    parser.add_argument('--dry-run', action='store_true', help="only report what would be merged")
+    parser.add_argument('--verbose', action='store_true', help="list every duplicate")
+    args = parser.parse_args()
+
+    manager = DatabaseManager()
+    manager.ensure_db_upgraded()
+    report = manager.dedupe_cards(dry_run=args.dry_run)
+
+    if args.verbose:
+        for group in report.merged:
+            print(f"set {group.set_id}: card {group.kept_id} kept, {', '.join(map(str, group.removed_ids))} merged into it")
+        for group in report.linked:
+            print(f"cards {', '.join(map(str, group.card_ids))} are the same card in sets {', '.join(map(str, group.set_ids))}")
+    print(f"{'Would merge' if args.dry_run else 'Merged'} {report.cards_removed} duplicate cards in {len(report.merged)} groups. "
+          f"{len(report.linked)} cards are shared between sets. Took {report.seconds:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+One long-lived, tuned SQLAlchemy engine and session factory per database, shared by the
+whole process.
+
+SQLite is put in WAL mode so that readers (the UI) and a writer (imports, review logging)
+can work at the same time, and connections wait for locks instead of failing straight away
+with "database is locked".
+"""
+
+import os
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+# applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # readers don't block the writer and the writer doesn't block readers
+    'synchronous': 'NORMAL',  # safe in WAL mode. Only the last commits can be lost on power failure
+    'cache_size': -64000,  # negative values are KiB, so 64 MiB of page cache per connection
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 30000,  # ms to wait for a lock held by another connection
+}
+
+# connections kept open, plus how many more may be opened under load. SQLite connections
+# are cheap, but reusing them keeps their page cache warm.
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 30
+
+_lock = threading.Lock()
+_engines: dict[tuple[int, str], Engine] = {}
+_session_factories: dict[tuple[int, str], sessionmaker] = {}
+
+
+def _configure_sqlite(engine: Engine):
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        # let SQLAlchemy decide when transactions begin instead of the sqlite3 module,
+        # which doesn't start them before SELECTs and so gives inconsistent reads
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(connection):
+        connection.exec_driver_sql('BEGIN')
+
+
+def get_engine(database_url: str) -> Engine:
+    """
+    The engine for database_url, created on first use. Engines are per process, since pooled
+    connections must not be shared with forked worker processes.
+    """
+    key = (os.getpid(), database_url)
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            if database_url.startswith('sqlite'):
+                engine = create_engine(
+                    database_url,
+                    poolclass=QueuePool,
+                    pool_size=POOL_SIZE,
+                    max_overflow=MAX_OVERFLOW,
+                    pool_timeout=POOL_TIMEOUT,
+                    # connections are handed between the Tk thread and background workers
+                    connect_args={'check_same_thread': False, 'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000},
+                )
+                _configure_sqlite(engine)
+            else:
+                engine = create_engine(database_url, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+            _engines[key] = engine
+        return engine
+
+
+def get_session_factory(database_url: str) -> sessionmaker:
+    key = (os.getpid(), database_url)
+    engine = get_engine(database_url)
+    with _lock:
+        factory = _session_factories.get(key)
+        if factory is None:
+            factory = _session_factories[key] = sessionmaker(bind=engine)
+        return factory
+
+
+def dispose_engine(database_url: str):
+    """
+    Close every pooled connection to the database and forget its engine
+    """
+    key = (os.getpid(), database_url)
+    with _lock:
+        _session_factories.pop(key, None)
+        engine = _engines.pop(key, None)
+    if engine is not None:
+        engine.dispose()
@@ -0,0 +1,373 @@
+"""
+Streaming export of flashcard sets to CSV files and Anki packages.
+
+Cards are read with yield_per in index order of (set, card id), so only one batch of cards
+is in memory at a time however large the export is, and nothing has to be sorted.
+
+- CSV: one file per set, named after the set, in the layout described in the README
+  (Term | Definition | Exclude, with a header row), so the files can be imported again
+- Anki: a single .apkg holding one deck per set, named "course::set" for sets with a
+  course. Excluded cards are suspended, and cards which have been reviewed keep their
+  spaced repetition schedule. The collection is written to a temporary SQLite file and then
+  streamed into the package.
+
+Usage (from the src folder):
+python -m database.export {csv,apkg} OUTPUT [--set NAME_OR_ID ...] [--course NAME] [--no-excluded]
+Without --set or --course every set is exported. OUTPUT is a folder for csv and a file for apkg.
+"""
+
+import csv
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+import tempfile
+import time
+from typing import Callable, Iterator, NamedTuple, Optional
+import zipfile
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Connection, Engine
+
+from .deck import MAX_IN_PARAMS
+from .models import Flashcard, FlashcardSet
+
+DEFAULT_BATCH_SIZE = 10_000  # cards read from the database at a time
+
+# characters which can't be used in file names on at least one platform
+UNSAFE_FILENAME = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+EXPORT_COLUMNS = (Flashcard.id, Flashcard.set_id, Flashcard.term, Flashcard.definition, Flashcard.exclude,
+                  Flashcard.ease, Flashcard.interval, Flashcard.repetitions, Flashcard.due)
+
+
+class ExportReport(NamedTuple):
+    paths: list[str]  # files written
+    sets: int
+    cards: int
+    seconds: float
+
+    @property
+    def cards_per_second(self):
+        return self.cards / self.seconds if self.seconds else 0.0
+
+
+def select_sets(connection: Connection, set_ids=None, course_name: str = None) -> list:
+    """
+    (id, name, course_name) of the sets to export, in id order. Every set if neither set_ids
+    nor course_name is given.
+    """
+    query = select(FlashcardSet.id, FlashcardSet.name, FlashcardSet.course_name).order_by(FlashcardSet.id)
+    if course_name is not None:
+        query = query.where(FlashcardSet.course_name == course_name)
+    sets = connection.execute(query).all()
+    if set_ids is not None:
+        set_ids = set(set_ids)
+        sets = [row for row in sets if row.id in set_ids]
+    return sets
+
+
+def count_cards(connection: Connection, set_ids: list[int], include_excluded: bool) -> int:
+    total = 0
+    for i in range(0, len(set_ids), MAX_IN_PARAMS):
+        query = select(func.count()).select_from(Flashcard).where(Flashcard.set_id.in_(set_ids[i:i+MAX_IN_PARAMS]))
+        if not include_excluded:
+            query = query.where(Flashcard.exclude.isnot(True))
+        total += connection.execute(query).scalar()
+    return total
+
+
+def stream_cards(connection: Connection, set_ids: list[int], include_excluded: bool,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list]:
+    """
+    Batches of the cards of the given sets, ordered by set and then card id
+    """
+    for i in range(0, len(set_ids), MAX_IN_PARAMS):
+        query = select(*EXPORT_COLUMNS).where(Flashcard.set_id.in_(set_ids[i:i+MAX_IN_PARAMS]))
+        if not include_excluded:
+            query = query.where(Flashcard.exclude.isnot(True))
+        result = connection.execution_options(yield_per=batch_size).execute(query.order_by(Flashcard.set_id, Flashcard.id))
+        for partition in result.partitions():
+            yield partition
+
+
+def safe_filename(name: str) -> str:
+    return UNSAFE_FILENAME.sub('_', name).strip(' .') or 'untitled'
+
+
+def export_csv(engine: Engine, folder: os.PathLike, set_ids=None, course_name: str = None, include_excluded: bool = True,
+               batch_size: int = DEFAULT_BATCH_SIZE, progress: Callable[[int, int], None] = None) -> ExportReport:
+    """
+    Write each set to a CSV file named after it in folder. Sets with the same name get their
+    id added to the file name. progress, if given, is called with the number of cards written
+    so far and the total after every batch.
+    """
+    start = time.perf_counter()
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    with engine.connect() as connection:
+        sets = select_sets(connection, set_ids, course_name)
+        set_ids = [row.id for row in sets]
+        total = count_cards(connection, set_ids, include_excluded)
+
+        paths = {}
+        used_names = set()
+        for row in sets:
+            name = safe_filename(row.name or f'set {row.id}')
+            if name.lower() in used_names:
+                name = f'{name} ({row.id})'
+            used_names.add(name.lower())
+            paths[row.id] = folder / f'{name}.csv'
+
+        written = 0
+        fp = writer = None
+        current_set_id = None
+        opened = set()
+        try:
+            for batch in stream_cards(connection, set_ids, include_excluded, batch_size):
+                for card in batch:
+                    if card.set_id != current_set_id:
+                        if fp is not None:
+                            fp.close()
+                        current_set_id = card.set_id
+                        fp = open(paths[current_set_id], 'w', newline='', encoding='utf-8')
+                        opened.add(current_set_id)
+                        writer = csv.writer(fp)
+                        writer.writerow(['Term', 'Definition', 'Exclude'])
+                    writer.writerow([card.term or '', card.definition or '', 'True' if card.exclude else 'False'])
+                written += len(batch)
+                if progress:
+                    progress(written, total)
+        finally:
+            if fp is not None:
+                fp.close()
+
+    # sets without any cards to export still get a file, so that every set is accounted for
+    for set_id, path in paths.items():
+        if set_id not in opened:
+            with open(path, 'w', newline='', encoding='utf-8') as fp:
+                csv.writer(fp).writerow(['Term', 'Definition', 'Exclude'])
+
+    return ExportReport([str(path) for path in paths.values()], len(sets), written, time.perf_counter() - start)
+
+
+# Anki packages
+
+ANKI_SCHEMA = """
+CREATE TABLE col (id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+                  ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+                  conf text not null, models text not null, decks text not null, dconf text not null, tags text not null);
+CREATE TABLE notes (id integer primary key, guid text not null, mid integer not null, mod integer not null,
+                    usn integer not null, tags text not null, flds text not null, sfld integer not null,
+                    csum integer not null, flags integer not null, data text not null);
+CREATE TABLE cards (id integer primary key, nid integer not null, did integer not null, ord integer not null,
+                    mod integer not null, usn integer not null, type integer not null, queue integer not null,
+                    due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+                    lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+                    flags integer not null, data text not null);
+CREATE TABLE revlog (id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+                     ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+                     type integer not null);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+"""
+
+# created once the rows are in, which is much faster than keeping them up to date while inserting
+ANKI_INDEXES = """
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+ANKI_SCHEMA_VERSION = 11
+ANKI_MODEL_ID = 1627347600000  # fixed, so that exporting again updates the notes of earlier imports
+ANKI_DEFAULT_DECK_ID = 1
+ANKI_DECK_ID_BASE = 1627347600000
+
+ANKI_CARD_CSS = ".card { font-family: arial; font-size: 20px; text-align: center; color: black; background-color: white; }"
+
+
+def anki_model(now: int) -> dict:
+    fields = [
+        {'name': name, 'ord': i, 'sticky': False, 'rtl': False, 'font': 'Arial', 'size': 20, 'media': []}
+        for i, name in enumerate(('Term', 'Definition'))
+    ]
+    return {
+        'id': ANKI_MODEL_ID, 'name': 'Flashcard-Tool', 'type': 0, 'mod': now, 'usn': -1, 'sortf': 0,
+        'did': ANKI_DEFAULT_DECK_ID, 'tags': [], 'vers': [], 'flds': fields, 'css': ANKI_CARD_CSS,
+        'tmpls': [{'name': 'Card 1', 'ord': 0, 'qfmt': '{{Term}}', 'afmt': '{{FrontSide}}<hr id=answer>{{Definition}}',
+                   'did': None, 'bqfmt': '', 'bafmt': ''}],
+        'latexPre': '\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage{amssymb,amsmath}\n'
+                    '\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n',
+        'latexPost': '\\end{document}',
+        'req': [[0, 'any', [0]]],
+    }
+
+
+def anki_deck(deck_id: int, name: str, now: int) -> dict:
+    return {
+        'id': deck_id, 'name': name, 'mod': now, 'usn': -1, 'desc': '', 'dyn': 0, 'conf': 1, 'collapsed': False,
+        'newToday': [0, 0], 'revToday': [0, 0], 'lrnToday': [0, 0], 'timeToday': [0, 0],
+        'extendNew': 10, 'extendRev': 50,
+    }
+
+
+def anki_deck_options() -> dict:
+    return {'1': {
+        'id': 1, 'name': 'Default', 'mod': 0, 'usn': 0, 'maxTaken': 60, 'autoplay': True, 'timer': 0, 'replayq': True,
+        'dyn': False,
+        'new': {'delays': [1, 10], 'ints': [1, 4, 7], 'initialFactor': 2500, 'order': 1, 'perDay': 20, 'bury': True},
+        'rev': {'perDay': 200, 'ease4': 1.3, 'fuzz': 0.05, 'ivlFct': 1, 'maxIvl': 36500, 'bury': True},
+        'lapse': {'delays': [10], 'mult': 0, 'minInt': 1, 'leechFails': 8, 'leechAction': 0},
+    }}
+
+
+def anki_guid(card_id: int) -> str:
+    # stable per card, so that Anki recognises cards it has imported before
+    return hashlib.sha1(f'flashcard-tool:{card_id}'.encode()).hexdigest()[:10]
+
+
+def anki_checksum(text: str) -> int:
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def anki_field(text: Optional[str]) -> str:
+    # fields are HTML
+    return (text or '').replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\n', '<br>')
+
+
+def export_apkg(engine: Engine, path: os.PathLike, set_ids=None, course_name: str = None, include_excluded: bool = True,
+                batch_size: int = DEFAULT_BATCH_SIZE, progress: Callable[[int, int], None] = None) -> ExportReport:
+    """
+    Write the sets to an Anki package with one deck per set. progress, if given, is called
+    with the number of cards written so far and the total after every batch.
+    """
+    start = time.perf_counter()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    now = int(time.time())
+    # Anki schedules reviews in days since the collection was created
+    created = now - now % 86400
+
+    with tempfile.TemporaryDirectory(dir=path.parent) as directory:
+        collection_path = Path(directory) / 'collection.anki2'
+        collection = sqlite3.connect(collection_path)
+        try:
+            # a throwaway file, so durability doesn't matter
+            collection.execute('PRAGMA journal_mode=OFF')
+            collection.execute('PRAGMA synchronous=OFF')
+            collection.executescript(ANKI_SCHEMA)
+
+            with engine.connect() as connection:
+                sets = select_sets(connection, set_ids, course_name)
+                set_ids = [row.id for row in sets]
+                total = count_cards(connection, set_ids, include_excluded)
+
+                decks = {str(ANKI_DEFAULT_DECK_ID): anki_deck(ANKI_DEFAULT_DECK_ID, 'Default', now)}
+                deck_ids = {}
+                for row in sets:
+                    deck_ids[row.id] = ANKI_DECK_ID_BASE + row.id
+                    name = row.name or f'set {row.id}'
+                    if row.course_name:
+                        name = f'{row.course_name}::{name}'
+                    decks[str(deck_ids[row.id])] = anki_deck(deck_ids[row.id], name, now)
+
+                conf = {'nextPos': total + 1, 'estTimes': True, 'activeDecks': [ANKI_DEFAULT_DECK_ID], 'sortType': 'noteFld',
+                        'timeLim': 0, 'sortBackwards': False, 'addToCur': True, 'curDeck': ANKI_DEFAULT_DECK_ID,
+                        'newBury': True, 'newSpread': 0, 'dueCounts': True, 'curModel': str(ANKI_MODEL_ID),
+                        'collapseTime': 1200}
+                collection.execute(
+                    'INSERT INTO col VALUES (1, ?, ?, ?, ?, 0, 0, 0, ?, ?, ?, ?, ?)',
+                    (created, now * 1000, now * 1000, ANKI_SCHEMA_VERSION, json.dumps(conf),
+                     json.dumps({str(ANKI_MODEL_ID): anki_model(now)}), json.dumps(decks), json.dumps(anki_deck_options()), '{}')
+                )
+
+                written = 0
+                # note and card ids are millisecond timestamps in Anki, and must be unique
+                first_id = now * 1000
+                for batch in stream_cards(connection, set_ids, include_excluded, batch_size):
+                    notes, cards = [], []
+                    for card in batch:
+                        written += 1
+                        item_id = first_id + written
+                        term = anki_field(card.term)
+                        notes.append((item_id, anki_guid(card.id), ANKI_MODEL_ID, now, -1, '',
+                                      f'{term}\x1f{anki_field(card.definition)}', term, anki_checksum(term), 0, ''))
+                        if card.due is not None and card.repetitions:
+                            # a review card, due in days since the collection was created
+                            card_type, due = 2, max(0, (card.due - created) // 86400)
+                            interval, factor = max(1, round(card.interval or 0)), int((card.ease or 2.5) * 1000)
+                        else:
+                            card_type, due, interval, factor = 0, written, 0, 0
+                        queue = -1 if card.exclude else card_type  # excluded cards are suspended
+                        cards.append((item_id, item_id, deck_ids[card.set_id], 0, now, -1, card_type, queue, due,
+                                      interval, factor, card.repetitions or 0, 0, 0, 0, 0, 0, ''))
+                    collection.executemany('INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', notes)
+                    collection.executemany('INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', cards)
+                    if progress:
+                        progress(written, total)
+
+            collection.executescript(ANKI_INDEXES)
+            collection.commit()
+        finally:
+            collection.close()
+
+        # write to a temporary file first so that a partially written package is never left behind
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        # the fastest level of compression, which is most of the saving for text at a fraction of the time
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as package:
+            package.write(collection_path, 'collection.anki2')
+            package.writestr('media', '{}')  # no media files
+        os.replace(tmp_path, path)
+
+    return ExportReport([str(path)], len(sets), written, time.perf_counter() - start)
+
+
+def main():
+    import argparse
+    import sys
+
+    from .manager import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Export flashcard sets to CSV files or an Anki package")
+    parser.add_argument('format', choices=('csv', 'apkg'))
+    parser.add_argument('output', type=Path, help="folder to write CSV files to, or the .apkg file to write")
+    parser.add_argument('--set', dest='sets', action='append', default=None, help="name or id of a set to export. May be repeated")
+    parser.add_argument('--course', default=None, help="export the sets of this course")
+    parser.add_argument('--no-excluded', action='store_true', help="leave out excluded cards")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="cards read from the database at a time")
+    args = parser.parse_args()
+
+    manager = DatabaseManager()
+    manager.ensure_db_upgraded()
+
+    set_ids = None
+    if args.sets:
+        summaries = manager.get_set_summaries()
+        set_ids = []
+        for wanted in args.sets:
+            matches = [summary.id for summary in summaries if str(summary.id) == wanted or summary.name == wanted]
+            if not matches:
+                parser.error(f"no set called {wanted!r}")
+            set_ids.extend(matches)
+
+    def print_progress(written, total):
+        percent = written / total * 100 if total else 100
+        print(f"\r{written}/{total} cards ({percent:.0f}%)", end='', file=sys.stderr, flush=True)
+
+    export = manager.export_csv if args.format == 'csv' else manager.export_apkg
+    report = export(args.output, set_ids=set_ids, course_name=args.course, include_excluded=not args.no_excluded,
+                    batch_size=args.batch_size, progress=print_progress)
+    print(file=sys.stderr)
+    print(f"Exported {report.cards} cards from {report.sets} sets in {report.seconds:.2f}s "
+          f"({report.cards_per_second:.0f} cards/sec) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
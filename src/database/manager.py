@@ -1,13 +1,20 @@
+import ast
 import os
+import re
 import sys
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from alembic.config import Config
-from alembic import command
+from sqlalchemy import bindparam, case, func, select, text, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
 
-from .models import Base, FlashcardSet, Flashcard
+from .deck import CARD_COLUMNS, MAX_IN_PARAMS, DeckCursor
+from .engine import dispose_engine, get_engine, get_session_factory
+from .models import Base, FlashcardSet, Flashcard, CsvManifestEntry, NotionSyncState, ReviewLog
+from .scheduler import next_schedule
+from .records import CardRecord, SearchResult, SetSummary
 
 root_path = Path(__file__).parent.parent.parent
 
@@ -23,49 +30,422 @@ src_path_str = str(src_path)
 if src_path_str not in sys.path:
     sys.path.insert(0, src_path_str)
 
+from metrics import timed  # noqa: E402
+
 DATABASE_NAME = "flashcards.db"
+DATABASE_URL = f"sqlite:///{DATABASE_NAME}"
+
+# the write-behind journal of a database is kept next to it, under its name plus this
+WRITE_BEHIND_SUFFIX = ".write-behind"
 
 alembic_cfg_path = root_path / "alembic.ini"
+migrations_path = root_path / "alembic" / "versions"
+
+if TYPE_CHECKING:
+    from alembic.config import Config
+
+    from .write_behind import WriteBehindQueue
+
+# the revision identifiers assigned at the top of each migration script
+REVISION_PATTERN = re.compile(r"^(revision|down_revision)\b[^=]*=\s*(.+)$", re.MULTILINE)
+
+
+def head_revisions(versions_path: Path = migrations_path) -> Optional[set[str]]:
+    """
+    Revisions of the migration scripts which no other script builds on, read straight from the
+    scripts since importing Alembic takes a while. None if any script can't be understood.
+    """
+    revisions, parents = set(), set()
+    for path in versions_path.glob('*.py'):
+        identifiers = dict(REVISION_PATTERN.findall(path.read_text(encoding='utf-8')))
+        try:
+            revision = ast.literal_eval(identifiers['revision'])
+            down_revision = ast.literal_eval(identifiers['down_revision'])
+        except (KeyError, ValueError, SyntaxError):
+            return None
+        revisions.add(revision)
+        if isinstance(down_revision, str):
+            parents.add(down_revision)
+        elif down_revision:
+            parents.update(down_revision)
+    return revisions - parents or None
+
+
+def build_fts_query(query: str) -> str:
+    """
+    Turn what the user typed into an FTS5 query matching cards containing every word. Words
+    are quoted so punctuation can't be taken as query syntax, and the last word matches as a
+    prefix so results show up while it is still being typed.
+    """
+    words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
 
-alembic_cfg = Config(alembic_cfg_path)
+def apply_reviews(connection, answers) -> list:
+    """
+    Reschedule cards and log the answers on connection, within the caller's transaction.
+    answers are (card id, knew it, unix time answered), applied in order. Returns the new
+    schedule for each answer, None where there is no such card.
+    """
+    answers = list(answers)
+    card_ids = list({card_id for card_id, _, _ in answers})
+    # card id -> (ease, interval, repetitions), updated as answers to the card are applied
+    states = {}
+    for i in range(0, len(card_ids), MAX_IN_PARAMS):
+        rows = connection.execute(select(Flashcard.id, Flashcard.ease, Flashcard.interval, Flashcard.repetitions)
+                                  .where(Flashcard.id.in_(card_ids[i:i+MAX_IN_PARAMS])))
+        states.update((row.id, tuple(row[1:])) for row in rows)
+
+    schedules = []
+    for card_id, knew, reviewed_at in answers:
+        state = states.get(card_id)
+        schedule = next_schedule(*state, knew, reviewed_at) if state is not None else None
+        if schedule is not None:
+            states[card_id] = schedule[:3]
+        schedules.append(schedule)
+
+    recorded = [(answer, schedule) for answer, schedule in zip(answers, schedules) if schedule is not None]
+    if recorded:
+        connection.execute(
+            update(Flashcard).where(Flashcard.id == bindparam('card_id'))
+            .values(ease=bindparam('ease'), interval=bindparam('interval'), repetitions=bindparam('repetitions'), due=bindparam('due')),
+            [{'card_id': card_id, **schedule._asdict()} for (card_id, _, _), schedule in recorded]
+        )
+        connection.execute(ReviewLog.__table__.insert(), [
+            {'card_id': card_id, 'reviewed_at': reviewed_at, 'knew': knew, 'ease': schedule.ease, 'interval': schedule.interval,
+             'due': schedule.due}
+            for (card_id, knew, reviewed_at), schedule in recorded
+        ])
+    return schedules
 
 
 class DatabaseManager:
 
-    def __init__(self):
-        """Initializes the DatabaseManager with an engine."""
-        self.engine = create_engine(f"sqlite:///{DATABASE_NAME}")
+    def __init__(self, database_url: str = DATABASE_URL):
+        """Initializes the DatabaseManager with the shared engine for the database."""
+        self.database_url = database_url
+        self.engine = get_engine(database_url)
+        self.Session = get_session_factory(database_url)
 
     def create_session(self):
         """Creates a new session with the bound engine."""
         if not self.engine:
             raise ValueError("Database engine is not initialized.")
 
-        Session = sessionmaker(bind=self.engine)
-        return Session()
+        return self.Session()
+
+    @timed('db.get_set_summaries')
+    def get_set_summaries(self) -> list[SetSummary]:
+        """
+        Id, name and card counts of every flashcard set, ordered by name. The cards themselves
+        are not loaded.
+        """
+        with self.create_session() as session:
+            rows = session.query(
+                FlashcardSet.id,
+                FlashcardSet.name,
+                FlashcardSet.course_name,
+                func.count(Flashcard.id),
+                func.coalesce(func.sum(case((Flashcard.exclude.is_(True), 1), else_=0)), 0)
+            ).outerjoin(Flashcard, Flashcard.set_id == FlashcardSet.id)\
+             .group_by(FlashcardSet.id)\
+             .order_by(FlashcardSet.name, FlashcardSet.id)\
+             .all()
+
+        return [SetSummary(*row) for row in rows]
+
+    @timed('db.get_cards')
+    def get_cards(self, set_ids, include_excluded=False) -> list[CardRecord]:
+        """
+        Cards belonging to the given sets, ordered by set and then by id
+        """
+        set_ids = list(set_ids)
+        cards = []
+        with self.engine.connect() as connection:
+            for i in range(0, len(set_ids), MAX_IN_PARAMS):
+                query = select(*CARD_COLUMNS).where(Flashcard.set_id.in_(set_ids[i:i+MAX_IN_PARAMS]))
+                if not include_excluded:
+                    query = query.where(Flashcard.exclude.isnot(True))
+                result = connection.execute(query.order_by(Flashcard.set_id, Flashcard.id))
+                cards.extend(CardRecord.from_row(row) for row in result)
+
+        return cards
+
+    @timed('db.get_card')
+    def get_card(self, card_id: int) -> Optional[CardRecord]:
+        """
+        The card with the given id, or None if there isn't one
+        """
+        with self.engine.connect() as connection:
+            row = connection.execute(select(*CARD_COLUMNS).where(Flashcard.id == card_id)).first()
+        return CardRecord.from_row(row) if row is not None else None
+
+    @timed('db.open_deck')
+    def open_deck(self, set_ids, random_order=False, seed=None) -> DeckCursor:
+        """
+        The non-excluded cards of the given sets as a deck which is loaded a page at a time
+        while it is studied. See database.deck.
+        """
+        return DeckCursor(self.engine, set_ids, random_order=random_order, seed=seed)
+
+    @timed('db.get_due_cards')
+    def get_due_cards(self, set_ids, limit: int = 100, now: int = None, include_new=True) -> list[CardRecord]:
+        """
+        Up to limit cards from the given sets which are due for review, most overdue first.
+        If there aren't enough due cards, cards which have never been reviewed are added.
+        Both are range scans of the (set_id, due) index.
+        """
+        now = int(time.time()) if now is None else now
+        set_ids = list(set_ids)
+
+        def query_cards(connection, *criteria, order_by):
+            rows = []
+            for i in range(0, len(set_ids), MAX_IN_PARAMS):
+                rows.extend(connection.execute(
+                    select(*CARD_COLUMNS, Flashcard.due)
+                    .where(Flashcard.set_id.in_(set_ids[i:i+MAX_IN_PARAMS]), Flashcard.exclude.isnot(True), *criteria)
+                    .order_by(*order_by)
+                    .limit(limit)
+                ).all())
+            return rows
+
+        with self.engine.connect() as connection:
+            # each chunk of sets is limited separately, so merge them before limiting again
+            rows = query_cards(connection, Flashcard.due <= now, order_by=(Flashcard.due, Flashcard.id))
+            rows = sorted(rows, key=lambda row: (row.due, row.id))[:limit]
+            if include_new and len(rows) < limit:
+                new_rows = query_cards(connection, Flashcard.due.is_(None), order_by=(Flashcard.id,))
+                rows.extend(sorted(new_rows, key=lambda row: row.id)[:limit - len(rows)])
+
+        return [CardRecord.from_row(row) for row in rows]
+
+    @timed('db.record_review')
+    def record_review(self, card_id: int, knew: bool, now: int = None):
+        """
+        Reschedule a card after it has been answered and add the answer to the review log
+        """
+        now = int(time.time()) if now is None else now
+        with self.create_session() as session:
+            card = session.get(Flashcard, card_id)
+            if card is None:
+                return None
+            schedule = next_schedule(card.ease, card.interval, card.repetitions, knew, now)
+            card.ease, card.interval, card.repetitions, card.due = schedule
+            session.add(ReviewLog(card_id=card_id, reviewed_at=now, knew=knew,
+                                  ease=schedule.ease, interval=schedule.interval, due=schedule.due))
+            session.commit()
+        return schedule
+
+    @timed('db.record_reviews')
+    def record_reviews(self, answers, now: int = None) -> list:
+        """
+        record_review for many (card id, knew it) answers in one transaction. Returns the new
+        schedule for each answer, None where there is no such card.
+        """
+        now = int(time.time()) if now is None else now
+        with self.engine.begin() as connection:
+            return apply_reviews(connection, [(card_id, knew, now) for card_id, knew in answers])
+
+    def open_write_behind(self, journal_path=None, **options) -> 'WriteBehindQueue':
+        """
+        A queue which records answers and card edits on a background thread, journaled to
+        journal_path, by default next to the database. See database.write_behind.
+        """
+        from .write_behind import WriteBehindQueue
+
+        if journal_path is None:
+            database_path = make_url(self.database_url).database
+            if not database_path or database_path == ':memory:':
+                raise ValueError("journal_path must be given for databases which aren't SQLite files")
+            journal_path = f"{database_path}{WRITE_BEHIND_SUFFIX}"
+        return WriteBehindQueue(self.engine, journal_path, **options)
+
+    def attach_image(self, card_id: int, image) -> str:
+        """
+        Add an image (a file path or its bytes) to the image store and attach it to a card,
+        replacing any image it had. Returns the key of the image in the store.
+        """
+        from image_store import get_default_image_store
+
+        store = get_default_image_store()
+        key = store.put(image) if isinstance(image, bytes) else store.put_file(image)
+        with self.engine.begin() as connection:
+            connection.execute(update(Flashcard).where(Flashcard.id == card_id).values(image_hash=key))
+        return key
+
+    def detach_image(self, card_id: int):
+        with self.engine.begin() as connection:
+            connection.execute(update(Flashcard).where(Flashcard.id == card_id).values(image_hash=None))
+
+    def prune_images(self) -> int:
+        """
+        Remove stored images which no card is attached to. Returns how many were removed.
+        """
+        from image_store import get_default_image_store
+
+        store = get_default_image_store()
+        with self.engine.connect() as connection:
+            in_use = set(connection.execute(select(Flashcard.image_hash).where(Flashcard.image_hash.isnot(None)).distinct()).scalars())
+        unused = [key for key in store.keys() if key not in in_use]
+        for key in unused:
+            store.remove(key)
+        return len(unused)
+
+    @timed('db.search_cards')
+    def search_cards(self, query: str, limit: int = 50, offset: int = 0, set_ids=None, include_excluded=False) -> list[SearchResult]:
+        """
+        Cards whose term or definition contain every word of query, best matches first.
+        Use limit and offset to page through the results.
+        """
+        fts_query = build_fts_query(query)
+        if not fts_query:
+            return []
+
+        sql = """
+            SELECT flashcards.id, flashcards.term, flashcards.definition, flashcards.set_id, flashcards_fts.rank,
+                   flashcards.image_hash
+            FROM flashcards_fts
+            JOIN flashcards ON flashcards.id = flashcards_fts.rowid
+            WHERE flashcards_fts MATCH :query
+        """
+        parameters = {'query': fts_query, 'limit': limit, 'offset': offset}
+        if not include_excluded:
+            sql += " AND flashcards.exclude IS NOT 1"
+        if set_ids is not None:
+            sql += " AND flashcards.set_id IN :set_ids"
+            parameters['set_ids'] = list(set_ids)
+        sql += " ORDER BY flashcards_fts.rank LIMIT :limit OFFSET :offset"
+
+        statement = text(sql)
+        if set_ids is not None:
+            statement = statement.bindparams(bindparam('set_ids', expanding=True))
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(statement, parameters).all()
+
+        return [SearchResult(*row) for row in rows]
+
+    def import_csv_files(self, paths, workers=None, chunk_size=None, course_name=None, progress=None):
+        """
+        Import CSV flashcard files as new sets. See database.csv_import for details.
+        """
+        from .csv_import import DEFAULT_CHUNK_SIZE, import_csv_files
+
+        return import_csv_files(
+            self.database_url,
+            paths,
+            workers=workers,
+            chunk_size=chunk_size or DEFAULT_CHUNK_SIZE,
+            course_name=course_name,
+            progress=progress
+        )
+
+    @timed('db.sync_csv_folder')
+    def sync_csv_folder(self, folder, workers=None):
+        """
+        Import new CSV files from folder and apply changes made to previously imported ones.
+        See database.csv_sync for details.
+        """
+        from .csv_sync import sync_csv_folder
+
+        return sync_csv_folder(self.engine, folder, workers=workers)
+
+    @timed('db.dedupe_cards')
+    def dedupe_cards(self, set_ids=None, dry_run=False):
+        """
+        Merge duplicate cards within sets and find the cards shared between sets, in the given
+        sets or all of them. See database.dedupe for details.
+        """
+        from .dedupe import dedupe_cards
+
+        return dedupe_cards(self.engine, set_ids, dry_run=dry_run)
+
+    @timed('db.export_csv')
+    def export_csv(self, folder, set_ids=None, course_name=None, include_excluded=True, **options):
+        """
+        Write sets to CSV files in folder, every set if neither set_ids nor course_name is
+        given. See database.export for details.
+        """
+        from .export import export_csv
+
+        return export_csv(self.engine, folder, set_ids=set_ids, course_name=course_name,
+                          include_excluded=include_excluded, **options)
+
+    @timed('db.export_apkg')
+    def export_apkg(self, path, set_ids=None, course_name=None, include_excluded=True, **options):
+        """
+        Write sets to an Anki package, every set if neither set_ids nor course_name is given.
+        See database.export for details.
+        """
+        from .export import export_apkg
+
+        return export_apkg(self.engine, path, set_ids=set_ids, course_name=course_name,
+                           include_excluded=include_excluded, **options)
+
+    @timed('db.sync_notion')
+    def sync_notion(self, api_key: str, database_ids, full=False, **options):
+        """
+        Sync flashcard sets from Notion databases, fetching only pages edited since the last
+        sync unless full is True. See database.notion_sync for details.
+        """
+        # aiohttp takes a while to import and is only needed when syncing
+        from .notion_sync import sync_notion
+
+        return sync_notion(self.engine, api_key, database_ids, full=full, **options)
+
+    def alembic_config(self) -> 'Config':
+        """Alembic configuration pointing at this manager's database."""
+        from alembic.config import Config
+
+        config = Config(alembic_cfg_path)
+        config.set_main_option("script_location", str(root_path / "alembic"))
+        config.set_main_option("sqlalchemy.url", self.database_url)
+        return config
+
+    def current_revisions(self) -> set[str]:
+        """Revisions the database has been upgraded to. Empty for a new database."""
+        with self.engine.connect() as connection:
+            try:
+                return set(connection.execute(text("SELECT version_num FROM alembic_version")).scalars())
+            except OperationalError:  # no such table
+                return set()
+
+    def is_db_current(self) -> bool:
+        """Whether the database is already at the latest version."""
+        heads = head_revisions()
+        return heads is not None and self.current_revisions() == heads
+
+    @timed('db.ensure_db_upgraded')
+    def ensure_db_upgraded(self):
+        """
+        Ensures that the database is upgraded to the latest version. Alembic is only loaded and
+        run when the database is out of date.
+        """
+        if self.is_db_current():
+            return
+
+        from alembic import command
 
-    @staticmethod
-    def ensure_db_upgraded():
-        """Ensures that the database is upgraded to the latest version."""
-        command.upgrade(alembic_cfg, "head")
+        command.upgrade(self.alembic_config(), "head")
 
-    @staticmethod
-    def init_db():
+    def init_db(self):
         """Initializes the database and creates tables based on models."""
         try:
-            engine = create_engine(f"sqlite:///{DATABASE_NAME}")
-            Base.metadata.create_all(engine)
+            Base.metadata.create_all(self.engine)
         except Exception as e:
             # Log or print the exception for debugging
             print(f"An error occurred while initializing the database: {e}")
             raise e
 
-    @staticmethod
-    def flush_data():
+    def flush_data(self):
         """Removes all data from the database."""
         try:
-            engine = create_engine(f"sqlite:///{DATABASE_NAME}")
-            with sessionmaker(bind=engine)() as session:
+            with self.create_session() as session:
+                session.query(ReviewLog).delete()
+                session.query(CsvManifestEntry).delete()
+                session.query(NotionSyncState).delete()
                 session.query(FlashcardSet).delete()
                 session.query(Flashcard).delete()
                 session.commit()
@@ -74,16 +454,16 @@ class DatabaseManager:
             print(f"An error occurred while flushing the database: {e}")
             raise e
 
-    @staticmethod
-    def delete_db():
+    def delete_db(self):
         """Deletes the database."""
         try:
-            engine = create_engine(f"sqlite:///{DATABASE_NAME}")
-            engine.dispose()
-            Base.metadata.drop_all(engine)
-            # delete from disk
-            if os.path.exists(DATABASE_NAME):
-                os.remove(DATABASE_NAME)
+            Base.metadata.drop_all(self.engine)
+            dispose_engine(self.database_url)
+            # delete from disk, along with the write-ahead log and the write-behind journal
+            database_path = make_url(self.database_url).database
+            for path in (database_path, f"{database_path}-wal", f"{database_path}-shm", f"{database_path}{WRITE_BEHIND_SUFFIX}"):
+                if database_path and os.path.exists(path):
+                    os.remove(path)
         except Exception as e:
             # Log or print the exception for debugging
             print(f"An error occurred while deleting the database: {e}")
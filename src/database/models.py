@@ -1,10 +1,14 @@
 from sqlalchemy import (
+    BigInteger,
     Column,
     Integer,
     String,
     Boolean,
+    Float,
     ForeignKey,
-    Text
+    Index,
+    Text,
+    text
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -38,8 +42,36 @@ class Flashcard(Base):
     set_id = Column(Integer, ForeignKey('flashcard_sets.id',
                                         ondelete="SET NULL"))
 
+    # spaced repetition state. See database.scheduler
+    ease = Column(Float, default=2.5, server_default='2.5')
+    interval = Column(Float, default=0, server_default='0')  # days
+    repetitions = Column(Integer, default=0, server_default='0')  # correct answers in a row
+    due = Column(BigInteger, default=None)  # unix time. None if the card has never been reviewed
+
+    # sha256 of an image attached to the card, kept in the image store. See image_store
+    image_hash = Column(String(64), default=None)
+
+    # id of the Notion page the card was synced from. None for cards from CSV files
+    notion_page_id = Column(String(36), default=None)
+
+    # hash of the normalized term and definition, shared by duplicate cards. See database.dedupe
+    content_hash = Column(String(32), default=None)
+
     set = relationship("FlashcardSet", back_populates="flashcards")
 
+    __table_args__ = (
+        # entries are ordered by (set_id, id), so decks can be paged through a set without sorting.
+        # ix_flashcards_set_id_exclude can't do that, as its entries are ordered by exclude first
+        Index('ix_flashcards_set_id_included', 'set_id', sqlite_where=text('exclude IS NOT 1')),
+        Index('ix_flashcards_set_id_exclude', 'set_id', 'exclude'),
+        Index('ix_flashcards_course_name', 'course_name'),
+        # due cards of a set are a range scan
+        Index('ix_flashcards_set_id_due', 'set_id', 'due'),
+        Index('ix_flashcards_notion_page_id', 'notion_page_id', unique=True),
+        # duplicates of a card are a range scan, grouped by set
+        Index('ix_flashcards_content_hash', 'content_hash', 'set_id'),
+    )
+
     def __repr__(self):
         return f"<Flashcard(term='{self.term}', definition='{self.definition}', exclude={self.exclude})>"
 
@@ -54,3 +86,81 @@ class Flashcard(Base):
 
     def __hash__(self):
         return hash((self.term, self.definition))
+
+
+class ReviewLog(Base):
+    """
+    One answer given while studying a card, along with the schedule it resulted in
+    """
+    __tablename__ = 'review_log'
+
+    id = Column(Integer, primary_key=True,
+                autoincrement=True)
+    card_id = Column(Integer, ForeignKey('flashcards.id',
+                                         ondelete="CASCADE"), index=True)
+    reviewed_at = Column(BigInteger)  # unix time
+    knew = Column(Boolean)
+    ease = Column(Float)
+    interval = Column(Float)
+    due = Column(BigInteger)
+
+    card = relationship("Flashcard")
+
+    def __repr__(self):
+        return f"<ReviewLog(card_id={self.card_id}, knew={self.knew}, reviewed_at={self.reviewed_at})>"
+
+
+class CsvManifestEntry(Base):
+    """
+    A CSV file which has been imported from the flashcard folder. Used to only re-read files
+    which have changed since the last sync.
+    """
+    __tablename__ = 'csv_manifest'
+
+    # path of the file relative to the flashcard folder, using forward slashes
+    path = Column(String, primary_key=True)
+    mtime_ns = Column(BigInteger)
+    size = Column(BigInteger)
+    content_hash = Column(String)
+    set_id = Column(Integer, ForeignKey('flashcard_sets.id',
+                                        ondelete="CASCADE"))
+
+    set = relationship("FlashcardSet")
+
+    def __repr__(self):
+        return f"<CsvManifestEntry(path='{self.path}', set_id={self.set_id})>"
+
+
+class NotionSyncState(Base):
+    """
+    A Notion database which is synced into a flashcard set, and how far it has been synced.
+    See database.notion_sync.
+    """
+    __tablename__ = 'notion_sync_state'
+
+    database_id = Column(String(36), primary_key=True)
+    set_id = Column(Integer, ForeignKey('flashcard_sets.id',
+                                        ondelete="CASCADE"))
+    # latest last_edited_time seen, as the ISO 8601 string Notion returns
+    last_edited_time = Column(String, default=None)
+    synced_at = Column(BigInteger)  # unix time of the last successful sync
+
+    set = relationship("FlashcardSet")
+
+    def __repr__(self):
+        return f"<NotionSyncState(database_id='{self.database_id}', set_id={self.set_id})>"
+
+
+class WriteBehindCheckpoint(Base):
+    """
+    The last event of a write-behind journal which has been written to the database. See
+    database.write_behind.
+    """
+    __tablename__ = 'write_behind_checkpoint'
+
+    journal = Column(String, primary_key=True)  # file name of the journal
+    sequence = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(BigInteger)  # unix time
+
+    def __repr__(self):
+        return f"<WriteBehindCheckpoint(journal='{self.journal}', sequence={self.sequence})>"
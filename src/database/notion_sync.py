@@ -0,0 +1,544 @@
+"""
+Concurrent, incremental sync of Notion databases into flashcard sets.
+
+Each Notion database becomes one flashcard set named after the database, and each page in
+it one card. The term is the page's title, the definition a text property called Definition
+and a checkbox called Exclude excludes the card, matching the layout of the CSV files. A
+Course property, if there is one, fills in the card's course.
+
+A database is split into last_edited_time windows which several workers page through at
+once, each window with its own cursor. Pages are rarely spread evenly over time, so there
+are a few times more windows than workers and a worker which finishes early takes the next
+one. All requests go through a token bucket shared by every request so that the integration stays
+within Notion's rate limit. Rate limited and failed requests are retried with exponential
+backoff. Pages are upserted by their page id in batches, one transaction per batch, by a
+single writer so that SQLite never has two writers waiting on each other. Duplicate cards
+are linked afterwards, rather than merged, see database.dedupe.
+
+After the first sync only pages edited since the latest last_edited_time seen are fetched.
+Pages deleted in Notion don't show up in queries, so cards are only removed for them by a
+full sync, which fetches everything.
+
+Usage (from the src folder): python -m database.notion_sync [--full] [--config api_conf.json] [DATABASE_ID ...]
+The API key, database ids and optionally base_url are read from api_conf.json.
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import os
+from pathlib import Path
+import random
+import time
+from typing import Iterable, NamedTuple, Optional
+
+import aiohttp
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.engine import Engine
+
+from .deck import MAX_IN_PARAMS
+from .dedupe import DedupeReport, content_hash, dedupe_cards
+from .models import Flashcard, FlashcardSet, NotionSyncState
+
+NOTION_API_URL = 'https://api.notion.com/v1'
+NOTION_VERSION = '2022-06-28'
+
+PAGE_SIZE = 100  # most results the query endpoint returns at once
+DEFAULT_RATE = 3.0  # requests per second. Notion allows an average of three
+DEFAULT_BURST = 10  # requests which may be made at once after a pause
+DEFAULT_CONCURRENCY = 4  # windows of each database queried at the same time
+WINDOWS_PER_WORKER = 4
+MIN_WINDOW = timedelta(hours=1)
+DEFAULT_BATCH_SIZE = 1000  # pages written per transaction
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5  # seconds before the first retry, doubled for each one after
+BACKOFF_CAP = 30.0
+REQUEST_TIMEOUT = 60  # seconds
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFINITION_PROPERTY = 'definition'
+EXCLUDE_PROPERTY = 'exclude'
+COURSE_PROPERTY = 'course'
+
+# columns of a card which come from its page
+SYNCED_COLUMNS = (Flashcard.term, Flashcard.definition, Flashcard.exclude, Flashcard.course_name, Flashcard.set_id,
+                  Flashcard.content_hash)
+
+default_config_path = Path(__file__).parent.parent / 'api_conf.json'
+
+
+class NotionSyncError(Exception):
+    pass
+
+
+class DatabaseSyncResult(NamedTuple):
+    database_id: str
+    set_id: int
+    pages: int  # pages fetched from Notion
+    cards_inserted: int
+    cards_updated: int
+    cards_deleted: int
+    full: bool  # whether every page was fetched, rather than only those edited since the last sync
+
+
+class NotionSyncReport(NamedTuple):
+    databases: list[DatabaseSyncResult]
+    requests: int
+    seconds: float
+    duplicates: Optional[DedupeReport] = None  # duplicates found in the synced sets
+
+    @property
+    def pages(self):
+        return sum(result.pages for result in self.databases)
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing rate acquisitions per second on average and bursts of up to
+    capacity. Only for use within one event loop.
+    """
+
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self, seconds: float):
+        """
+        Take away the tokens which would build up over seconds, e.g. when told to back off
+        """
+        self._refill()
+        self.tokens -= seconds * self.rate
+
+
+class NotionClient:
+    """
+    The few endpoints of the Notion API the sync needs, with rate limiting and retries
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, api_key: str, base_url: str = NOTION_API_URL,
+                 rate_limiter: TokenBucket = None, max_retries: int = MAX_RETRIES):
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+        self.headers = {
+            'Authorization': f'Bearer {api_key}',
+            'Notion-Version': NOTION_VERSION,
+            'Content-Type': 'application/json',
+        }
+        self.rate_limiter = rate_limiter or TokenBucket(DEFAULT_RATE, DEFAULT_BURST)
+        self.max_retries = max_retries
+        self.requests = 0
+
+    async def request(self, method: str, path: str, body: dict = None) -> dict:
+        url = f'{self.base_url}/{path}'
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            self.requests += 1
+            delay = None
+            try:
+                async with self.session.request(method, url, json=body, headers=self.headers) as response:
+                    if response.status < 400:
+                        return await response.json()
+                    if response.status not in RETRY_STATUSES:
+                        raise NotionSyncError(f"{method} {path} failed with {response.status}: {await response.text()}")
+                    if response.status == 429 and 'Retry-After' in response.headers:
+                        try:
+                            delay = float(response.headers['Retry-After'])
+                        except ValueError:
+                            pass
+                        else:
+                            # every other request would be refused as well until then
+                            self.rate_limiter.drain(delay)
+                    error = f"{response.status} {response.reason}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+
+            if attempt == self.max_retries:
+                raise NotionSyncError(f"{method} {path} failed after {attempt + 1} attempts: {error}")
+            if delay is None:
+                # full jitter, so that concurrent requests which failed together don't retry together
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            await asyncio.sleep(delay)
+
+    async def get_database(self, database_id: str) -> dict:
+        return await self.request('GET', f'databases/{database_id}')
+
+    async def query_database(self, database_id: str, filter: dict = None, start_cursor: str = None) -> dict:
+        body = {'page_size': PAGE_SIZE}
+        if filter:
+            body['filter'] = filter
+        if start_cursor:
+            body['start_cursor'] = start_cursor
+        return await self.request('POST', f'databases/{database_id}/query', body)
+
+
+def parse_time(value: str) -> datetime:
+    # fromisoformat only understands a trailing Z from Python 3.11
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def format_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def time_windows(start: Optional[datetime], end: datetime, count: int) -> list[tuple[Optional[str], Optional[str]]]:
+    """
+    Split last_edited_time into up to count (on_or_after, before) windows which don't overlap
+    and together cover everything from start on. The first window is open at the start if
+    start is None and the last is always open at the end, so nothing edited during the sync is
+    missed. Windows are at least MIN_WINDOW long, so an incremental sync shortly after the
+    last one doesn't spend requests on empty windows.
+    """
+    if start is not None and end > start:
+        count = min(count, int((end - start) / MIN_WINDOW))
+    if start is None or count <= 1 or end <= start:
+        return [(format_time(start) if start is not None else None, None)]
+    step = (end - start) / count
+    bounds = [format_time(start + step * i) for i in range(1, count)]
+    return list(zip([format_time(start)] + bounds, bounds + [None]))
+
+
+def window_filter(on_or_after: Optional[str], before: Optional[str]) -> Optional[dict]:
+    conditions = []
+    if on_or_after is not None:
+        conditions.append({'timestamp': 'last_edited_time', 'last_edited_time': {'on_or_after': on_or_after}})
+    if before is not None:
+        conditions.append({'timestamp': 'last_edited_time', 'last_edited_time': {'before': before}})
+    if len(conditions) > 1:
+        return {'and': conditions}
+    return conditions[0] if conditions else None
+
+
+def plain_text(value) -> str:
+    """
+    The text of a property value or a list of rich text objects
+    """
+    if isinstance(value, list):
+        return ''.join(part.get('plain_text', '') for part in value)
+    if not isinstance(value, dict):
+        return ''
+    kind = value.get('type')
+    content = value.get(kind)
+    if kind in ('title', 'rich_text'):
+        return plain_text(content)
+    if kind in ('select', 'status'):
+        return content['name'] if content else ''
+    if kind == 'multi_select':
+        return ', '.join(option['name'] for option in content or [])
+    if kind == 'formula' and content:
+        content = content.get(content.get('type'))
+    if content is None:
+        return ''
+    return str(content)
+
+
+def page_to_row(page: dict) -> dict:
+    """
+    The card values of a page, with the page's id under notion_page_id
+    """
+    term = definition = ''
+    exclude = False
+    course_name = None
+    for name, value in page.get('properties', {}).items():
+        kind = value.get('type')
+        name = name.lower()
+        if kind == 'title':
+            term = plain_text(value).strip()
+        elif name == DEFINITION_PROPERTY:
+            definition = plain_text(value).strip()
+        elif name == EXCLUDE_PROPERTY:
+            exclude = bool(value.get('checkbox')) if kind == 'checkbox' else plain_text(value).strip().lower() == 'true'
+        elif name == COURSE_PROPERTY:
+            course_name = plain_text(value).strip() or None
+    return {'notion_page_id': page['id'], 'term': term, 'definition': definition, 'exclude': exclude,
+            'course_name': course_name, 'content_hash': content_hash(term, definition)}
+
+
+def is_deleted(page: dict) -> bool:
+    return bool(page.get('archived') or page.get('in_trash'))
+
+
+def load_state(engine: Engine, database_id: str) -> Optional[NotionSyncState]:
+    with engine.connect() as connection:
+        return connection.execute(
+            select(NotionSyncState.__table__).where(NotionSyncState.database_id == database_id)
+        ).first()
+
+
+def ensure_set(engine: Engine, database_id: str, name: str) -> int:
+    """
+    Id of the set a database is synced into, creating the set on the first sync. The set is
+    renamed along with the database.
+    """
+    with engine.begin() as connection:
+        set_id = connection.execute(
+            select(NotionSyncState.set_id).where(NotionSyncState.database_id == database_id)
+        ).scalar()
+        if set_id is not None and connection.execute(select(FlashcardSet.id).where(FlashcardSet.id == set_id)).first():
+            connection.execute(update(FlashcardSet).where(FlashcardSet.id == set_id).values(name=name))
+            return set_id
+
+        set_id = connection.execute(insert(FlashcardSet).values(name=name)).inserted_primary_key[0]
+        connection.execute(delete(NotionSyncState).where(NotionSyncState.database_id == database_id))
+        connection.execute(insert(NotionSyncState).values(database_id=database_id, set_id=set_id))
+        return set_id
+
+
+def write_pages(engine: Engine, set_id: int, pages: list[dict]) -> tuple[int, int, int]:
+    """
+    Upsert a batch of pages into a set in one transaction, and delete the cards of pages
+    which were deleted. Cards which already match their page aren't written, which keeps full
+    syncs cheap. Returns the number of cards inserted, updated and deleted.
+    """
+    rows = {}
+    deleted_ids = set()
+    for page in pages:
+        if is_deleted(page):
+            deleted_ids.add(page['id'])
+            rows.pop(page['id'], None)
+        else:
+            rows[page['id']] = page_to_row(page)
+            deleted_ids.discard(page['id'])
+
+    page_ids = list(rows) + list(deleted_ids)
+    with engine.begin() as connection:
+        existing = {}
+        for i in range(0, len(page_ids), MAX_IN_PARAMS):
+            for card in connection.execute(
+                select(Flashcard.notion_page_id, Flashcard.id, *SYNCED_COLUMNS)
+                .where(Flashcard.notion_page_id.in_(page_ids[i:i+MAX_IN_PARAMS]))
+            ):
+                existing[card.notion_page_id] = card
+
+        to_insert, to_update = [], []
+        for page_id, row in rows.items():
+            row['set_id'] = set_id
+            card = existing.get(page_id)
+            if card is None:
+                to_insert.append(row)
+            elif tuple(card[2:]) != tuple(row[column.key] for column in SYNCED_COLUMNS):
+                to_update.append({**row, 'card_id': card.id})
+        to_delete = [existing[page_id].id for page_id in deleted_ids if page_id in existing]
+
+        if to_insert:
+            connection.execute(insert(Flashcard), to_insert)
+        if to_update:
+            connection.execute(
+                update(Flashcard).where(Flashcard.id == bindparam('card_id'))
+                .values({column.key: bindparam(column.key) for column in SYNCED_COLUMNS}),
+                [{key: value for key, value in row.items() if key != 'notion_page_id'} for row in to_update]
+            )
+        for i in range(0, len(to_delete), MAX_IN_PARAMS):
+            connection.execute(delete(Flashcard).where(Flashcard.id.in_(to_delete[i:i+MAX_IN_PARAMS])))
+
+    return len(to_insert), len(to_update), len(to_delete)
+
+
+def delete_unseen(engine: Engine, set_id: int, seen_page_ids: set[str]) -> int:
+    """
+    Delete the cards of a set synced from pages which no longer exist. Returns how many
+    were deleted.
+    """
+    with engine.begin() as connection:
+        cards = connection.execute(
+            select(Flashcard.id, Flashcard.notion_page_id)
+            .where(Flashcard.set_id == set_id, Flashcard.notion_page_id.isnot(None))
+        ).all()
+        to_delete = [card_id for card_id, page_id in cards if page_id not in seen_page_ids]
+        for i in range(0, len(to_delete), MAX_IN_PARAMS):
+            connection.execute(delete(Flashcard).where(Flashcard.id.in_(to_delete[i:i+MAX_IN_PARAMS])))
+    return len(to_delete)
+
+
+def save_state(engine: Engine, database_id: str, last_edited_time: Optional[str]):
+    values = {'synced_at': int(time.time())}
+    if last_edited_time is not None:
+        values['last_edited_time'] = last_edited_time
+    with engine.begin() as connection:
+        connection.execute(update(NotionSyncState).where(NotionSyncState.database_id == database_id).values(**values))
+
+
+class _DatabaseSync:
+    """
+    Running totals of one database's sync
+    """
+
+    def __init__(self, database_id: str, set_id: int, full: bool, since: Optional[str]):
+        self.database_id = database_id
+        self.set_id = set_id
+        self.full = full
+        self.since = since
+        self.pages = 0
+        self.counts = [0, 0, 0]  # inserted, updated, deleted
+        self.latest_edit = since
+        self.seen_page_ids = set()
+
+    def result(self) -> DatabaseSyncResult:
+        return DatabaseSyncResult(self.database_id, self.set_id, self.pages, *self.counts, self.full)
+
+
+async def _fetch_window(client: NotionClient, sync: _DatabaseSync, window, batches: asyncio.Queue, batch_size: int):
+    """
+    Page through one window of a database, putting the pages on the queue in batches
+    """
+    batch = []
+    cursor = None
+    while True:
+        response = await client.query_database(sync.database_id, window_filter(*window), cursor)
+        for page in response.get('results', []):
+            sync.pages += 1
+            if sync.full and not is_deleted(page):
+                sync.seen_page_ids.add(page['id'])
+            edited = page.get('last_edited_time')
+            if edited and (sync.latest_edit is None or parse_time(edited) > parse_time(sync.latest_edit)):
+                sync.latest_edit = edited
+            batch.append(page)
+        if len(batch) >= batch_size:
+            await batches.put((sync, batch))
+            batch = []
+        if not response.get('has_more'):
+            break
+        cursor = response.get('next_cursor')
+    if batch:
+        await batches.put((sync, batch))
+
+
+async def _write_batches(engine: Engine, batches: asyncio.Queue):
+    while True:
+        item = await batches.get()
+        if item is None:
+            return
+        sync, pages = item
+        counts = await asyncio.to_thread(write_pages, engine, sync.set_id, pages)
+        sync.counts = [total + count for total, count in zip(sync.counts, counts)]
+
+
+async def _sync_database(client: NotionClient, engine: Engine, database_id: str, full: bool, concurrency: int,
+                         batches: asyncio.Queue, batch_size: int) -> _DatabaseSync:
+    database = await client.get_database(database_id)
+    name = plain_text(database.get('title', [])) or database_id
+    state = await asyncio.to_thread(load_state, engine, database_id)
+    set_id = await asyncio.to_thread(ensure_set, engine, database_id, name)
+
+    since = None if full or state is None or state.set_id != set_id else state.last_edited_time
+    sync = _DatabaseSync(database_id, set_id, full=since is None, since=since)
+
+    # nothing in the database was edited before it was created, so a full sync can split the
+    # time from then on between the windows
+    start = parse_time(since) if since else (parse_time(database['created_time']) if database.get('created_time') else None)
+    windows = time_windows(start, datetime.now(timezone.utc), concurrency * WINDOWS_PER_WORKER)
+    if since is None:
+        windows[0] = (None, windows[0][1])  # in case anything was imported with an earlier time
+
+    async def worker():
+        while windows:
+            await _fetch_window(client, sync, windows.pop(0), batches, batch_size)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(windows)))))
+    return sync
+
+
+async def sync_notion_async(engine: Engine, api_key: str, database_ids: Iterable[str], full: bool = False,
+                            base_url: str = NOTION_API_URL, rate: float = DEFAULT_RATE, burst: float = DEFAULT_BURST,
+                            concurrency: int = DEFAULT_CONCURRENCY, batch_size: int = DEFAULT_BATCH_SIZE) -> NotionSyncReport:
+    """
+    Sync every database into its set, all at the same time. See sync_notion.
+    """
+    start = time.perf_counter()
+    # writing falls behind fetching when the database is slow, so don't hold on to more than a
+    # few batches
+    batches = asyncio.Queue(maxsize=4)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        client = NotionClient(session, api_key, base_url, TokenBucket(rate, burst))
+        fetching = asyncio.ensure_future(asyncio.gather(*(
+            _sync_database(client, engine, database_id, full, concurrency, batches, batch_size)
+            for database_id in database_ids
+        )))
+        writer = asyncio.create_task(_write_batches(engine, batches))
+        try:
+            await asyncio.wait({fetching, writer}, return_when=asyncio.FIRST_COMPLETED)
+            if writer.done():
+                # the writer only stops early if writing failed. Fetching would wait on it forever
+                fetching.cancel()
+                writer.result()
+            syncs = fetching.result()
+            await batches.put(None)
+            await writer
+        finally:
+            fetching.cancel()
+            writer.cancel()
+
+    # only move the sync state on once everything was written, so that a sync which failed
+    # part way through is picked up from where the previous one ended
+    for sync in syncs:
+        if sync.full:
+            sync.counts[2] += await asyncio.to_thread(delete_unseen, engine, sync.set_id, sync.seen_page_ids)
+        await asyncio.to_thread(save_state, engine, sync.database_id, sync.latest_edit)
+
+    duplicates = await asyncio.to_thread(dedupe_cards, engine, [sync.set_id for sync in syncs]) if syncs else None
+
+    return NotionSyncReport([sync.result() for sync in syncs], client.requests, time.perf_counter() - start, duplicates)
+
+
+def sync_notion(engine: Engine, api_key: str, database_ids: Iterable[str], full: bool = False, **options) -> NotionSyncReport:
+    """
+    Bring the sets synced from the given Notion databases up to date. Only pages edited since
+    the previous sync are fetched, unless full is True or the database hasn't been synced
+    before. Takes the keyword arguments of sync_notion_async, e.g. base_url.
+    """
+    return asyncio.run(sync_notion_async(engine, api_key, list(database_ids), full=full, **options))
+
+
+def load_config(path: os.PathLike = default_config_path) -> dict:
+    """
+    The Notion settings in api_conf.json: api_key, database_ids and optionally base_url
+    """
+    with open(path, encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def main():
+    from .engine import get_engine
+    from .manager import DATABASE_URL
+
+    parser = argparse.ArgumentParser(description="Sync flashcard sets from Notion databases")
+    parser.add_argument('database_ids', nargs='*', help="databases to sync. Defaults to those in the config")
+    parser.add_argument('--full', action='store_true', help="fetch every page, removing cards of deleted pages")
+    parser.add_argument('--config', default=default_config_path, help="path of api_conf.json")
+    parser.add_argument('--database-url', default=DATABASE_URL)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="windows queried at once per database")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    database_ids = args.database_ids or config.get('database_ids', [])
+    if not database_ids:
+        parser.error("no database ids given or in the config")
+
+    report = sync_notion(get_engine(args.database_url), config['api_key'], database_ids, full=args.full,
+                         base_url=config.get('base_url', NOTION_API_URL), concurrency=args.concurrency)
+    for result in report.databases:
+        print(f"{result.database_id}: {result.pages} pages fetched{' (full sync)' if result.full else ''}, "
+              f"{result.cards_inserted} cards added, {result.cards_updated} updated, {result.cards_deleted} deleted")
+    print(f"{report.pages} pages in {report.seconds:.2f}s using {report.requests} requests")
+
+
+if __name__ == '__main__':
+    main()
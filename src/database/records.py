@@ -0,0 +1,69 @@
+"""
+Lightweight read-only rows returned by DatabaseManager queries which don't need full ORM
+objects.
+"""
+
+import sys
+from typing import NamedTuple, Optional
+
+
+class SetSummary(NamedTuple):
+    """
+    What the set selection list needs to know about a flashcard set, without its cards
+    """
+
+    id: int
+    name: str
+    course_name: Optional[str]
+    card_count: int
+    excluded_count: int
+
+    @property
+    def included_count(self):
+        return self.card_count - self.excluded_count
+
+
+class SearchResult(NamedTuple):
+    """
+    A card matching a full text search. Has term and definition, so it can be presented
+    like any other card.
+    """
+
+    id: int
+    term: str
+    definition: str
+    set_id: Optional[int]
+    rank: float  # lower is a better match
+    image_hash: Optional[str] = None
+
+
+class CardRecord:
+    """
+    Read-only card used while studying. Much smaller than a Flashcard ORM instance, since it
+    has no instance dict, identity map state or relationships, and it stays valid after the
+    session which loaded it is closed. Text is interned so cards repeated across sets share
+    their strings.
+    """
+
+    __slots__ = ('id', 'term', 'definition', 'set_id', 'image_hash')
+
+    def __init__(self, id: int, term: Optional[str], definition: Optional[str], set_id: Optional[int],
+                 image_hash: Optional[str] = None):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'term', sys.intern(term) if term is not None else None)
+        object.__setattr__(self, 'definition', sys.intern(definition) if definition is not None else None)
+        object.__setattr__(self, 'set_id', set_id)
+        object.__setattr__(self, 'image_hash', image_hash)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row[:5])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __repr__(self):
+        return f"<CardRecord(id={self.id}, term='{self.term}', definition='{self.definition}')>"
+
+    def __str__(self):
+        return f"{self.term}: {self.definition}"
@@ -0,0 +1,49 @@
+"""
+SM-2 spaced repetition scheduling.
+
+Answers are binary ("knew it" or "didn't"), so they are mapped onto the SM-2 quality scale
+of 0 to 5 before updating the card's ease and interval.
+"""
+
+from typing import NamedTuple
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+QUALITY_KNEW = 4
+QUALITY_DIDNT_KNOW = 1
+
+
+class Schedule(NamedTuple):
+    ease: float
+    interval: float  # days
+    repetitions: int
+    due: int  # unix time
+
+
+def next_schedule(ease, interval, repetitions, knew: bool, now: int) -> Schedule:
+    """
+    Schedule of a card after answering it at time now
+    """
+    ease = DEFAULT_EASE if ease is None else ease
+    interval = interval or 0
+    repetitions = repetitions or 0
+    quality = QUALITY_KNEW if knew else QUALITY_DIDNT_KNOW
+
+    if quality >= 3:
+        if repetitions == 0:
+            interval = 1
+        elif repetitions == 1:
+            interval = 6
+        else:
+            interval = round(interval * ease)
+        repetitions += 1
+    else:
+        # start learning the card again
+        repetitions = 0
+        interval = 1
+
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return Schedule(ease, interval, repetitions, int(now + interval * SECONDS_PER_DAY))
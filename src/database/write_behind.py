@@ -0,0 +1,348 @@
+"""
+Write-behind queue for the answers and card edits made while studying, so that moving to
+the next card never waits for the database.
+
+Events are appended to a journal file and handed to a worker thread, which writes them to
+the database in batches: once MAX_BATCH events are waiting, once the oldest has waited
+MAX_DELAY seconds, or when flush() or close() is called. Each batch is one transaction,
+which also records the sequence number of its last event in the write_behind_checkpoint
+table. Queueing an event costs a short write to the journal, not a database transaction.
+
+The journal makes the queue crash safe. An event is in the journal, and in the operating
+system's hands, before record_review or update_card returns, and the worker fsyncs the
+journal before writing each batch. When a queue is opened on a journal which still has
+events after the checkpoint, because the app crashed or was killed before they were
+written, those events are written first. Since the checkpoint is committed along with the
+batch, and each batch skips the events the checkpoint already covers, no event is written
+twice. As with SQLite's synchronous=NORMAL, which the engine uses, a power cut can lose the
+events of the last moment but never corrupts anything.
+
+An event which the database rejects outright, rather than because it is busy, is logged and
+skipped, so that it can't hold up the events queued after it.
+
+One queue should be open per journal at a time.
+"""
+
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, SQLAlchemyError, StatementError
+
+from .dedupe import content_hash
+from .deck import MAX_IN_PARAMS
+from .manager import apply_reviews
+from .models import Flashcard, WriteBehindCheckpoint
+
+from metrics import count, timed, timer
+
+MAX_BATCH = 200  # events which are written as soon as they are waiting
+MAX_DELAY = 2.0  # seconds an event waits at most before it is written
+RETRY_DELAY = 5.0  # seconds before a batch which couldn't be written is tried again
+
+EDITABLE_COLUMNS = ('term', 'definition', 'exclude', 'course_name')
+
+
+def is_permanent(exception: SQLAlchemyError) -> bool:
+    """
+    Whether writing the events again would fail the same way, e.g. because a value can't be
+    stored, as opposed to the database being locked or unavailable
+    """
+    if isinstance(exception, (IntegrityError, DataError)):
+        return True
+    # other DBAPI errors come from the database. A StatementError which isn't one failed
+    # before reaching it, while converting the values
+    return isinstance(exception, StatementError) and not isinstance(exception, DBAPIError)
+
+
+def apply_events(connection, events):
+    """
+    Write journal events on connection, within the caller's transaction
+    """
+    reviews = [(event['card_id'], event['knew'], event['at']) for event in events if event['type'] == 'review']
+    if reviews:
+        apply_reviews(connection, reviews)
+
+    # card id -> changed columns, later edits replacing earlier ones
+    edits = {}
+    for event in events:
+        if event['type'] == 'update':
+            edits.setdefault(event['card_id'], {}).update(event['changes'])
+    if not edits:
+        return
+
+    # the content hash covers the term and definition, so it needs whichever wasn't edited
+    rehash = [card_id for card_id, changes in edits.items() if 'term' in changes or 'definition' in changes]
+    for i in range(0, len(rehash), MAX_IN_PARAMS):
+        rows = connection.execute(select(Flashcard.id, Flashcard.term, Flashcard.definition)
+                                  .where(Flashcard.id.in_(rehash[i:i+MAX_IN_PARAMS])))
+        for card_id, term, definition in rows:
+            changes = edits[card_id]
+            changes['content_hash'] = content_hash(changes.get('term', term), changes.get('definition', definition))
+    for card_id, changes in edits.items():
+        connection.execute(update(Flashcard).where(Flashcard.id == card_id).values(**changes))
+
+
+def read_checkpoint(connection, journal: str) -> int:
+    return connection.execute(
+        select(WriteBehindCheckpoint.sequence).where(WriteBehindCheckpoint.journal == journal)
+    ).scalar() or 0
+
+
+def save_checkpoint(connection, journal: str, sequence: int):
+    values = {'sequence': sequence, 'updated_at': int(time.time())}
+    updated = connection.execute(update(WriteBehindCheckpoint).where(WriteBehindCheckpoint.journal == journal).values(**values))
+    if not updated.rowcount:
+        connection.execute(WriteBehindCheckpoint.__table__.insert().values(journal=journal, **values))
+
+
+class WriteBehindQueue:
+    """
+    Records answers and card edits in the background. record_review can be passed anywhere
+    DatabaseManager.record_review is, e.g. as a StudySession's record_answer.
+    """
+
+    def __init__(self, engine: Engine, journal_path: os.PathLike, max_batch: int = MAX_BATCH, max_delay: float = MAX_DELAY):
+        self.engine = engine
+        self.journal_path = Path(journal_path)
+        self.journal = self.journal_path.name  # the journal's key in the checkpoint table
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        # guards everything below, including the journal file
+        self._condition = threading.Condition()
+        self._pending = []  # events in the journal which haven't been written yet
+        self._first_pending_at = None  # time.monotonic() when the oldest pending event was queued
+        self._retry_at = None  # time.monotonic() before which a failed batch isn't tried again
+        self._flush_requested = False
+        self._closing = False
+        self.error = None  # why the last batch couldn't be written, if it couldn't
+
+        self._journal_file = open(self.journal_path, 'ab')
+        self._sequence = 0  # sequence number of the last queued event
+        self._pending = self.recover()
+        if self._pending:
+            self._first_pending_at = time.monotonic()
+            self._retry_at = self._first_pending_at + RETRY_DELAY
+        self.written_sequence = self._pending[0]['seq'] - 1 if self._pending else self._sequence
+
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def recover(self) -> list:
+        """
+        Write the journal's events which aren't in the database yet and empty the journal.
+        Returns the events which couldn't be written yet, e.g. because the database is locked,
+        which the worker tries again.
+        """
+        # new events are numbered after both the journal's and the checkpoint's, since events
+        # numbered at or below the checkpoint would be taken as written already. The journal
+        # alone isn't enough if it was deleted or replaced
+        try:
+            with self.engine.connect() as connection:
+                self._sequence = read_checkpoint(connection, self.journal)
+        except SQLAlchemyError as exception:
+            print(f"Could not read the checkpoint of {self.journal_path.name}: {exception}", file=sys.stderr)
+            self.error = exception
+
+        events = []
+        with open(self.journal_path, 'rb') as fp:
+            for line in fp:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    break  # the last line is cut short if the app stopped while it was written
+                if event['type'] != 'start' and event['seq'] > self._sequence:
+                    events.append(event)
+                self._sequence = max(self._sequence, event['seq'])
+
+        for i in range(0, len(events), self.max_batch):
+            try:
+                self._write(events[i:i + self.max_batch])
+            except (SQLAlchemyError, OSError) as exception:
+                print(f"Could not write {len(events) - i} answers and edits from {self.journal_path.name}, "
+                      f"retrying in {RETRY_DELAY:.0f}s: {exception}", file=sys.stderr)
+                self.error = exception
+                return events[i:]
+        if events:
+            count('write_behind.recovered', len(events))
+        # the checkpoint has everything, so the journal can start again
+        self._start_journal()
+        return []
+
+    def _start_journal(self):
+        """
+        Empty the journal, keeping the last sequence number in it so that the numbers of new
+        events follow on from the checkpoint's
+        """
+        self._journal_file.truncate(0)
+        self._journal_file.write(json.dumps({'type': 'start', 'seq': self._sequence}, separators=(',', ':')).encode() + b'\n')
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+
+    @timed('write_behind.record_review')
+    def record_review(self, card_id: int, knew: bool, now: int = None):
+        """
+        Queue an answer to be recorded like DatabaseManager.record_review
+        """
+        self._queue({'type': 'review', 'card_id': card_id, 'knew': knew, 'at': int(time.time()) if now is None else now})
+
+    @timed('write_behind.update_card')
+    def update_card(self, card_id: int, **changes):
+        """
+        Queue changes to a card's term, definition, exclude or course_name
+        """
+        unknown = set(changes) - set(EDITABLE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Can't edit {', '.join(sorted(unknown))}. Editable columns are {', '.join(EDITABLE_COLUMNS)}")
+        # checked here, since the worker can't tell the caller about a value which can't be stored
+        for column, value in changes.items():
+            if column == 'exclude' and not isinstance(value, bool):
+                raise ValueError(f"exclude must be True or False, not {value!r}")
+            if column != 'exclude' and value is not None and not isinstance(value, str):
+                raise ValueError(f"{column} must be a string or None, not {value!r}")
+        if changes:
+            self._queue({'type': 'update', 'card_id': card_id, 'changes': changes})
+
+    def _queue(self, event):
+        with self._condition:
+            if self._closing:
+                raise RuntimeError("the write-behind queue is closed")
+            self._sequence += 1
+            event['seq'] = self._sequence
+            self._journal_file.write(json.dumps(event, separators=(',', ':')).encode() + b'\n')
+            self._journal_file.flush()
+            self._pending.append(event)
+            # the worker sleeps until the first event of a batch starts the delay, and then until
+            # the delay is up or the batch is full
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+                self._condition.notify_all()
+            elif len(self._pending) >= self.max_batch:
+                self._condition.notify_all()
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of queued events which haven't been written yet
+        """
+        with self._condition:
+            return self._sequence - self.written_sequence
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Write everything queued so far without waiting for the thresholds, and wait until it
+        has been written. Returns whether it was written within timeout seconds.
+        """
+        with self._condition:
+            target = self._sequence
+            self._flush_requested = True
+            self._retry_at = None
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self.written_sequence >= target, timeout)
+
+    def close(self, timeout: float = None) -> bool:
+        """
+        Write everything queued and stop the worker. Returns whether everything was written
+        within timeout seconds. Anything which wasn't is written when the journal is next opened.
+        """
+        with self._condition:
+            self._closing = True
+            self._retry_at = None
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        with self._condition:
+            self._journal_file.close()
+            return self.written_sequence == self._sequence
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _ready(self, now):
+        """
+        Whether the pending events should be written now. Called with the condition held.
+        """
+        if not self._pending or (self._retry_at is not None and now < self._retry_at):
+            return False
+        return (self._closing or self._flush_requested or len(self._pending) >= self.max_batch
+                or now - self._first_pending_at >= self.max_delay)
+
+    def _wait_time(self, now):
+        if not self._pending:
+            return None
+        if self._retry_at is not None:
+            return max(0.0, self._retry_at - now)
+        return max(0.0, self._first_pending_at + self.max_delay - now)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready(time.monotonic()):
+                    if self._closing and (not self._pending or self._retry_at is not None):
+                        return
+                    self._condition.wait(self._wait_time(time.monotonic()))
+                batch, self._pending = self._pending, []
+                self._first_pending_at = None
+                self._flush_requested = False
+
+            try:
+                os.fsync(self._journal_file.fileno())
+                self._write(batch)
+            except (SQLAlchemyError, OSError) as exception:
+                print(f"Could not write {len(batch)} answers and edits, retrying in {RETRY_DELAY:.0f}s: {exception}", file=sys.stderr)
+                with self._condition:
+                    self.error = exception
+                    self._pending[:0] = batch
+                    self._first_pending_at = time.monotonic()
+                    self._retry_at = self._first_pending_at + RETRY_DELAY
+                continue
+
+            with self._condition:
+                self.written_sequence = batch[-1]['seq']
+                self.error = None
+                self._retry_at = None
+                if not self._pending:
+                    # everything in the journal is in the database, so keep it from growing
+                    self._start_journal()
+                self._condition.notify_all()
+
+    def _write(self, batch):
+        """
+        Write a batch in one transaction. If the database rejects one of its events, write them
+        one at a time instead, skipping the ones it rejects.
+        """
+        try:
+            self._write_events(batch)
+            return
+        except SQLAlchemyError as exception:
+            if not is_permanent(exception):
+                raise
+        for event in batch:
+            try:
+                self._write_events([event])
+            except SQLAlchemyError as exception:
+                if not is_permanent(exception):
+                    raise
+                print(f"Skipping {event['type']} of card {event['card_id']}, which can't be written: {exception}", file=sys.stderr)
+                count('write_behind.skipped')
+                with self.engine.begin() as connection:
+                    save_checkpoint(connection, self.journal, event['seq'])
+
+    def _write_events(self, events):
+        with timer('write_behind.write'), self.engine.begin() as connection:
+            # events the checkpoint covers were written before the app last stopped
+            checkpoint = read_checkpoint(connection, self.journal)
+            unwritten = [event for event in events if event['seq'] > checkpoint]
+            apply_events(connection, unwritten)
+            save_checkpoint(connection, self.journal, max(checkpoint, events[-1]['seq']))
+        count('write_behind.events', len(unwritten))
@@ -0,0 +1,145 @@
+"""
+Content-addressed store for images attached to flashcards.
+
+Images are stored once under the sha256 of their bytes, so cards sharing a picture share the
+file and the database only holds the hash. Thumbnails sized for the card display are
+rendered when an image is added, so studying never has to decode and shrink full size images.
+"""
+
+import hashlib
+import io
+import os
+from pathlib import Path
+import threading
+from typing import Iterator, Optional
+
+DEFAULT_STORE_DIR = Path(__file__).parent / 'image_store'
+
+CARD_IMAGE_SIZE = (400, 250)  # largest image shown on a card, in pixels
+DEFAULT_THUMBNAIL_SIZES = (CARD_IMAGE_SIZE,)
+
+
+class ImageStore:
+    """
+    Image files named by the hash of their content, with precomputed thumbnails.
+
+    Originals are kept as they were added under originals/ab/abcdef..., thumbnails as PNGs
+    under thumbnails/ab/abcdef..._400x250.png. Thumbnails keep the aspect ratio of the image
+    and fit within their size.
+    """
+
+    def __init__(self, store_dir: os.PathLike = DEFAULT_STORE_DIR, thumbnail_sizes=DEFAULT_THUMBNAIL_SIZES):
+        self.store_dir = Path(store_dir)
+        self.thumbnail_sizes = tuple(tuple(size) for size in thumbnail_sizes)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        """
+        Content address of an image
+        """
+        return hashlib.sha256(data).hexdigest()
+
+    def path_for(self, key: str) -> Path:
+        return self.store_dir / 'originals' / key[:2] / key
+
+    def thumbnail_path_for(self, key: str, size) -> Path:
+        width, height = size
+        return self.store_dir / 'thumbnails' / key[:2] / f'{key}_{width}x{height}.png'
+
+    def put(self, data: bytes) -> str:
+        """
+        Add an image and render its thumbnails. Returns its key. Adding an image which is
+        already stored only makes sure its thumbnails exist.
+        """
+        # PIL is imported on first use, so that starting the app doesn't wait for it
+        from PIL import Image
+
+        # refuse anything PIL can't read before it is stored
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+
+        key = self.key(data)
+        path = self.path_for(key)
+        if not path.exists():
+            self._write(path, data)
+        for size in self.thumbnail_sizes:
+            self.thumbnail(key, size)
+        return key
+
+    def put_file(self, path: os.PathLike) -> str:
+        return self.put(Path(path).read_bytes())
+
+    def get(self, key: str) -> Optional[Path]:
+        """
+        Return the path of the original image, or None if it isn't stored
+        """
+        path = self.path_for(key)
+        return path if path.exists() else None
+
+    def thumbnail(self, key: str, size=CARD_IMAGE_SIZE) -> Optional[Path]:
+        """
+        Return the path of the thumbnail of the image at size, rendering it first if needed.
+        None if the image isn't stored.
+        """
+        path = self.thumbnail_path_for(key, size)
+        if path.exists():
+            return path
+
+        original = self.get(key)
+        if original is None:
+            return None
+
+        from PIL import Image
+
+        with Image.open(original) as image:
+            image.thumbnail(size)
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGBA')
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+        self._write(path, buffer.getvalue())
+        return path
+
+    def keys(self) -> Iterator[str]:
+        originals = self.store_dir / 'originals'
+        if originals.exists():
+            for path in originals.glob('*/*'):
+                if path.suffix != '.tmp':
+                    yield path.name
+
+    def remove(self, key: str):
+        """
+        Remove an image along with all of its thumbnails
+        """
+        paths = [self.path_for(key)]
+        thumbnails = self.store_dir / 'thumbnails' / key[:2]
+        if thumbnails.exists():
+            paths.extend(thumbnails.glob(f'{key}_*.png'))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _write(self, path: Path, data: bytes):
+        # write to a temporary file first so that a partially written image is never read
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+
+
+_default_store = None
+
+
+def get_default_image_store() -> ImageStore:
+    """
+    Application-wide image store
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = ImageStore()
+    return _default_store
@@ -7,6 +7,7 @@ Author: Ethan Posner
 Date: July 27, 2021
 """
 
+import json
 import os
 import sys
 from pathlib import Path
@@ -28,10 +29,10 @@ if not debug:
 from window import Root, FlashcardFrame
 
 from database.manager import DatabaseManager
+from metrics import timed
 from database.models import FlashcardSet, Flashcard
 
 import tkinter as tk
-from sqlalchemy.orm import joinedload
 
 BACKGROUND_COLOR = "#191919"
 FONT_TYPE = 'Arial'
@@ -45,23 +46,59 @@ flashcard_csv_file_folder = "csv_flashcard_files"
 
 flashcard_data_path = os.path.join(ROOT_DIR, flashcard_csv_file_folder)
 
+api_conf_path = os.path.join(ROOT_DIR, 'api_conf.json')
+
 current_folder = os.path.basename(os.getcwd())
 
 
 manager = DatabaseManager()
 manager.ensure_db_upgraded()
-
-
+# answers are written on a background thread, so that moving on to the next card doesn't wait for the disk
+writes = manager.open_write_behind()
+
+
+def sync_notion():
+    """
+    Sync the sets of the Notion databases listed in api_conf.json, if an API key has been given
+    """
+    try:
+        with open(api_conf_path, encoding='utf-8') as fp:
+            config = json.load(fp)
+    except (OSError, ValueError):
+        return
+    api_key = config.get('api_key')
+    if not api_key or api_key == 'Enter API Key Here' or not config.get('database_ids'):
+        return
+
+    from database.notion_sync import NOTION_API_URL, NotionSyncError
+
+    try:
+        manager.sync_notion(api_key, config['database_ids'], base_url=config.get('base_url', NOTION_API_URL))
+    except NotionSyncError as e:
+        print(f"Could not sync with Notion: {e}")
+
+
+@timed('app.sync_flashcards')
+def sync_flashcards():
+    """
+    Sync the CSV flashcard folder and any Notion databases with the database. Run on a
+    background thread by the window, since a Notion sync goes over the network.
+    """
+    if os.path.isdir(flashcard_data_path):
+        manager.sync_csv_folder(flashcard_data_path)
+    sync_notion()
+
+
+@timed('app.get_flashcard_data')
 def get_flashcard_data():
-    global flashcard_sets, card_set_selection_frame, current_frame, flashcard_set_names
+    """
+    Summaries of every flashcard set. Cards are only loaded once a session is started.
+    """
+    return manager.get_set_summaries()
 
-    with manager.create_session() as session:
-        flashcard_sets = session.query(FlashcardSet)\
-                                .options(
-                                    joinedload(FlashcardSet.flashcards)
-                                ).all()
 
-    return flashcard_sets
+def get_flashcard_cards(set_ids):
+    return manager.get_cards(set_ids)
 
 
 def goto_main():
@@ -113,6 +150,13 @@ def view_sets():
 # initialize the root window
 root = Root(image_path=IMAGE_PATH,
             get_flashcard_data_func=get_flashcard_data,
+            get_flashcard_cards_func=get_flashcard_cards,
+            search_cards_func=manager.search_cards,
+            get_due_cards_func=manager.get_due_cards,
+            record_answer_func=writes.record_review,
+            flush_writes_func=writes.flush,
+            open_deck_func=manager.open_deck,
+            sync_func=sync_flashcards,
             width=1000,
             height=600,
             bg=BACKGROUND_COLOR,
@@ -133,7 +177,9 @@ root.update()
 
 loading_frame.pack_forget()
 
+# show the sets already in the database straight away, and again once the sources are synced
 root.update_list()
+root.reload()
 
 # Present the flashcard sets as selectable items
 # card_set_selection_frame = ItemSelectionFrame(root, flashcard_set_names, start_command=view_sets,
@@ -141,4 +187,7 @@ root.update_list()
 # card_set_selection_frame.pack(fill="both", expand=True)
 # current_frame = card_set_selection_frame
 
-root.mainloop()
+try:
+    root.mainloop()
+finally:
+    writes.close()
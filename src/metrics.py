@@ -0,0 +1,356 @@
+"""
+Opt-in timers and counters for the hot paths of the app, written to local files so that a
+slow session can be looked into afterwards.
+
+Set the FLASHCARD_METRICS environment variable to turn them on:
+- jsonl (or 1): every observation is appended to metrics.jsonl, which is rotated when it
+  gets large
+- prometheus: metrics.prom is kept up to date in the Prometheus text format, e.g. for the
+  node exporter's textfile collector
+
+Files are written to FLASHCARD_METRICS_DIR, src/metrics by default. Separately,
+FLASHCARD_PROFILE=1 runs cProfile from start up and saves the stats there when the app
+exits. Profiling can also be switched on and off while the app runs with toggle_profiling().
+
+When FLASHCARD_METRICS isn't set, timed() hands back the function it decorates unchanged and
+timer(), observe() and count() return straight away, so the instrumentation costs next to
+nothing.
+"""
+
+import atexit
+from collections import defaultdict
+import cProfile
+import functools
+import json
+import logging
+import logging.handlers
+import os
+from pathlib import Path
+import queue
+import sys
+import threading
+import time
+from typing import Optional
+
+DEFAULT_METRICS_DIR = Path(__file__).parent / 'metrics'
+
+MAX_BYTES = 5 * 1024 * 1024  # size at which metrics.jsonl is rotated
+BACKUP_COUNT = 3  # rotated files kept
+WRITE_INTERVAL = 10  # seconds between rewrites of metrics.prom
+
+# upper bounds, in seconds, of the histogram buckets timings are counted in
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Timing:
+    """
+    Summary of the durations observed for one metric
+    """
+
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class Registry:
+    """
+    Running totals of every timer and counter, keyed by name and labels
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings: dict[tuple, Timing] = defaultdict(Timing)
+        self.counters: dict[tuple, float] = defaultdict(float)
+
+    def observe(self, name: str, seconds: float, labels: tuple = ()):
+        with self._lock:
+            self.timings[name, labels].add(seconds)
+
+    def increment(self, name: str, value: float, labels: tuple = ()):
+        with self._lock:
+            self.counters[name, labels] += value
+
+    def prometheus_text(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format. Timers become histograms in
+        seconds and counters become totals.
+        """
+        def metric_name(name):
+            return 'flashcards_' + ''.join(c if c.isalnum() else '_' for c in name)
+
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+
+        lines = []
+        declared = set()
+        with self._lock:
+            timings = sorted(self.timings.items())
+            counters = sorted(self.counters.items())
+
+        for (name, labels), timing in timings:
+            prometheus_name = metric_name(name) + '_seconds'
+            if prometheus_name not in declared:
+                declared.add(prometheus_name)
+                lines.append(f'# TYPE {prometheus_name} histogram')
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, timing.buckets):
+                cumulative += bucket
+                lines.append(f'{prometheus_name}_bucket{label_text(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{prometheus_name}_bucket{label_text(labels, [("le", "+Inf")])} {timing.count}')
+            lines.append(f'{prometheus_name}_sum{label_text(labels)} {timing.total}')
+            lines.append(f'{prometheus_name}_count{label_text(labels)} {timing.count}')
+
+        for (name, labels), value in counters:
+            prometheus_name = metric_name(name) + '_total'
+            if prometheus_name not in declared:
+                declared.add(prometheus_name)
+                lines.append(f'# TYPE {prometheus_name} counter')
+            lines.append(f'{prometheus_name}{label_text(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class JsonLinesExporter:
+    """
+    Appends each observation to a rotating JSON lines file. Writing happens on a background
+    thread, so the code being measured only pays for putting the line on a queue.
+    """
+
+    def __init__(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / 'metrics.jsonl'
+        file_handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT,
+                                                            encoding='utf-8')
+        self._queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._queue, file_handler)
+        self._logger = logging.getLogger(f'{__name__}.jsonl')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(logging.handlers.QueueHandler(self._queue))
+        self._listener.start()
+
+    def export(self, event: dict):
+        self._logger.info(json.dumps(event))
+
+    def close(self):
+        self._listener.stop()
+
+
+class PrometheusExporter:
+    """
+    Rewrites a Prometheus text file with the totals so far every WRITE_INTERVAL seconds and
+    when the app exits
+    """
+
+    def __init__(self, directory: Path, registry: Registry):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / 'metrics.prom'
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self._thread.start()
+
+    def export(self, event: dict):
+        pass  # everything needed is already in the registry
+
+    def write(self):
+        # replace the file in one go so that a scraper never reads half of it
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(self.registry.prometheus_text(), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stop.wait(WRITE_INTERVAL):
+            self.write()
+
+    def close(self):
+        self._stop.set()
+        self.write()
+
+
+registry = Registry()
+_exporter = None
+enabled = False
+
+
+def configure(mode: Optional[str] = None, directory: os.PathLike = None):
+    """
+    Turn metrics on with the given mode ('jsonl' or 'prometheus') or off with None. Only
+    functions decorated with timed() after this call are affected, so it should be called
+    before the instrumented modules are imported. Done from the environment on import.
+    """
+    global _exporter, enabled
+    if _exporter is not None:
+        _exporter.close()
+        _exporter = None
+
+    enabled = False
+    if not mode:
+        return
+
+    directory = Path(directory or DEFAULT_METRICS_DIR)
+    if mode == 'prometheus':
+        _exporter = PrometheusExporter(directory, registry)
+    elif mode in ('jsonl', '1'):
+        _exporter = JsonLinesExporter(directory)
+    else:
+        raise ValueError(f"unknown metrics mode {mode!r}. Use 'jsonl' or 'prometheus'")
+    enabled = True
+
+
+def _export(event):
+    exporter = _exporter
+    if exporter is not None:  # None once metrics have been turned off
+        exporter.export(event)
+
+
+def _record(name, seconds, labels):
+    registry.observe(name, seconds, tuple(sorted(labels.items())))
+    _export({'ts': time.time(), 'metric': name, 'seconds': seconds, **labels})
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.name, time.perf_counter() - self.start, self.labels)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str, **labels):
+    """
+    Context manager which records how long its block takes
+    """
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+def timed(name: str = None):
+    """
+    Decorator which records how long each call takes. The metric is named after the function
+    unless name is given.
+    """
+    def decorator(func):
+        if not enabled:
+            return func
+        metric = name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(metric, time.perf_counter() - start, {})
+        return wrapper
+    return decorator
+
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Record a duration which was measured elsewhere, e.g. across threads
+    """
+    if enabled:
+        _record(name, seconds, labels)
+
+
+def count(name: str, value: float = 1, **labels):
+    if not enabled:
+        return
+    registry.increment(name, value, tuple(sorted(labels.items())))
+    _export({'ts': time.time(), 'metric': name, 'count': value, **labels})
+
+
+# profiling
+
+_profiler: Optional[cProfile.Profile] = None
+profile_directory = os.environ.get('FLASHCARD_METRICS_DIR') or DEFAULT_METRICS_DIR
+
+
+def start_profiling():
+    """
+    Profile the calling thread (the Tk thread, for the app) until stop_profiling()
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def stop_profiling() -> Optional[Path]:
+    """
+    Stop profiling and save the stats. Returns where they were saved, for use with pstats or
+    snakeviz, or None if profiling wasn't on.
+    """
+    global _profiler
+    if _profiler is None:
+        return None
+    _profiler.disable()
+    directory = Path(profile_directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof"
+    _profiler.dump_stats(path)
+    _profiler = None
+    return path
+
+
+def toggle_profiling() -> Optional[Path]:
+    """
+    Start profiling, or stop it and return where the stats were saved
+    """
+    if _profiler is None:
+        start_profiling()
+        return None
+    return stop_profiling()
+
+
+def _shutdown():
+    stop_profiling()
+    configure(None)
+
+
+try:
+    configure(os.environ.get('FLASHCARD_METRICS', '').strip().lower() or None, profile_directory)
+except ValueError as exception:
+    # a typo in the environment shouldn't stop the app from starting
+    print(f"Metrics are off: FLASHCARD_METRICS: {exception}", file=sys.stderr)
+if os.environ.get('FLASHCARD_PROFILE', '').strip() not in ('', '0'):
+    start_profiling()
+atexit.register(_shutdown)
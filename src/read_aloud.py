@@ -0,0 +1,93 @@
+"""
+Reads flashcards aloud on a background thread so that the Tk thread never waits for speech
+to be synthesized or played.
+"""
+
+from collections import deque
+import queue
+import threading
+import time
+import traceback
+from typing import Iterable
+
+from metrics import observe
+from text_to_speech import TextToSpeech
+
+
+class ReadAloudWorker:
+    """
+    Background thread which speaks the most recently requested text.
+
+    Each call to say() cancels whatever is currently playing or waiting to be played. While
+    idle, the worker synthesizes the upcoming texts it was given so that they are already in
+    the audio cache by the time they are requested.
+    """
+
+    def __init__(self, engine: TextToSpeech = None):
+        self.engine = engine if engine is not None else TextToSpeech()
+
+        self._requests = queue.Queue()
+        # incremented on every request. Work belonging to an older generation has been cancelled
+        self._generation = 0
+        self._playback_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name='read-aloud', daemon=True)
+        self._thread.start()
+
+    def say(self, text: str, upcoming: Iterable[str] = ()):
+        """
+        Stop the current clip and speak text. upcoming is the text of the next cards, in the
+        order they will be presented, which is synthesized ahead of time.
+        """
+        with self._playback_lock:
+            self._generation += 1
+            generation = self._generation
+            self.engine.stop()
+        self._requests.put((generation, text, list(upcoming), time.perf_counter()))
+
+    def stop(self):
+        """
+        Stop the current clip and forget any pending text
+        """
+        with self._playback_lock:
+            self._generation += 1
+            self.engine.stop()
+
+    def shutdown(self):
+        self.stop()
+        self._requests.put(None)
+
+    def _run(self):
+        prefetch = deque()
+        while True:
+            try:
+                # only wait for a new request if there is nothing to synthesize ahead of time
+                item = self._requests.get(block=not prefetch)
+            except queue.Empty:
+                self._synthesize(prefetch.popleft())
+                continue
+
+            if item is None:
+                return
+
+            generation, text, upcoming, requested_at = item
+            if generation != self._generation:
+                continue  # a newer request has already replaced this one
+            prefetch = deque(upcoming)
+
+            path = self._synthesize(text)
+            if path is None:
+                continue
+            with self._playback_lock:
+                if generation == self._generation:
+                    self.engine.start(path)
+                    # from the card being shown to its speech starting
+                    observe('tts.say_latency', time.perf_counter() - requested_at)
+
+    def _synthesize(self, text):
+        try:
+            return self.engine.audio_path(text)
+        except Exception:
+            # speech is a convenience. Never let a failed synthesis kill the worker
+            traceback.print_exc()
+            return None
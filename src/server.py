@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+
+"""
+HTTP API for studying the flashcards from other devices on the local network.
+
+Endpoints (JSON unless noted):
+    GET  /sets
+        Every set with its card counts. The response has an ETag, and a request with a
+        matching If-None-Match gets an empty 304 response.
+    GET  /deck?sets=1,2[&random=1&seed=N][&page=0]
+        A page of the non-excluded cards of the given sets, as opened by
+        DatabaseManager.open_deck. Random decks are ordered by seed. If no seed is given, one
+        is chosen and returned so that the following pages can ask for the same order.
+    POST /answers   {"answers": [{"card_id": 1, "knew": true}, ...]}
+        Records answers for spaced repetition and returns each card's new schedule.
+    GET  /cards/{card_id}/audio[?side=term|definition&language=en&slow=1]
+        A side of the card read aloud. The response is an audio file. language has to be
+        one the text to speech backend supports, or one of --languages if they are given.
+
+Requests are served by one asyncio event loop. Queries run on a thread pool with a thread
+for each of the engine's pooled connections, writes on a thread of their own and speech
+synthesis, which can take seconds, runs on a pool of its own so that it doesn't hold up
+queries. Open decks are kept and shared by every client studying the same sets in the same
+order, and opened again after DECK_MAX_AGE seconds so that cards added or deleted by a sync
+show up.
+
+There is no authentication, so only serve on networks you trust.
+
+Usage (from the src folder):
+    python server.py [--host 127.0.0.1] [--port 8080] [--database URL] [--tts-backend NAME] [--languages en,fr]
+"""
+
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+
+from database.engine import POOL_SIZE
+from database.manager import DATABASE_URL, DatabaseManager
+from metrics import count, observe
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+MAX_OPEN_DECKS = 64  # decks kept open between requests, least recently used are closed first
+DECK_MAX_AGE = 60  # seconds an open deck is reused before it is opened again, to pick up synced and deleted cards
+SETS_MAX_AGE = 5  # seconds the set listing is reused before the database is queried again
+MAX_ANSWERS = 1000  # answers accepted in one request
+MAX_ID = 2**63 - 1  # largest id SQLite can store
+TTS_WORKERS = 4
+MAX_SPEAKERS = 8  # (language, speed) pairs kept ready to synthesize, least recently used are dropped first
+
+
+def error_response(exception_class, message):
+    return exception_class(text=json.dumps({'error': message}), content_type='application/json')
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header lists etag. Weak and strong tags compare equal, as they
+    should for If-None-Match.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def query_int(request, name, default=None, minimum=None):
+    value = request.query.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise error_response(web.HTTPBadRequest, f"{name} must be a whole number") from None
+    if minimum is not None and number < minimum:
+        raise error_response(web.HTTPBadRequest, f"{name} must be at least {minimum}")
+    return number
+
+
+def query_flag(request, name):
+    return request.query.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def card_json(card):
+    return {'id': card.id, 'term': card.term, 'definition': card.definition, 'set_id': card.set_id, 'image_hash': card.image_hash}
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exception:
+        status = exception.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        observe('server.request', time.perf_counter() - start, route=route, status=status)
+
+
+class StudyServer:
+    """
+    Request handlers and the state shared between requests
+    """
+
+    def __init__(self, manager: DatabaseManager, tts_backend: str = None, audio_cache=None, db_workers: int = POOL_SIZE,
+                 tts_workers: int = TTS_WORKERS, languages=None):
+        self.manager = manager
+        self.tts_backend = tts_backend
+        self.audio_cache = audio_cache
+        # languages audio can be asked for. By default every language the backend supports
+        self.languages = set(languages) if languages is not None else None
+        self._backend_languages = None  # future of the backend's languages
+        # one thread per pooled connection, so queries never wait for a connection and the
+        # page caches of the pooled connections stay warm
+        self.db_executor = ThreadPoolExecutor(db_workers, thread_name_prefix='server-db')
+        # SQLite has one writer at a time, so writes are queued for a single thread of their
+        # own. That is quicker than leaving them to SQLite's busy handler, which sleeps between
+        # retries, and waiting writers don't take threads from the queries
+        self.write_executor = ThreadPoolExecutor(1, thread_name_prefix='server-write')
+        self.tts_executor = ThreadPoolExecutor(tts_workers, thread_name_prefix='server-tts')
+
+        self._sets = None  # (body, etag, time it was loaded) of the set listing
+        self._sets_loading = None
+        # (set ids, random order, seed) -> future of (DeckCursor, lock, time it was opened), least recently used first
+        self._decks: OrderedDict[tuple, asyncio.Future] = OrderedDict()
+        self._pending_answers = []  # (answers, future) waiting to be written
+        self._writing = None
+        self._speakers = OrderedDict()  # (language, slow) -> TextToSpeech, least recently used first
+        self._synthesizing: dict[tuple, asyncio.Future] = {}
+
+    def routes(self):
+        return [
+            web.get('/sets', self.list_sets),
+            web.get('/deck', self.get_deck_page),
+            web.post('/answers', self.record_answers),
+            web.get('/cards/{card_id}/audio', self.get_audio),
+        ]
+
+    async def run_db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, func, *args)
+
+    @staticmethod
+    async def share(futures: dict, key, start):
+        """
+        Await the future for key, starting it with start() unless another request already
+        has. One client giving up doesn't cancel the work for the others.
+        """
+        future = futures.get(key)
+        if future is None:
+            future = futures[key] = asyncio.ensure_future(start())
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if futures.get(key) is future:
+                del futures[key]
+            raise
+
+    # sets
+
+    async def list_sets(self, request):
+        body, etag = await self.set_listing()
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            count('server.not_modified')
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    async def set_listing(self):
+        """
+        Body and ETag of the set listing. Summing the cards of every set is the slowest query
+        the server makes, so its result is reused for SETS_MAX_AGE seconds and requests which
+        arrive while it runs wait for the same query.
+        """
+        if self._sets is not None and time.monotonic() - self._sets[2] < SETS_MAX_AGE:
+            return self._sets[:2]
+        if self._sets_loading is None:
+            self._sets_loading = asyncio.ensure_future(self._load_sets())
+            self._sets_loading.add_done_callback(lambda _: setattr(self, '_sets_loading', None))
+        return await asyncio.shield(self._sets_loading)
+
+    async def _load_sets(self):
+        summaries = await self.run_db(self.manager.get_set_summaries)
+        body = json.dumps({'sets': [{
+            'id': summary.id,
+            'name': summary.name,
+            'course_name': summary.course_name,
+            'card_count': summary.card_count,
+            'included_count': summary.included_count,
+        } for summary in summaries]}).encode()
+        # the tag only changes when the listing does, however often it is reloaded
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        self._sets = (body, etag, time.monotonic())
+        return body, etag
+
+    # decks
+
+    async def get_deck_page(self, request):
+        try:
+            set_ids = sorted({int(set_id) for set_id in request.query.get('sets', '').split(',') if set_id})
+        except ValueError:
+            raise error_response(web.HTTPBadRequest, "sets must be a comma separated list of set ids") from None
+        if not set_ids:
+            raise error_response(web.HTTPBadRequest, "sets is required")
+        if not all(0 < set_id <= MAX_ID for set_id in set_ids):
+            raise error_response(web.HTTPBadRequest, "set ids must be positive and fit in 64 bits")
+        random_order = query_flag(request, 'random')
+        seed = query_int(request, 'seed', minimum=0) if random_order else None
+        if random_order and seed is None:
+            seed = random.randrange(2**32)
+        page = query_int(request, 'page', default=0, minimum=0)
+
+        deck, lock, _ = await self.open_deck(tuple(set_ids), random_order, seed)
+        cards = await self.run_db(self._read_page, deck, lock, page)
+        return web.json_response({
+            'size': len(deck),
+            'seed': seed,
+            'page': page,
+            'page_size': deck.page_size,
+            'pages': -(-len(deck) // deck.page_size),
+            'cards': [card_json(card) for card in cards],
+        })
+
+    async def open_deck(self, set_ids, random_order, seed):
+        key = (set_ids, random_order, seed)
+        future = self._decks.get(key)
+        if future is not None and future.done() and time.monotonic() - future.result()[2] > DECK_MAX_AGE:
+            del self._decks[key]
+        elif future is not None:
+            self._decks.move_to_end(key)
+        deck = await self.share(self._decks, key, lambda: self.run_db(self._open_deck, set_ids, random_order, seed))
+        while len(self._decks) > MAX_OPEN_DECKS:
+            self._decks.popitem(last=False)
+        return deck
+
+    def _open_deck(self, set_ids, random_order, seed):
+        # a DeckCursor isn't safe to use from several threads at once
+        return self.manager.open_deck(set_ids, random_order=random_order, seed=seed), threading.Lock(), time.monotonic()
+
+    @staticmethod
+    def _read_page(deck, lock, page):
+        start = page * deck.page_size
+        with lock:
+            return deck[start:start + deck.page_size]
+
+    # answers
+
+    async def record_answers(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise error_response(web.HTTPBadRequest, "the body must be JSON") from None
+        answers = body.get('answers') if isinstance(body, dict) else None
+        if not isinstance(answers, list) or not answers:
+            raise error_response(web.HTTPBadRequest, "answers must be a list of {\"card_id\": id, \"knew\": true or false}")
+        if len(answers) > MAX_ANSWERS:
+            raise error_response(web.HTTPBadRequest, f"at most {MAX_ANSWERS} answers can be sent at once")
+        parsed = []
+        for answer in answers:
+            card_id = answer.get('card_id') if isinstance(answer, dict) else None
+            knew = answer.get('knew') if isinstance(answer, dict) else None
+            if not isinstance(card_id, int) or isinstance(card_id, bool) or not isinstance(knew, bool):
+                raise error_response(web.HTTPBadRequest, "every answer needs an integer card_id and a boolean knew")
+            if not 0 < card_id <= MAX_ID:
+                raise error_response(web.HTTPBadRequest, "card ids must be positive and fit in 64 bits")
+            parsed.append((card_id, knew))
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending_answers.append((parsed, future))
+        if self._writing is None or self._writing.done():
+            self._writing = asyncio.ensure_future(self._write_answers())
+        results = await future
+        count('server.answers', len(parsed))
+        return web.json_response({'results': results})
+
+    async def _write_answers(self):
+        """
+        Write the answers of every request which arrived while the previous write ran in one
+        transaction, so that busy clients share commits instead of queueing for one each
+        """
+        loop = asyncio.get_running_loop()
+        while self._pending_answers:
+            requests, self._pending_answers = self._pending_answers, []
+            answers = [answer for request_answers, _ in requests for answer in request_answers]
+            try:
+                results = await loop.run_in_executor(self.write_executor, self._record_answers, answers)
+            except Exception as exception:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(exception)
+                continue
+            start = 0
+            for request_answers, future in requests:
+                if not future.done():
+                    future.set_result(results[start:start + len(request_answers)])
+                start += len(request_answers)
+
+    def _record_answers(self, answers):
+        results = []
+        for (card_id, _), schedule in zip(answers, self.manager.record_reviews(answers)):
+            if schedule is None:
+                results.append({'card_id': card_id, 'recorded': False})
+            else:
+                results.append({'card_id': card_id, 'recorded': True, 'interval': schedule.interval, 'due': schedule.due})
+        return results
+
+    # audio
+
+    async def get_audio(self, request):
+        try:
+            card_id = int(request.match_info['card_id'])
+        except ValueError:
+            raise error_response(web.HTTPNotFound, "no such card") from None
+        if not 0 < card_id <= MAX_ID:
+            raise error_response(web.HTTPNotFound, "no such card")
+        side = request.query.get('side', 'term')
+        if side not in ('term', 'definition'):
+            raise error_response(web.HTTPBadRequest, "side must be term or definition")
+        language = request.query.get('language', 'en')
+        if not await self.supports_language(language):
+            raise error_response(web.HTTPBadRequest, f"language {language!r} is not supported")
+        slow = query_flag(request, 'slow')
+
+        card = await self.run_db(self.manager.get_card, card_id)
+        if card is None:
+            raise error_response(web.HTTPNotFound, "no such card")
+        text = card.term if side == 'term' else card.definition
+        if not text:
+            raise error_response(web.HTTPNotFound, f"the card has no {side}")
+
+        path = await self.share(self._synthesizing, (text, language, slow), lambda: self._synthesize(text, language, slow))
+        # clips never change, so clients can keep them
+        return web.FileResponse(path, headers={'Cache-Control': 'max-age=86400'})
+
+    async def supports_language(self, language):
+        if self.languages is not None:
+            return language in self.languages
+        if self._backend_languages is None:
+            from tts_backends import get_backend
+
+            # espeak asks its executable, so don't wait for it on the event loop
+            backend = get_backend(self.tts_backend)
+            self._backend_languages = asyncio.get_running_loop().run_in_executor(self.tts_executor, backend.languages)
+        future = self._backend_languages
+        try:
+            languages = await asyncio.shield(future)
+        except Exception:
+            # ask the backend again on the next request
+            if self._backend_languages is future:
+                self._backend_languages = None
+            raise
+        return languages is None or language in languages
+
+    async def _synthesize(self, text, language, slow):
+        try:
+            speaker = self._speakers.get((language, slow))
+            if speaker is None:
+                from text_to_speech import TextToSpeech
+
+                speaker = self._speakers[(language, slow)] = TextToSpeech(language, slow, backend=self.tts_backend,
+                                                                          cache=self.audio_cache)
+                while len(self._speakers) > MAX_SPEAKERS:
+                    self._speakers.popitem(last=False)
+            else:
+                self._speakers.move_to_end((language, slow))
+            return await asyncio.get_running_loop().run_in_executor(self.tts_executor, speaker.audio_path, text)
+        finally:
+            self._synthesizing.pop((text, language, slow), None)
+
+    async def close(self, app=None):
+        self.db_executor.shutdown(wait=False, cancel_futures=True)
+        self.write_executor.shutdown(wait=True)
+        self.tts_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_app(manager: DatabaseManager, **options) -> web.Application:
+    """
+    The aiohttp application serving manager's database. options are passed to StudyServer.
+    """
+    server = StudyServer(manager, **options)
+    app = web.Application(middlewares=[metrics_middleware])
+    app.add_routes(server.routes())
+    app.on_cleanup.append(server.close)
+    app['server'] = server
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=DEFAULT_HOST, help="address to listen on. 0.0.0.0 serves the whole network")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--database', default=DATABASE_URL, help="database URL")
+    parser.add_argument('--tts-backend', default=None, help="text to speech backend. See tts_backends")
+    parser.add_argument('--languages', default=None,
+                        help="comma separated languages audio can be asked for. Defaults to every language of the backend")
+    args = parser.parse_args()
+
+    manager = DatabaseManager(args.database)
+    manager.ensure_db_upgraded()
+    languages = [language.strip() for language in args.languages.split(',')] if args.languages else None
+    web.run_app(create_app(manager, tts_backend=args.tts_backend, languages=languages), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
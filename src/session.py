@@ -0,0 +1,259 @@
+"""
+State of a flashcard study session, independent of any user interface.
+
+A StudySession knows which card is shown, which side of it is up, when the next autoflip
+is due and how answers are recorded. FlashcardFrame and the terminal study mode (study.py)
+are views which call its methods and redraw from its state. Nothing here imports tkinter,
+PIL or the text to speech modules.
+"""
+
+from collections import deque
+import random
+import time
+from typing import Callable, NamedTuple, Optional, Sequence
+
+from metrics import observe
+
+AUTOFLIP_HISTORY = 1000  # autoflips whose lateness is kept for autoflip_jitter()
+
+
+class AutoflipJitter(NamedTuple):
+    """
+    How late autoflips happened after they were due, in seconds
+    """
+    count: int
+    median: float
+    p95: float
+    max: float
+
+
+class StudySession:
+    """
+    One pass through a deck of cards.
+
+    cards can be any sequence of objects with id, term and definition, such as a list of
+    CardRecords or a DeckCursor. Autoflip times are measured with clock, which defaults to
+    time.monotonic so that changes to the system clock don't affect them.
+
+    Autoflips are a stream of deadlines: each one is due autoflip_interval after the one
+    before, however late that one was carried out, so hands-free sessions keep their pace
+    instead of drifting by the time taken to draw each card. Flipping, moving or resuming
+    by hand starts the interval again from then.
+    """
+
+    def __init__(
+        self,
+        cards: Sequence,
+        random_order=False,
+        definition_first=False,
+        autoflip=False,
+        autoflip_interval: float = 0,
+        record_answer: Callable[[int, bool], object] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.cards = cards
+        # decks opened from the database are already in random order when asked for
+        if random_order and isinstance(self.cards, list):
+            random.shuffle(self.cards)
+
+        self.definition_first = definition_first
+        self.autoflip = autoflip
+        self.autoflip_interval = autoflip_interval  # seconds
+        self.record_answer = record_answer  # called with (card id, knew it) when a card is answered
+        self.clock = clock
+
+        self.position = -1  # index of the current card. -1 until the first card is shown
+        self.is_flipped = False  # whether the back of the current card is showing
+        self.revealed = False  # whether the back of the current card has been shown at all
+        self.finished = False
+        self.answers = 0
+
+        self.paused = False
+        self.autoflip_deadline: Optional[float] = None  # clock time at which the next autoflip is due
+        self.autoflip_remaining: Optional[float] = None  # seconds left on the autoflip when it was paused
+        self.autoflip_lateness = deque(maxlen=AUTOFLIP_HISTORY)  # seconds each recent autoflip was late by
+
+    def __len__(self):
+        return len(self.cards)
+
+    @property
+    def current_card(self):
+        return self.cards[self.position] if 0 <= self.position < len(self.cards) else None
+
+    @property
+    def current_text(self) -> str:
+        """
+        Text on the side of the current card which is showing
+        """
+        card = self.current_card
+        if card is None:
+            return ''
+        return card.term if self.showing_term else card.definition
+
+    @property
+    def showing_term(self) -> bool:
+        # the front is the term, unless definitions are shown first
+        return self.is_flipped == self.definition_first
+
+    @property
+    def progress(self) -> str:
+        """
+        e.g. "3/20". Counts from 1
+        """
+        return f"{self.position + 1}/{len(self.cards)}"
+
+    @property
+    def can_answer(self) -> bool:
+        return self.record_answer is not None and self.revealed
+
+    def next(self) -> bool:
+        """
+        Move to the next card, front side up. Returns False, and finishes the session, if
+        there are no more cards.
+        """
+        if self.position + 1 >= len(self.cards):
+            self.finish()
+            return False
+        self.position += 1
+        self.is_flipped = self.revealed = False
+        self._schedule_autoflip()
+        return True
+
+    def back(self) -> bool:
+        """
+        Move to the previous card, front side up. Returns False if already on the first card.
+        """
+        if self.position <= 0:
+            return False
+        self.position -= 1
+        self.is_flipped = self.revealed = False
+        self._schedule_autoflip()
+        return True
+
+    def flip(self):
+        """
+        Turn the current card over, restarting the autoflip timer. Once the back is showing,
+        the autoflip moves on to the next card.
+        """
+        self.is_flipped = not self.is_flipped
+        if self.is_flipped:
+            self.revealed = True
+        self._schedule_autoflip()
+
+    def answer(self, knew: bool) -> bool:
+        """
+        Record whether the current card was known and move on to the next one. Returns the
+        result of next().
+        """
+        if self.record_answer is not None and self.current_card is not None:
+            self.record_answer(self.current_card.id, knew)
+            self.answers += 1
+        return self.next()
+
+    def finish(self):
+        self.finished = True
+        self.autoflip_deadline = None
+        self.autoflip_remaining = None
+
+    def upcoming_cards(self, count: int) -> list:
+        return list(self.cards[self.position + 1:self.position + 1 + count])
+
+    def upcoming_texts(self, lookahead: int) -> list[str]:
+        """
+        Text which may be shown next, in the order it will most likely be needed: the other
+        side of the current card, then both sides of the next lookahead cards
+        """
+        texts = []
+        card = self.current_card
+        if card is not None:
+            texts.append(card.definition if self.showing_term else card.term)
+        for card in self.upcoming_cards(lookahead):
+            texts.extend((card.term, card.definition) if not self.definition_first else (card.definition, card.term))
+        return texts
+
+    # autoflip
+
+    def _schedule_autoflip(self):
+        self.autoflip_remaining = None
+        if self.autoflip and not self.paused and not self.finished:
+            self.autoflip_deadline = self.clock() + self.autoflip_interval
+        else:
+            self.autoflip_deadline = None
+
+    def time_until_autoflip(self) -> Optional[float]:
+        """
+        Seconds until the next autoflip is due, 0 if it is overdue, or None if none is
+        scheduled
+        """
+        if self.autoflip_deadline is None:
+            return None
+        return max(0.0, self.autoflip_deadline - self.clock())
+
+    def autoflip_action(self) -> str:
+        """
+        What the next autoflip does: 'flip' to show the back, or 'next' once it is showing
+        """
+        return 'next' if self.is_flipped else 'flip'
+
+    def run_autoflip(self) -> Optional[str]:
+        """
+        Carry out the autoflip if it is due. Returns 'flip' if the back is now showing, 'next'
+        if the session moved on (or finished, see finished), or None if nothing was due yet,
+        in which case time_until_autoflip() says how much longer to wait.
+        """
+        if self.autoflip_deadline is None:
+            return None
+        now = self.clock()
+        lateness = now - self.autoflip_deadline
+        if lateness < 0:
+            return None
+        self.autoflip_lateness.append(lateness)
+        observe('session.autoflip_lateness', lateness)
+
+        # the next deadline follows on from this one. After a stall of a whole interval or more,
+        # e.g. while the computer was asleep, it starts from now rather than catching up at once
+        start = self.autoflip_deadline if lateness < self.autoflip_interval else now
+        action = self.autoflip_action()
+        if action == 'flip':
+            self.flip()
+        else:
+            self.next()
+        if self.autoflip_deadline is not None:
+            self.autoflip_deadline = start + self.autoflip_interval
+        return action
+
+    def autoflip_jitter(self) -> Optional[AutoflipJitter]:
+        """
+        Lateness of the last AUTOFLIP_HISTORY autoflips, or None if there haven't been any
+        """
+        if not self.autoflip_lateness:
+            return None
+        lateness = sorted(self.autoflip_lateness)
+        p95 = lateness[min(len(lateness) - 1, int(len(lateness) * 0.95))]
+        return AutoflipJitter(len(lateness), lateness[len(lateness) // 2], p95, lateness[-1])
+
+    def pause(self):
+        if self.paused:
+            return
+        self.paused = True
+        if self.autoflip_deadline is not None:
+            self.autoflip_remaining = max(0.0, self.autoflip_deadline - self.clock())
+            self.autoflip_deadline = None
+
+    def resume(self):
+        """
+        Continue autoflipping where it left off when it was paused
+        """
+        if not self.paused:
+            return
+        self.paused = False
+        if self.autoflip and not self.finished:
+            remaining = self.autoflip_remaining if self.autoflip_remaining is not None else self.autoflip_interval
+            self.autoflip_deadline = self.clock() + remaining
+        self.autoflip_remaining = None
+
+    def toggle_pause(self):
+        if self.paused:
+            self.resume()
+        else:
+            self.pause()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""
+Study flashcards in the terminal.
+
+Only the session engine and the database layer are loaded, not tkinter, PIL or the text to
+speech modules, so this starts much faster than the window.
+
+Usage (from the src folder):
+    python study.py --list
+    python study.py [--set NAME_OR_ID ...] [--course NAME] [--random] [--definition-first] [--due]
+    python study.py --search QUERY
+
+While studying, press enter to flip the card and enter again to go to the next one.
+Other commands: b (back), f (flip), y (knew it), n (didn't know), q (quit).
+"""
+
+import argparse
+from pathlib import Path
+import sys
+
+from database.manager import DATABASE_URL, DatabaseManager
+from session import StudySession
+
+CSV_FOLDER = Path(__file__).parent / 'csv_flashcard_files'
+
+DUE_DECK_SIZE = 200  # most cards studied in a single spaced repetition session
+SEARCH_DECK_SIZE = 500  # most cards studied from a single search
+
+
+def select_sets(summaries, names_or_ids, course):
+    """
+    Ids of the sets matching any of names_or_ids (set names, case insensitive, or ids) and
+    course. All sets if neither is given.
+    """
+    wanted = {name.lower() for name in names_or_ids or ()}
+    selected = []
+    for summary in summaries:
+        if wanted and summary.name.lower() not in wanted and str(summary.id) not in wanted:
+            continue
+        if course is not None and (summary.course_name or '').lower() != course.lower():
+            continue
+        selected.append(summary.id)
+    return selected
+
+
+def print_sets(summaries):
+    print(f"{'id':>6}  {'cards':>7}  name")
+    for summary in summaries:
+        course = f"  ({summary.course_name})" if summary.course_name else ''
+        print(f"{summary.id:>6}  {summary.included_count:>7}  {summary.name}{course}")
+
+
+def prompt(session: StudySession) -> str:
+    if not session.revealed:
+        return "[enter] flip  [b]ack  [q]uit > "
+    if session.can_answer:
+        return "[y] knew it  [n] didn't know  [enter] next  [f]lip  [b]ack  [q]uit > "
+    return "[enter] next  [f]lip  [b]ack  [q]uit > "
+
+
+def run(session: StudySession, read=input, write=print):
+    """
+    Present every card of session until it is finished or the user quits
+    """
+    session.next()
+    show_card = True
+    while not session.finished:
+        if show_card:
+            write(f"\n[{session.progress}] {session.current_text}")
+        try:
+            command = read(prompt(session)).strip().lower()
+        except (EOFError, KeyboardInterrupt):
+            command = 'q'
+
+        show_card = True
+        if command == 'q':
+            session.finish()
+        elif command == 'b':
+            show_card = session.back()
+        elif command == 'f' or (command == '' and not session.revealed):
+            session.flip()
+        elif command in ('y', 'n') and session.can_answer:
+            session.answer(command == 'y')
+        elif command == '':
+            session.next()
+        else:
+            show_card = False
+
+    write(f"\nStudied {session.position + 1} of {len(session)} cards" + (f", {session.answers} answered" if session.answers else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--list', action='store_true', help="list the flashcard sets and exit")
+    parser.add_argument('--set', dest='sets', action='append', metavar='NAME_OR_ID', help="set to study. May be repeated")
+    parser.add_argument('--course', default=None, help="only study sets of this course")
+    parser.add_argument('--search', default=None, help="study the cards matching a search instead")
+    parser.add_argument('--due', action='store_true', help="only study cards which are due for review")
+    parser.add_argument('--random', action='store_true', help="present the cards in random order")
+    parser.add_argument('--definition-first', action='store_true', help="show the definition before the term")
+    parser.add_argument('--no-record', action='store_true', help="don't record answers for spaced repetition")
+    parser.add_argument('--no-sync', action='store_true', help="don't import changes from the CSV flashcard folder first")
+    parser.add_argument('--database', default=DATABASE_URL, help="database URL")
+    args = parser.parse_args()
+
+    manager = DatabaseManager(args.database)
+    manager.ensure_db_upgraded()
+    if not args.no_sync and CSV_FOLDER.is_dir():
+        manager.sync_csv_folder(CSV_FOLDER)
+
+    summaries = manager.get_set_summaries()
+    if args.list:
+        print_sets(summaries)
+        return
+
+    if args.search is not None:
+        cards = manager.search_cards(args.search, limit=SEARCH_DECK_SIZE)
+    else:
+        set_ids = select_sets(summaries, args.sets, args.course)
+        if not set_ids:
+            sys.exit("No flashcard sets match. Use --list to see them")
+        if args.due:
+            cards = manager.get_due_cards(set_ids, limit=DUE_DECK_SIZE)
+        else:
+            cards = manager.open_deck(set_ids, random_order=args.random)
+
+    if not cards:
+        sys.exit("No cards to study")
+
+    session = StudySession(
+        cards,
+        random_order=args.random,
+        definition_first=args.definition_first,
+        record_answer=None if args.no_record else manager.record_review,
+    )
+    run(session)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,91 @@
 """
-Use the google text to speech library to read content. Provide an easy-to-use interface
-so that the library could be changed in the future.
+Read content aloud. Synthesis is done by one of the backends in tts_backends (google text
+to speech by default) and playback by pygame, behind an easy-to-use interface.
 """
 
-from io import BytesIO
+import shutil
+import sys
+import time
 
-import pygame
-from gtts import gTTS
+from audio_cache import AudioCache, get_default_cache
+from audio_packs import AudioPackLibrary, get_default_packs
+from metrics import count, timed, timer
+from tts_backends import TTSBackend, get_backend
 
 
 class TextToSpeech:
-    def __init__(self, language: str = 'en', slow: bool = False):
+    def __init__(self, language: str = 'en', slow: bool = False, backend: TTSBackend | str = None, cache: AudioCache = None,
+                 packs: AudioPackLibrary = None):
+        """
+        backend is a TTSBackend instance or the name of a registered backend. Synthesis only
+        happens when a clip is neither in the cache nor in an audio pack (see audio_packs).
+        """
         self.language = language
         self.slow = slow
+        self.backend = backend if backend is not None and not isinstance(backend, str) else get_backend(backend)
+        self.cache = cache if cache is not None else get_default_cache()
+        self.packs = packs if packs is not None else get_default_packs()
 
-    def save(self, text, file_path: str):
-        tts = gTTS(text=text, lang=self.language, slow=False)
-        tts.save(file_path)
+    def audio_path(self, text):
+        """
+        Path of the audio file for the given text, synthesizing it if it isn't cached yet
+        """
+        key = self.cache.key(text, self.language, self.slow, backend=self.backend.name, extension=self.backend.extension)
+        path = self.cache.get(key)
+        if path is not None:
+            count('tts.cache_hits')
+            return path
 
-    def play(self, text):
+        count('tts.cache_misses')
+        # pygame plays files, so a clip rendered ahead of time is copied into the cache
+        data = self.packs.read(key)
+        if data is not None:
+            count('tts.pack_hits')
+            return self.cache.put(key, data)
+
+        with timer('tts.synthesize', backend=self.backend.name):
+            data = self.backend.synthesize(text, self.language, self.slow)
+        return self.cache.put(key, data)
+
+    def save(self, text, file_path: str):
+        shutil.copyfile(self.audio_path(text), file_path)
 
-        tts = gTTS(text=text, lang=self.language, slow=False)
+    @timed('tts.start_playback')
+    def start(self, path):
+        """
+        Start playing an audio file without waiting for it to finish
+        """
+        # pygame takes a noticeable time to import, so it is only loaded once something is played
+        import pygame
 
-        with BytesIO() as fp:
-            fp.seek(0)
-            tts.write_to_fp(fp)
-            # play the audio
-            fp.seek(0)
+        if not pygame.mixer.get_init():
             pygame.mixer.init()
-            pygame.mixer.music.load(fp)
-            pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():  # Wait for audio to finish playing
-                pygame.time.Clock().tick(10)  # You can adjust the tick rate as needed
+        pygame.mixer.music.load(str(path))
+        pygame.mixer.music.play()
+
+    @staticmethod
+    def _mixer():
+        """
+        The pygame mixer if anything has been played yet, otherwise None
+        """
+        pygame = sys.modules.get('pygame')
+        if pygame is None or not pygame.mixer.get_init():
+            return None
+        return pygame.mixer
+
+    def stop(self):
+        mixer = self._mixer()
+        if mixer is not None:
+            mixer.music.stop()
+
+    def is_busy(self):
+        mixer = self._mixer()
+        return mixer is not None and mixer.music.get_busy()
+
+    def play(self, text):
+        """
+        Play the text and block until it has finished
+        """
+        self.start(self.audio_path(text))
+        while self.is_busy():  # Wait for audio to finish playing
+            time.sleep(0.1)
@@ -0,0 +1,162 @@
+"""
+Speech synthesis engines used by TextToSpeech. Every engine implements the TTSBackend
+protocol and registers itself by name, so the engine can be chosen per machine with the
+FLASHCARD_TTS_BACKEND environment variable.
+"""
+
+import importlib.util
+from io import BytesIO
+import os
+import shutil
+import subprocess
+import wave
+from typing import Optional, Protocol
+
+DEFAULT_BACKEND = 'gtts'
+BACKEND_ENV_VAR = 'FLASHCARD_TTS_BACKEND'
+
+
+class TTSBackend(Protocol):
+    """
+    Turns text into audio data which pygame can play
+    """
+
+    name: str
+    extension: str  # file extension of the audio format produced e.g. '.mp3'
+
+    def is_available(self) -> bool:
+        ...
+
+    def languages(self) -> Optional[set[str]]:
+        """
+        Codes of the languages synthesize accepts, or None if it accepts any
+        """
+        ...
+
+    def synthesize(self, text: str, language: str, slow: bool) -> bytes:
+        ...
+
+
+BACKENDS: dict[str, type] = {}
+
+
+def register_backend(cls):
+    """
+    Class decorator which makes a backend available through get_backend
+    """
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+def get_backend(name: str = None) -> TTSBackend:
+    """
+    Create the backend with the given name. If no name is given, the backend named by the
+    FLASHCARD_TTS_BACKEND environment variable is used, falling back to google text to speech.
+    """
+    if name is None:
+        name = os.environ.get(BACKEND_ENV_VAR, DEFAULT_BACKEND)
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown text to speech backend '{name}'. Choose from: {', '.join(BACKENDS)}") from None
+
+
+def available_backends() -> list[str]:
+    """
+    Names of the registered backends which can be used on this machine
+    """
+    return [name for name, cls in BACKENDS.items() if cls().is_available()]
+
+
+@register_backend
+class GTTSBackend:
+    """
+    Google text to speech. Requires a network connection.
+    """
+
+    name = 'gtts'
+    extension = '.mp3'
+
+    def is_available(self):
+        # find the module without importing it, which is slow
+        return importlib.util.find_spec('gtts') is not None
+
+    def languages(self):
+        from gtts.lang import tts_langs
+
+        return set(tts_langs())
+
+    def synthesize(self, text, language, slow):
+        from gtts import gTTS
+
+        tts = gTTS(text=text, lang=language, slow=slow)
+        with BytesIO() as fp:
+            tts.write_to_fp(fp)
+            return fp.getvalue()
+
+
+@register_backend
+class EspeakBackend:
+    """
+    Offline synthesis using the espeak-ng (or espeak) command line program
+    """
+
+    name = 'espeak'
+    extension = '.wav'
+
+    words_per_minute = 175
+    slow_words_per_minute = 110
+
+    def __init__(self):
+        self.executable = shutil.which('espeak-ng') or shutil.which('espeak')
+
+    def is_available(self):
+        return self.executable is not None
+
+    def languages(self):
+        if not self.is_available():
+            return set()
+        result = subprocess.run([self.executable, '--voices'], check=True, capture_output=True, text=True)
+        # a table with a header row and the language of each voice in the second column
+        return {line.split()[1] for line in result.stdout.splitlines()[1:] if len(line.split()) > 1}
+
+    def synthesize(self, text, language, slow):
+        if not self.is_available():
+            raise RuntimeError("espeak-ng or espeak must be installed to use the espeak backend")
+
+        speed = self.slow_words_per_minute if slow else self.words_per_minute
+        result = subprocess.run(
+            [self.executable, '-v', language, '-s', str(speed), '--stdout', text],
+            check=True,
+            capture_output=True
+        )
+        return result.stdout
+
+
+@register_backend
+class NullBackend:
+    """
+    Produces a short silent clip without doing any synthesis. Useful for tests and for
+    measuring the overhead of everything other than synthesis.
+    """
+
+    name = 'null'
+    extension = '.wav'
+
+    sample_rate = 8000
+    duration = 0.1  # seconds
+
+    def is_available(self):
+        return True
+
+    def languages(self):
+        return None
+
+    def synthesize(self, text, language, slow):
+        with BytesIO() as fp:
+            with wave.open(fp, 'wb') as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(self.sample_rate)
+                wav.writeframes(b'\x00\x00' * int(self.sample_rate * self.duration))
+            return fp.getvalue()
@@ -5,16 +5,21 @@ Author: Ethan Posner
 Date: July 27, 2021
 """
 
+import math
 import os
 from pathlib import Path
-import random
-import time
+import threading
+from typing import Sequence
 
 import tkinter as tk
-from text_to_speech import TextToSpeech
-from PIL import Image, ImageTk
+from assets import ImageCache, get_default_image_cache
+from image_store import ImageStore, get_default_image_store
+import metrics
+from metrics import timed
+from read_aloud import ReadAloudWorker
+from session import StudySession
 
-from database.models import Flashcard
+from database.records import CardRecord
 
 
 class Root(tk.Tk):
@@ -22,10 +27,22 @@ class Root(tk.Tk):
     Main object which handles all frames (current display of widgets) for window
     """
 
+    search_deck_size = 500  # most cards studied from a single search
+    due_deck_size = 200  # most cards studied in a single spaced repetition session
+    flush_timeout = 5  # seconds to wait on QUIT for the session's answers to be written
+    sync_poll_interval = 200  # milliseconds between checks of whether a background sync has finished
+
     def __init__(
         self,
         get_flashcard_data_func,
+        get_flashcard_cards_func,
         image_path,
+        search_cards_func=None,
+        get_due_cards_func=None,
+        record_answer_func=None,
+        flush_writes_func=None,
+        open_deck_func=None,
+        sync_func=None,
         width=600,
         height=400,
         bg='#263238',
@@ -44,45 +61,84 @@ class Root(tk.Tk):
         self.item_selection_frame = None
         self.flashcard_series_frame = None
 
-        self.get_flashcard_data_func = get_flashcard_data_func
+        self.get_flashcard_data_func = get_flashcard_data_func  # returns a summary of each set
+        self.get_flashcard_cards_func = get_flashcard_cards_func  # returns the cards of the given set ids
+        self.search_cards_func = search_cards_func  # returns the cards matching a search query
+        self.get_due_cards_func = get_due_cards_func  # returns the cards of the given set ids which are due for review
+        self.record_answer_func = record_answer_func  # called with a card id and whether the answer was known
+        self.flush_writes_func = flush_writes_func  # waits for answers recorded in the background to be written
+        self.open_deck_func = open_deck_func  # returns a deck of the given set ids which is loaded as it is studied
+        self.sync_func = sync_func  # brings the database up to date with the flashcard sources. May be slow
+        self._sync_thread = None
+        self._sync_error = None
         self.image_path = image_path
 
+        self.bind_all('<F12>', self.toggle_profiling)
+
+    def toggle_profiling(self, event=None):
+        """
+        Start or stop profiling the app. The stats are saved to the metrics folder when it stops
+        """
+        path = metrics.toggle_profiling()
+        if path is not None:
+            print(f"Profile saved to {path}")
+
     def goto_main(self):
+        if self.flush_writes_func is not None:
+            # the next session may be of due cards, which depends on the answers of this one
+            self.flush_writes_func(timeout=self.flush_timeout)
         self.update_list()
 
+    @timed('ui.start_button_press')
     def start_button_press(self):
-        cards_to_present: list[Flashcard] = []
-
-        # determine which sets have been selected using check marks and append them to the selected_sets list accordingly
-        selected_sets_values: dict[str: bool] = self.item_selection_frame.enable
+        # determine which sets have been selected using check marks. Only their cards are loaded
+        selected_set_ids = [set.id for set in self.flashcard_sets if set.id in self.item_selection_frame.selected_ids]
+
+        if not selected_set_ids:
+            cards_to_present: list[CardRecord] = []
+        elif self.get_due_cards_func is not None and self.item_selection_frame.due_only.get():
+            cards_to_present = self.get_due_cards_func(selected_set_ids, limit=self.due_deck_size)
+        elif self.open_deck_func is not None:
+            # large selections are paged in from the database instead of being loaded all at once
+            cards_to_present = self.open_deck_func(selected_set_ids, random_order=self.item_selection_frame.randomize.get())
+        else:
+            cards_to_present = self.get_flashcard_cards_func(selected_set_ids)
 
-        for set in self.flashcard_sets:
-            if selected_sets_values[set.name].get():
-                for card in set.flashcards:
-                    if not card.exclude:
-                        cards_to_present.append(card)
+        # if any sets are selected, present the first card
+        if cards_to_present:
+            self.start_flashcards(cards_to_present, **self.session_options())
 
-        # retreive all custom settings. These are retrieved through tkinter Booleanvars which are associated with whether the checkbuttons are checked
-        random_order = self.item_selection_frame.randomize
-        read_aloud = self.item_selection_frame.read_aloud.get()  # whether or not to read each card out loud when it is presented
-        definition_first = self.item_selection_frame.reverse_order.get()
-        autoflip = self.item_selection_frame.autoflip.get()
-        autoflip_interval = float(self.item_selection_frame.autoflip_interval_box.get())
+    @timed('ui.search_button_press')
+    def search_button_press(self, query):
+        """
+        Build a deck out of the cards matching the search query, best matches first, and start
+        presenting it
+        """
+        if self.search_cards_func is None:
+            return
 
-        # if any sets are selected, present the first card
+        cards_to_present = self.search_cards_func(query, limit=self.search_deck_size)
+        self.item_selection_frame.show_search_result_count(len(cards_to_present))
         if cards_to_present:
-            self.start_flashcards(
-                cards_to_present,
-                random_order=random_order,
-                definition_first=definition_first,
-                autoflip=autoflip,
-                autoflip_interval=autoflip_interval,
-                read_aloud=read_aloud
-            )
+            self.start_flashcards(cards_to_present, **self.session_options())
+
+    def session_options(self):
+        """
+        Custom settings for the next session. These are retrieved through tkinter Booleanvars which are
+        associated with whether the checkbuttons are checked
+        """
+        return dict(
+            random_order=self.item_selection_frame.randomize.get(),
+            read_aloud=self.item_selection_frame.read_aloud.get(),  # whether or not to read each card out loud when it is presented
+            definition_first=self.item_selection_frame.reverse_order.get(),
+            autoflip=self.item_selection_frame.autoflip.get(),
+            autoflip_interval=float(self.item_selection_frame.autoflip_interval_box.get()),
+        )
 
+    @timed('ui.start_flashcards')
     def start_flashcards(
         self,
-        cards_to_present: list[Flashcard],
+        cards_to_present: Sequence[CardRecord],
         random_order=False,
         definition_first=False,
         read_aloud=False,
@@ -100,6 +156,7 @@ class Root(tk.Tk):
                 autoflip_interval=autoflip_interval,
                 read_aloud=read_aloud,
                 quit_cmd=self.goto_main,
+                record_answer_cmd=self.record_answer_func,
                 image_path=self.image_path
         )
 
@@ -109,24 +166,63 @@ class Root(tk.Tk):
         self.flashcard_series_frame.pack(fill="both", expand=True)
         self.flashcard_series_frame.next()
 
+    def reload(self):
+        """
+        Sync the flashcard sources on a background thread, so that a slow or unreachable
+        source doesn't freeze the window, and refresh the list of sets once it is done
+        """
+        if self.sync_func is None:
+            self.update_list()
+            return
+        if self._sync_thread is not None and self._sync_thread.is_alive():
+            return  # the list is refreshed when the running sync finishes
+        self._sync_thread = threading.Thread(target=self._run_sync, name='sync', daemon=True)
+        self._sync_thread.start()
+        self.after(self.sync_poll_interval, self._check_sync)
+
+    def _run_sync(self):
+        try:
+            self.sync_func()
+        except Exception as exception:
+            self._sync_error = exception
+
+    def _check_sync(self):
+        # tkinter isn't thread safe, so the sync thread is polled from here instead of calling back
+        if self._sync_thread.is_alive():
+            self.after(self.sync_poll_interval, self._check_sync)
+            return
+        if self._sync_error is not None:
+            print(f"Could not sync the flashcards: {self._sync_error}")
+            self._sync_error = None
+        # during a session the list is refreshed when it ends instead
+        if self.flashcard_series_frame is None or not self.flashcard_series_frame.winfo_ismapped():
+            self.update_list()
+
+    @timed('ui.update_list')
     def update_list(self):
         """
         Refresh the list of flashcard sets
         """
 
         self.flashcard_sets = self.get_flashcard_data_func()
-        flashcard_set_names = [set.name for set in self.flashcard_sets]
+        flashcard_set_items = [(set.id, f"{set.name} ({set.included_count})") for set in self.flashcard_sets]
 
+        # keep the sets which were checked before reloading checked
+        previously_selected = set()
         if self.item_selection_frame is not None:
-            self.item_selection_frame.pack_forget()
+            previously_selected = self.item_selection_frame.selected_ids
+            self.item_selection_frame.destroy()
         if self.flashcard_series_frame is not None:
             self.flashcard_series_frame.pack_forget()
 
         self.item_selection_frame = ItemSelectionFrame(
             self,
-            items=flashcard_set_names,
+            items=flashcard_set_items,
+            selected=previously_selected,
             start_command=self.start_button_press,
-            refresh_command=self.update_list,
+            refresh_command=self.reload,
+            search_command=self.search_button_press if self.search_cards_func else None,
+            show_due_option=self.get_due_cards_func is not None,
             bg=self.bg,
             font_type=self.font_type
         )
@@ -139,15 +235,19 @@ class Root(tk.Tk):
 
 class ItemSelectionFrame(tk.Frame):
     """
-    List of items to check off for selection
+    List of items to check off for selection. Items are (id, text) pairs and self.selected_ids
+    is the set of ids which have been checked.
     """
 
     def __init__(
         self,
         parent,
-        items=[], 
+        items=[],
+        selected=(),
         start_command=None,
         refresh_command=None,
+        search_command=None,
+        show_due_option=False,
         width=600,
         height=600,
         bg='#263238',
@@ -164,36 +264,24 @@ class ItemSelectionFrame(tk.Frame):
         self.list_items = items
         self.start_command = start_command
         self.refresh_command = refresh_command
+        self.search_command = search_command
 
-        # display all flashcard sets for selection
-        self.scrollable_item_selection = tk.Frame(self, width=400, height=600, bg='white')
-        self.scrollable_canvas = tk.Canvas(self.scrollable_item_selection, bg=self.bg, highlightthickness=0, width=400)
-        self.item_selection_scrollbar = tk.Scrollbar(self.scrollable_item_selection, orient='vertical',
-                                                     command=self.scrollable_canvas.yview, bg=bg)
-
-        # create a frame for the scrollable items to exist in and bind it to a command which changes their position as the scrollbar moves
-        self.scrollable_items_frame = tk.Frame(self.scrollable_canvas, width=0, height=0, bg=bg)
-        self.scrollable_items_frame.bind("<Configure>", lambda e: self.scrollable_canvas.configure(scrollregion=self.scrollable_canvas.bbox("all")))
-
-        # set up the scrolling canvas in the
-        self.scrollable_canvas.create_window((0, 0), window=self.scrollable_items_frame, anchor="nw")
-        self.scrollable_canvas.config(yscrollcommand=self.item_selection_scrollbar.set)
-
-        self.enable = {}
-        for i, list_item in enumerate(self.list_items):
-            self.enable[list_item] = tk.BooleanVar(value=False)
-            checkbox = tk.Checkbutton(
-                self.scrollable_items_frame, text=list_item, variable=self.enable[list_item], foreground='white', bg=self.bg,
-                onvalue=True, offvalue=False, font=(self.font_type, 15, 'normal'), selectcolor='black')
-            checkbox.grid(row=i, column=0, sticky=tk.W)
-
-        self.item_selection_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.scrollable_canvas.pack(side=tk.LEFT, fill="both", expand=True)
-        self.scrollable_item_selection.pack(padx=5, pady=5, side=tk.LEFT, fill="both", expand=True)
+        # display all flashcard sets for selection. Only the visible rows have widgets
+        self.item_list = VirtualCheckList(self, items=self.list_items, selected=selected, width=400, height=600,
+                                          bg=self.bg, font_type=self.font_type)
+        self.item_list.pack(padx=5, pady=5, side=tk.LEFT, fill="both", expand=True)
 
         # -- session customization -- #
         self.options_frame = tk.Frame(self, width=300, height=100, bg=self.bg)
 
+        # only study cards which are due according to the spaced repetition schedule
+        self.due_only = tk.BooleanVar()
+        if show_due_option:
+            self.due_only_checkbutton = tk.Checkbutton(self.options_frame, text="Due Cards Only", variable=self.due_only, foreground='white',
+                                                       bg=self.bg, onvalue=True, offvalue=False, font=(self.font_type, 15, 'normal'),
+                                                       selectcolor='black')
+            self.due_only_checkbutton.grid(row=0, column=1, sticky='w')
+
         self.read_aloud = tk.BooleanVar()
         self.read_aloud_checkbutton = tk.Checkbutton(self.options_frame, text="Read Text Aloud", variable=self.read_aloud, foreground='white',
                                                      bg=self.bg, onvalue=True, offvalue=False, font=(self.font_type, 15, 'normal'), selectcolor='black')
@@ -248,6 +336,45 @@ class ItemSelectionFrame(tk.Frame):
                                         background='grey25', command=self.refresh_command, font=(self.font_type, 15, 'bold'))
         self.refresh_button.place(relx=0.97, rely=1, anchor="se")
 
+        # search all cards and study the matches
+        if self.search_command is not None:
+            self.search_frame = tk.Frame(self, bg=self.bg)
+            self.search_text = tk.StringVar()
+            self.search_box = tk.Entry(self.search_frame, width=18, foreground='white', bg=self.bg, insertbackground='white',
+                                       font=(self.font_type, 15, 'normal'), textvariable=self.search_text)
+            self.search_box.bind('<Return>', lambda e: self.search_button_press())
+            self.search_box.grid(row=0, column=0, sticky='w')
+            self.search_button = tk.Button(self.search_frame, text='SEARCH', foreground='white', background='grey25',
+                                           command=self.search_button_press, font=(self.font_type, 15, 'bold'))
+            self.search_button.grid(row=0, column=1, sticky='w', padx=5)
+            self.search_result_text = tk.StringVar(value="")
+            self.search_result_label = tk.Label(self.search_frame, textvariable=self.search_result_text, foreground='white', bg=self.bg,
+                                                font=(self.font_type, 12, 'normal'))
+            self.search_result_label.grid(row=1, column=0, columnspan=2, sticky='w')
+            self.search_frame.place(relx=0.97, rely=0.02, anchor="ne")
+
+    def search_button_press(self):
+        """
+        Ran when self.search_button is pressed. Studies the cards matching the search box,
+        using the same input checks as the start button.
+        """
+        query = self.search_text.get().strip()
+        if not query:
+            return
+        try:
+            float(self.autoflip_interval_box.get())
+            self.autoflip_input_error_reset()
+            self.search_command(query)
+        except ValueError:
+            self.autoflip_input_error_alert()
+
+    def show_search_result_count(self, count):
+        self.search_result_text.set("No matching cards" if count == 0 else f"{count} matching cards")
+
+    @property
+    def selected_ids(self) -> set:
+        return self.item_list.selected
+
     def start_button_press(self):
         """
         Ran when self.start_button is pressed. Before continuing execution of the
@@ -276,22 +403,112 @@ class ItemSelectionFrame(tk.Frame):
         self.autoflip_border_color.config(background=self.bg)
 
 
+class VirtualCheckList(tk.Frame):
+    """
+    Scrollable list of checkbuttons which stays fast with any number of items.
+
+    Only enough checkbuttons to fill the visible area are created. As the list scrolls, they
+    are moved and given the text and checked state of the items which have come into view.
+    Which items are checked is kept in self.selected, a set of item ids.
+    """
+
+    def __init__(self, parent, items, selected=(), row_height=32, width=400, height=600, bg='#263238', font_type='consolas'):
+        tk.Frame.__init__(self, parent, width=width, height=height, bg='white')
+        self.items = items  # (id, text) pairs
+        self.selected = set(selected) & {item_id for item_id, _ in items}
+        self.row_height = row_height
+        self.bg = bg
+        self.font_type = font_type
+
+        self.canvas = tk.Canvas(self, bg=self.bg, highlightthickness=0, width=width, height=height,
+                                yscrollincrement=row_height, scrollregion=(0, 0, width, len(items) * row_height))
+        self.scrollbar = tk.Scrollbar(self, orient='vertical', command=self.canvas.yview, bg=bg)
+        self.canvas.config(yscrollcommand=self.on_scroll)
+
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill="both", expand=True)
+
+        # recycled widgets: each row is [checkbutton, variable, canvas window id, index of the item shown]
+        self.rows = []
+        self.canvas.bind('<Configure>', lambda e: self.refresh())
+        self.bind_mousewheel(self.canvas)
+
+    def bind_mousewheel(self, widget):
+        widget.bind('<MouseWheel>', lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, 'units'))
+        widget.bind('<Button-4>', lambda e: self.canvas.yview_scroll(-1, 'units'))
+        widget.bind('<Button-5>', lambda e: self.canvas.yview_scroll(1, 'units'))
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh()
+
+    def create_row(self):
+        variable = tk.BooleanVar(value=False)
+        row = [None, variable, None, -1]
+        checkbox = tk.Checkbutton(
+            self.canvas, variable=variable, foreground='white', bg=self.bg, activebackground=self.bg, anchor='w',
+            onvalue=True, offvalue=False, font=(self.font_type, 15, 'normal'), selectcolor='black',
+            command=lambda: self.toggle(row))
+        self.bind_mousewheel(checkbox)
+        row[0] = checkbox
+        row[2] = self.canvas.create_window((0, 0), window=checkbox, anchor='nw')
+        self.rows.append(row)
+
+    def toggle(self, row):
+        checkbox, variable, window, index = row
+        item_id = self.items[index][0]
+        if variable.get():
+            self.selected.add(item_id)
+        else:
+            self.selected.discard(item_id)
+
+    def refresh(self):
+        """
+        Show the items which are currently scrolled into view
+        """
+        visible_rows = self.canvas.winfo_height() // self.row_height + 2
+        while len(self.rows) < min(visible_rows, len(self.items)):
+            self.create_row()
+
+        first_index = int(self.canvas.canvasy(0) // self.row_height)
+        for offset, row in enumerate(self.rows):
+            checkbox, variable, window, index = row
+            index = first_index + offset
+            if index >= len(self.items):
+                self.canvas.itemconfigure(window, state='hidden')
+                row[3] = -1
+                continue
+            if row[3] != index:
+                item_id, text = self.items[index]
+                checkbox.config(text=text)
+                variable.set(item_id in self.selected)
+                self.canvas.coords(window, 0, index * self.row_height)
+                self.canvas.itemconfigure(window, state='normal')
+                row[3] = index
+
+
 class FlashcardFrame(tk.Frame):
     """
-    Frame which is used for presenting multiple flashcard frames
+    Frame which presents a study session one card at a time. What is shown is decided by a
+    session.StudySession; this frame draws its state and schedules its autoflips with Tk.
     """
 
     def __init__(
         self,
         parent,
-        cards: list[Flashcard],
+        cards: Sequence[CardRecord],
         image_path: os.PathLike,
         random_order=False,
         definition_first=False,
         quit_cmd=None,
+        record_answer_cmd=None,
         read_aloud=False,
         autoflip=False,
         autoflip_interval=0,
+        read_aloud_lookahead=3,
+        image_lookahead=3,
+        image_cache: ImageCache = None,
+        image_store: ImageStore = None,
         width=600,
         height=400,
         bg='#263238',
@@ -307,22 +524,31 @@ class FlashcardFrame(tk.Frame):
         self.bg = bg
         self.font_type = font_type
         self.image_path = image_path
-
-        self.cards = cards
+        self.image_cache = image_cache or get_default_image_cache()
+        self.image_store = image_store or get_default_image_store()
+        self.image_lookahead = image_lookahead  # number of upcoming cards whose images are decoded ahead of time
+        self.card_image = None  # keeps the image of the current card alive while it is shown
+
+        self.session = StudySession(
+            cards,
+            random_order=random_order,
+            definition_first=definition_first,
+            autoflip=autoflip,
+            autoflip_interval=autoflip_interval,
+            record_answer=record_answer_cmd,
+        )
+        self.cards = self.session.cards
 
         self.quit_cmd = quit_cmd
         self.read_aloud = read_aloud
-        self.definition_first = definition_first
-        self.autoflip = autoflip
-        self.autoflip_interval = autoflip_interval
+        self.read_aloud_lookahead = read_aloud_lookahead  # number of upcoming cards to synthesize ahead of time
         self.autoflip_job = None
-        self.definition_first = definition_first
 
         self.current_text = tk.StringVar(value="")  # term or definition
 
         self.card_label = tk.Label(self, textvariable=self.current_text, fg='white', bg=self.bg, font=(
-            self.font_type, 20, 'bold' if not self.definition_first else 'normal'),
-            justify='center', wraplength=800)
+            self.font_type, 20, 'bold' if not definition_first else 'normal'),
+            justify='center', wraplength=800, compound='top')
         self.card_label.pack(fill="x", expand=True)
 
         self.back_button = tk.Button(self, text="BACK", command=self.back, font=(self.font_type, 15, 'bold'))
@@ -330,148 +556,183 @@ class FlashcardFrame(tk.Frame):
 
         self.flip_button = tk.Button(self, text="FLIP", command=self.flip, font=(self.font_type, 15, 'bold'))
         self.flip_button.place(relx=0.5, rely=0.8, anchor="center")
-        self.is_flipped = False  # allows for user to flip back to the term after seeing the definition
 
         self.next_button = tk.Button(self, text="NEXT", command=self.next, font=(self.font_type, 15, 'bold'))
 
-        self.num_of_cards = len(self.cards)
-        self.current_card_num = -1  # since the presentation of cards hasn't started yet, -1 is the current card
-        self.current_card_text = tk.StringVar(value=f"{self.current_card_num}/{self.num_of_cards}")
+        # shown once the card has been flipped, so the answer can be recorded for spaced repetition
+        self.knew_button = tk.Button(self, text="KNEW IT", command=lambda: self.answer(True), font=(self.font_type, 15, 'bold'))
+        self.didnt_know_button = tk.Button(self, text="DIDN'T KNOW", command=lambda: self.answer(False), font=(self.font_type, 15, 'bold'))
+
+        self.num_of_cards = len(self.session)
+        self.current_card_text = tk.StringVar(value=self.session.progress)
         self.current_card_label = tk.Label(self, textvariable=self.current_card_text, font=(self.font_type, 15, 'bold'), fg='white',
                                            bg=self.bg)
         self.current_card_label.pack(side='top', anchor='ne', padx=10, pady=10)
 
-        self.quit_button = tk.Button(self, text="QUIT", foreground='white', background='grey25', command=quit_cmd, font=(self.font_type, 20, 'bold'))
+        self.quit_button = tk.Button(self, text="QUIT", foreground='white', background='grey25', command=self.exit_session,
+                                     font=(self.font_type, 20, 'bold'))
         self.quit_button.pack(side='top', anchor='ne', padx=10, pady=10)
 
-        self.pause_autoflip = False  # a pause button will be used for pausing autoflipping if enabled
-        if autoflip:
-            pause_icon = Image.open(Path(self.image_path) / 'pause_icon2.png')
-            pause_icon = ImageTk.PhotoImage(pause_icon.resize((50, 50)))
-            label = tk.Label(image=pause_icon)
-            label.image = pause_icon  # keep a reference of the image in the label
-            self.autoflip_pause_button = tk.Button(self, image=pause_icon, command=self.toggle_pause_autoflip,
+        if autoflip:  # a pause button is used for pausing autoflipping
+            self.autoflip_pause_icon = self.image_cache.photo(Path(self.image_path) / 'pause_icon2.png', (50, 50))
+            self.autoflip_pause_button = tk.Button(self, image=self.autoflip_pause_icon, command=self.toggle_pause_autoflip,
                                                    relief='raised', bd=3, background='grey25', compound='center', width=60, height=60)
             self.autoflip_pause_button.pack(side='top', anchor='nw', padx=10, pady=10)
 
-            # used to keep track of how much longer to wait after pausing and unpausing
-            self.autoflip_schedule_start = 0
-            self.autoflip_schedule_elapsed = 0
-
-        if random_order:
-            random.shuffle(self.cards)
-
         if self.read_aloud:
-            self.engine = TextToSpeech()
-            # voices = self.engine.getProperty('voices')
-            # self.engine.setProperty('voice', voices[1].id)
-            # self.engine.setProperty('rate', 220)
-            # self.engine.setProperty('volume', 0.5)
+            self.reader = ReadAloudWorker()
+
+    @property
+    def current_card(self):
+        return self.session.current_card
 
     def back(self):
         """
         Go to previous card. Activated if self.back_button is pressed
         """
-        if self.autoflip_job:  # if a previously created autoflip event still exists, cancel and delete it
-            self.winfo_toplevel().after_cancel(self.autoflip_job)
-            self.autoflip_job = None
-
-        if self.current_card_num > 0:  # don't want to go back on first card
-            self.is_flipped = False
-            self.next_button.place_forget()
-            self.current_card_num -= 1
-            self.current_card_text.set(f"{self.current_card_num+1}/{self.num_of_cards}")  # e.g. show that value with show as 1 instead of 0
-            self.card_label.config(font=(self.font_type, 20,  'bold' if not self.definition_first else 'normal'))
-
-            self.current_card = self.cards[self.current_card_num]
-            self.current_text.set(self.current_card.term if not self.definition_first else self.current_card.definition)
-            if self.read_aloud:
-                self.parent.update()
-                self.speak_text(self.current_card.term)
-
-            # set an event for flipping the card after the set interval if autoflip is enabled
-            if self.autoflip and not self.pause_autoflip:
-                self.autoflip_job = self.winfo_toplevel().after(int(self.autoflip_interval*1000), self.flip if not self.is_flipped else self.next)
-                self.autoflip_schedule_start = time.time() * 1000
-                self.autoflip_schedule_elapsed = 0
+        if self.session.back():  # doesn't go back from the first card
+            self.show_card()
 
     def flip(self):
         """
-        Handles packing and pack_forgetting of various widgets, as well as changing text.
-
-        Also handles text to speech of the current card, as well as cancelling an autoflip event if the user flipped before it was issued
+        Turn the current card over. The first time the back is shown, the buttons for moving
+        on and recording the answer appear
         """
+        self.session.flip()
+        self.show_side()
+
+    def next(self):
+        # Quit if no more cards are left. Otherwise, show the next card
+        if self.session.next():
+            self.show_card()
+        else:
+            self.exit_session()
 
-        if not self.is_flipped:
-            self.is_flipped = True
-            self.current_text.set(self.current_card.definition if not self.definition_first else self.current_card.term)
-            self.card_label.config(font=(self.font_type, 20, 'normal' if not self.definition_first else 'bold'))
+    def answer(self, knew):
+        """
+        Record whether the user knew the current card, then move on to the next one
+        """
+        if self.session.answer(knew):
+            self.show_card()
+        else:
+            self.exit_session()
 
-            self.next_button.place(relx=0.6, rely=0.8, anchor="center")  # insert the "next card" button
+    @timed('ui.show_card')
+    def show_card(self):
+        """
+        Draw the current card of the session, front side up
+        """
+        self.current_card_text.set(self.session.progress)
+        self.show_card_image()
+        self.show_side()
 
-            if self.autoflip_job:  # see if the autoflip job exists. If so, cancel it
-                self.winfo_toplevel().after_cancel(self.autoflip_job)
-                self.autoflip_job = None
+    @timed('ui.show_side')
+    def show_side(self):
+        """
+        Draw the side of the current card which is up, read it out loud if enabled and
+        schedule the next autoflip
+        """
+        self.current_text.set(self.session.current_text)
+        self.card_label.config(font=(self.font_type, 20, 'bold' if self.session.showing_term else 'normal'))
 
-            if self.autoflip and not self.pause_autoflip:  # if autoflip is enabled, schedule another autoflip event
-                self.autoflip_job = self.winfo_toplevel().after(int(self.autoflip_interval*1000), self.next)
-                self.autoflip_schedule_start = time.time() * 1000
-                self.autoflip_schedule_elapsed = 0
-        else:  # if the card has already been flipped, flip back to the term
-            self.is_flipped = False
-            self.current_text.set(self.current_card.term if not self.definition_first else self.current_card.definition)
-            self.card_label.config(font=(self.font_type, 20, 'bold' if not self.definition_first else 'normal'))
+        if self.session.revealed:
+            self.next_button.place(relx=0.6, rely=0.8, anchor="center")  # insert the "next card" button
+            self.show_answer_buttons()
+        else:
+            self.next_button.place_forget()
+            self.hide_answer_buttons()
 
         if self.read_aloud:
-            self.parent.update()
-            self.speak_text(self.current_card.definition)
+            self.speak_text(self.session.current_text)
+        self.schedule_autoflip()
 
-    def next(self):
+    def show_answer_buttons(self):
+        if self.session.can_answer:
+            self.knew_button.place(relx=0.42, rely=0.92, anchor="center")
+            self.didnt_know_button.place(relx=0.58, rely=0.92, anchor="center")
 
-        if self.autoflip_job:  # if a previously created autoflip event still exists, cancel and delete it
+    def hide_answer_buttons(self):
+        self.knew_button.place_forget()
+        self.didnt_know_button.place_forget()
+
+    def schedule_autoflip(self):
+        """
+        Replace any pending autoflip event with one for when the session's next autoflip is due
+        """
+        self.cancel_autoflip()
+        delay = self.session.time_until_autoflip()
+        if delay is not None:
+            # rounded up, since after() firing a fraction of a millisecond early would only reschedule
+            self.autoflip_job = self.winfo_toplevel().after(math.ceil(delay * 1000), self.run_autoflip)
+
+    def cancel_autoflip(self):
+        if self.autoflip_job:  # see if the autoflip job exists. If so, cancel it
             self.winfo_toplevel().after_cancel(self.autoflip_job)
             self.autoflip_job = None
 
-        # Quit if no more cards are left
-        if self.current_card_num+1 >= len(self.cards):
-            self.quit_cmd()
-        else:  # Otherwise, prepare the next card
-            self.is_flipped = False
-            self.next_button.place_forget()
-            self.current_card_num += 1
-            self.current_card_text.set(f"{self.current_card_num+1}/{self.num_of_cards}")  # e.g. show that value with show as 1 instead of 0
-            self.card_label.config(font=(self.font_type, 20,  'bold' if not self.definition_first else 'normal'))
-
-            self.current_card = self.cards[self.current_card_num]
-            self.current_text.set(self.current_card.term if not self.definition_first else self.current_card.definition)
-            if self.read_aloud:
-                self.parent.update()
-                self.speak_text(self.current_card.term)
-
-            # set an event for flipping the card after the set interval if autoflip is enabled
-            if self.autoflip and not self.pause_autoflip:
-                self.autoflip_job = self.winfo_toplevel().after(int(self.autoflip_interval*1000), self.flip if not self.is_flipped else self.next)
-                self.autoflip_schedule_start = time.time() * 1000
-                self.autoflip_schedule_elapsed = 0
+    def run_autoflip(self):
+        self.autoflip_job = None
+        action = self.session.run_autoflip()
+        if action is None:
+            self.schedule_autoflip()  # woken before the deadline
+        elif action == 'flip':
+            self.show_side()
+        elif self.session.finished:
+            self.exit_session()
+        else:
+            self.show_card()
 
     def toggle_pause_autoflip(self):
-        if not self.pause_autoflip:
-            self.autoflip_pause_button.config(relief="sunken")
-            self.pause_autoflip = True
-            if self.autoflip_job:  # see if the autoflip job exists. If so, cancel it
-                self.winfo_toplevel().after_cancel(self.autoflip_job)
-                self.autoflip_job = None
-                self.autoflip_schedule_elapsed = time.time() * 1000 - self.autoflip_schedule_start
-        else:
-            self.autoflip_pause_button.config(relief="raised")
-            self.pause_autoflip = False
-            # start a new autoflip job starting where the last one left off
-            self.autoflip_job = self.winfo_toplevel().after(int(self.autoflip_interval*1000-self.autoflip_schedule_elapsed), self.flip)
-            self.autoflip_schedule_start = time.time() * 1000
-            self.autoflip_schedule_elapsed = 0
+        self.session.toggle_pause()
+        self.autoflip_pause_button.config(relief="sunken" if self.session.paused else "raised")
+        # pausing cancels the pending autoflip. Resuming continues where it left off
+        self.schedule_autoflip()
+
+    def exit_session(self):
+        """
+        Stop any speech and leave the flashcard session
+        """
+        self.cancel_autoflip()
+        self.session.finish()
+        if self.read_aloud:
+            self.reader.shutdown()
+        if self.quit_cmd:
+            self.quit_cmd()
+
+    def card_image_path(self, card):
+        """
+        Path of the card display sized thumbnail of the image attached to card, if any
+        """
+        if card.image_hash is None:
+            return None
+        return self.image_store.thumbnail(card.image_hash)
+
+    def show_card_image(self):
+        """
+        Show the image attached to the current card, and decode the images of the next few
+        cards in the background so that flipping to them doesn't stall
+        """
+        path = self.card_image_path(self.current_card)
+        try:
+            self.card_image = self.image_cache.photo(path) if path is not None else None
+        except OSError:
+            self.card_image = None  # unreadable image. Show the card without it
+        self.card_label.config(image=self.card_image or '')
+
+        self.image_cache.prefetch(self.card_image_path(card) for card in self.session.upcoming_cards(self.image_lookahead))
 
     def speak_text(self, text):
-        self.engine.play(text)
+        """
+        Speak text in the background, cutting off the previous card, and synthesize the text
+        of the upcoming cards so that they can be played without delay
+        """
+        self.reader.say(text, self.upcoming_texts())
+
+    def upcoming_texts(self):
+        """
+        Text which may be spoken next, in the order it will most likely be needed
+        """
+        return self.session.upcoming_texts(self.read_aloud_lookahead)
 
 
 class LoginFrame(tk.Frame):